@@ -0,0 +1,737 @@
+# llm_gateway.py
+"""
+Resilience wrapper for model calls, shared by the backends (identical copies
+live next to each main.py). Works with any SDK call passed in as a zero-arg
+function, with shortcuts for google-genai clients and for
+google-generativeai / Vertex GenerativeModel objects.
+
+Each call gets:
+  - an overall deadline (retries included),
+  - jittered exponential-backoff retries on retryable errors (429/5xx/timeouts),
+  - an optional hedged duplicate request once the primary has run longer than
+    the observed p95 latency,
+  - a circuit breaker that fails fast after repeated timeouts or server errors,
+  - optional single-flight coalescing: concurrent calls with the same
+    canonical inputs share one model call and its result,
+  - an optional per-model AIMD concurrency limiter with a bounded wait
+    queue, so bursts queue briefly or fail fast instead of piling 429s
+    onto the shared quota.
+
+AsyncLLMGateway gives the same behaviour to asyncio (ASGI) code, awaiting the
+SDKs' async calls instead of running them on worker threads.
+
+metrics_snapshot() returns stats for every gateway and limiter in the process.
+
+    python llm_gateway.py   # tail-latency and coalescing demo against stub models
+"""
+import json
+import time
+import asyncio
+import random
+import hashlib
+import threading
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "BadGateway", "Aborted",
+}
+
+# Attempts run on this pool so the caller can stop waiting at the deadline.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-gateway")
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayTimeout(GatewayError, TimeoutError):
+    pass
+
+
+class CircuitOpenError(GatewayError):
+    pass
+
+
+class LimiterRejected(GatewayError):
+    pass
+
+
+def is_retryable(exc):
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if type(exc).__name__ in RETRYABLE_NAMES:
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    try:
+        return int(code) in RETRYABLE_STATUS
+    except (TypeError, ValueError):
+        return False
+
+
+def is_overload(exc):
+    """Quota/rate-limit signals that should shrink the concurrency limit."""
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(exc, "code", None) == 429 or getattr(exc, "status_code", None) == 429
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one trial call through after reset_seconds."""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def cancel(self):
+        """
+        Call ended without saying anything about the model's health (rejected
+        locally, or a client error such as a bad request or a safety block);
+        neither success nor failure.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, success):
+        with self._lock:
+            self._trial_in_flight = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+            else:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._opened_at = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one model's quota. Each success under the latency
+    target adds 1/limit (about +1 per round of requests); a 429 or a slow call
+    multiplies the limit by backoff_ratio, at most once per decrease_interval. Callers over
+    the limit wait in a bounded queue; when the queue is full they are rejected
+    immediately.
+    """
+
+    def __init__(self, name, initial_limit=8, min_limit=1, max_limit=64, max_queue=32,
+                 latency_target=15.0, backoff_ratio=0.7, decrease_interval=1.0):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise LimiterRejected(f"{self.name}: concurrency queue full")
+            self.queued += 1
+            end = time.monotonic() + timeout
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise GatewayTimeout(f"{self.name}: timed out waiting for a concurrency slot")
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.queued -= 1
+
+    async def acquire_async(self, timeout):
+        """acquire() for event-loop callers: waits by polling with asyncio.sleep instead of blocking the thread."""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise LimiterRejected(f"{self.name}: concurrency queue full")
+            self.queued += 1
+        end = time.monotonic() + timeout
+        delay = 0.005
+        try:
+            while True:
+                await asyncio.sleep(min(delay, max(0.0, end - time.monotonic())))
+                with self._cond:
+                    if self.in_flight < int(self.limit):
+                        self.in_flight += 1
+                        return
+                    if time.monotonic() >= end:
+                        self.rejected += 1
+                        raise GatewayTimeout(f"{self.name}: timed out waiting for a concurrency slot")
+                delay = min(delay * 2, 0.1)
+        finally:
+            with self._cond:
+                self.queued -= 1
+
+    def try_acquire(self):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self, latency, overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or latency > self.latency_target:
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def abandon(self):
+        """Gives back a slot whose call never ran, without counting it towards the limit."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "queued": self.queued,
+                    "rejected": self.rejected, "decreases": self.decreases}
+
+
+_registry_lock = threading.Lock()
+_limiters = {}
+_gateways = []
+
+
+def limiter_for(name, **kwargs):
+    """The process-wide limiter for a model/quota name; every gateway on that model shares it."""
+    with _registry_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name, **kwargs)
+        return _limiters[name]
+
+
+def metrics_snapshot():
+    with _registry_lock:
+        gateways = list(_gateways)
+        limiters = dict(_limiters)
+    return {
+        "gateways": {g.name: g.stats() for g in gateways},
+        "limiters": {name: l.stats() for name, l in limiters.items()},
+    }
+
+
+def canonical_key(*parts):
+    """Stable hash of call inputs (model, contents, config); SDK objects fall back to str()."""
+    blob = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _model_name(model):
+    return getattr(model, "_model_name", None) or getattr(model, "model_name", None) or type(model).__name__
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs fn once per key among concurrent callers; the others wait for and share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, timeout=None):
+        """Returns (result, shared) where shared is True if another caller did the work."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise GatewayTimeout("timed out waiting for in-flight duplicate")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class LLMGateway:
+    def __init__(self, name, deadline=30.0, max_retries=2, base_backoff=0.5, max_backoff=4.0,
+                 hedge=False, min_hedge_delay=0.5, breaker=None, coalesce=False, limiter=None):
+        self.name = name
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.coalesce = coalesce
+        self.limiter = limiter
+        self._flights = SingleFlight()
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        with _registry_lock:
+            _gateways.append(self)
+
+    # ---- SDK shortcuts ----
+    def generate_genai(self, client, model, contents, config=None, deadline=None):
+        """google-genai: client.models.generate_content(...)"""
+        key = canonical_key(model, contents, config) if self.coalesce else None
+        return self.call(lambda: client.models.generate_content(model=model, contents=contents, config=config),
+                         deadline=deadline, key=key)
+
+    def generate(self, model, contents, deadline=None, **kwargs):
+        """google-generativeai / Vertex GenerativeModel: model.generate_content(...)"""
+        key = canonical_key(_model_name(model), contents, kwargs) if self.coalesce else None
+        return self.call(lambda: model.generate_content(contents, **kwargs), deadline=deadline, key=key)
+
+    # ---- core ----
+    def call(self, fn, deadline=None, key=None):
+        """
+        Runs fn() with deadline, retries, hedging and circuit breaking. Returns fn's result.
+        With a key, concurrent calls sharing that key are coalesced into one.
+        """
+        if key is None:
+            return self._call(fn, deadline)
+        result, shared = self._flights.do(key, lambda: self._call(fn, deadline), timeout=deadline or self.deadline)
+        if shared:
+            self._count("coalesced")
+        return result
+
+    def _call(self, fn, deadline):
+        if not self.breaker.allow():
+            self._count("circuit_rejected")
+            raise CircuitOpenError(f"{self.name}: circuit open")
+
+        self._count("calls")
+        end = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                self._count("timeouts")
+                self.breaker.record(False)
+                raise GatewayTimeout(f"{self.name}: deadline exceeded")
+            try:
+                result = self._attempt(fn, remaining)
+                self.breaker.record(True)
+                return result
+            except LimiterRejected:
+                self._count("rejected")
+                self.breaker.cancel()
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if not retryable or attempt >= self.max_retries:
+                    self._count("timeouts" if isinstance(e, GatewayTimeout) else "failures")
+                    self._record_failure(retryable)
+                    raise
+                attempt += 1
+                self._count("retries")
+                # full jitter backoff, never sleeping past the deadline
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1))))
+                time.sleep(max(0.0, min(backoff, end - time.monotonic())))
+
+    def _attempt(self, fn, timeout):
+        """One logical attempt: the primary request plus, if it runs past the hedge delay, one duplicate."""
+        start = time.monotonic()
+        if self.limiter:
+            self.limiter.acquire(timeout)
+        primary = _executor.submit(self._timed, fn)
+        pending = {primary}
+        hedge_delay = self.hedge_delay() if self.hedge else None
+        last_exc = None
+        while pending:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                raise GatewayTimeout(f"{self.name}: attempt timed out")
+            wait_for = timeout - elapsed
+            if hedge_delay is not None:
+                wait_for = min(wait_for, max(0.0, hedge_delay - elapsed))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        self._count("hedge_wins")
+                    return f.result()
+                last_exc = f.exception()
+            if not done and hedge_delay is not None:
+                hedge_delay = None  # hedge at most once per attempt
+                if self.limiter and not self.limiter.try_acquire():
+                    self._count("hedges_skipped")  # no spare quota for a duplicate
+                    continue
+                self._count("hedges")
+                pending.add(_executor.submit(self._timed, fn))
+        raise last_exc
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        overloaded = False
+        try:
+            result = fn()
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+            return result
+        except Exception as e:
+            overloaded = is_overload(e)
+            raise
+        finally:
+            if self.limiter:
+                self.limiter.release(time.monotonic() - start, overloaded)
+
+    def hedge_delay(self):
+        """Observed p95 latency (floored at min_hedge_delay); None until there are enough samples."""
+        with self._lock:
+            if len(self._latencies) < 20:
+                return None
+            ordered = sorted(self._latencies)
+        return max(self.min_hedge_delay, ordered[int(0.95 * (len(ordered) - 1))])
+
+    def _record_failure(self, retryable):
+        """
+        Only failures that say the model is unhealthy (timeouts, 5xx, 429) count
+        toward opening the circuit; one caller's bad requests must not open it
+        for everyone.
+        """
+        if retryable:
+            self.breaker.record(False)
+        else:
+            self._count("client_errors")
+            self.breaker.cancel()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["circuit"] = self.breaker.state
+        if self.limiter:
+            out["limiter"] = self.limiter.name
+        return out
+
+
+
+class AsyncLLMGateway(LLMGateway):
+    """
+    LLMGateway for asyncio code (the ASGI services). Same deadline, retry,
+    hedging, circuit-breaker and limiter behaviour, and the same stats, but
+    every method is a coroutine and model calls are the SDKs' async variants.
+    A losing hedge is cancelled rather than left running, and coalesced callers
+    await one shared task.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tasks = {}  # coalescing key -> in-flight asyncio.Task
+
+    async def generate_genai(self, client, model, contents, config=None, deadline=None):
+        """google-genai: await client.aio.models.generate_content(...)"""
+        key = canonical_key(model, contents, config) if self.coalesce else None
+        return await self.call(
+            lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+            deadline=deadline, key=key)
+
+    async def generate(self, model, contents, deadline=None, **kwargs):
+        """google-generativeai / Vertex GenerativeModel: await model.generate_content_async(...)"""
+        key = canonical_key(_model_name(model), contents, kwargs) if self.coalesce else None
+        return await self.call(lambda: model.generate_content_async(contents, **kwargs), deadline=deadline, key=key)
+
+    async def call(self, fn, deadline=None, key=None):
+        """Awaits fn() (a zero-arg function returning an awaitable) under the gateway's policies."""
+        if key is None:
+            return await self._call(fn, deadline)
+        task = self._tasks.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            task = asyncio.ensure_future(self._call(fn, deadline))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield: one caller giving up must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _call(self, fn, deadline):
+        if not self.breaker.allow():
+            self._count("circuit_rejected")
+            raise CircuitOpenError(f"{self.name}: circuit open")
+
+        self._count("calls")
+        end = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                self._count("timeouts")
+                self.breaker.record(False)
+                raise GatewayTimeout(f"{self.name}: deadline exceeded")
+            try:
+                result = await self._attempt(fn, remaining)
+                self.breaker.record(True)
+                return result
+            except LimiterRejected:
+                self._count("rejected")
+                self.breaker.cancel()
+                raise
+            except asyncio.CancelledError:
+                self.breaker.cancel()
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if not retryable or attempt >= self.max_retries:
+                    self._count("timeouts" if isinstance(e, GatewayTimeout) else "failures")
+                    self._record_failure(retryable)
+                    raise
+                attempt += 1
+                self._count("retries")
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1))))
+                await asyncio.sleep(max(0.0, min(backoff, end - time.monotonic())))
+
+    async def _attempt(self, fn, timeout):
+        start = time.monotonic()
+        if self.limiter:
+            await self.limiter.acquire_async(timeout)
+        started = set()  # tasks whose _timed has begun; from then on it releases their limiter slot
+        primary = asyncio.ensure_future(self._timed(fn, started))
+        pending = {primary}
+        hedge_delay = self.hedge_delay() if self.hedge else None
+        last_exc = None
+        try:
+            while pending:
+                elapsed = time.monotonic() - start
+                if elapsed >= timeout:
+                    raise GatewayTimeout(f"{self.name}: attempt timed out")
+                wait_for = timeout - elapsed
+                if hedge_delay is not None:
+                    wait_for = min(wait_for, max(0.0, hedge_delay - elapsed))
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is not primary:
+                            self._count("hedge_wins")
+                        return t.result()
+                    last_exc = t.exception()
+                if not done and hedge_delay is not None:
+                    hedge_delay = None
+                    if self.limiter and not self.limiter.try_acquire():
+                        self._count("hedges_skipped")
+                        continue
+                    self._count("hedges")
+                    pending.add(asyncio.ensure_future(self._timed(fn, started)))
+            raise last_exc
+        finally:
+            for t in pending:
+                t.cancel()  # losing hedge or timed-out attempt; _timed releases its limiter slot
+                if self.limiter and t not in started:
+                    self.limiter.abandon()  # cancelled before it ran, so _timed never will
+
+    async def _timed(self, fn, started):
+        started.add(asyncio.current_task())
+        start = time.monotonic()
+        overloaded = False
+        try:
+            result = await fn()
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            overloaded = is_overload(e)
+            raise
+        finally:
+            if self.limiter:
+                self.limiter.release(time.monotonic() - start, overloaded)
+
+# ------------------ Fault-injecting stub (demo / load tests) ------------------
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [self]
+
+
+class StubServerError(Exception):
+    code = 503
+
+
+class StubQuotaExceeded(Exception):
+    code = 429
+
+
+class QuotaStubModel:
+    """Stub that returns 429 whenever more than `quota` requests are in flight at once."""
+
+    def __init__(self, quota=4, latency=0.05):
+        self.quota = quota
+        self.latency = latency
+        self.in_flight = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            over = self.in_flight > self.quota
+            if over:
+                self.throttled += 1
+        try:
+            time.sleep(self.latency / 5 if over else self.latency)
+            if over:
+                raise StubQuotaExceeded("injected 429")
+            return StubResponse("ok")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FaultInjectingStubModel:
+    """
+    Stand-in for a GenerativeModel: mostly fast, with a slow tail and a share
+    of retryable 503s. Latencies are in seconds.
+    """
+
+    def __init__(self, latency=0.02, slow_latency=0.5, slow_rate=0.05, error_rate=0.05, reply="ok"):
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.slow_rate = slow_rate
+        self.error_rate = error_rate
+        self.reply = reply
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self.calls += 1
+        roll = random.random()
+        if roll < self.error_rate:
+            time.sleep(self.latency)
+            raise StubServerError("injected 503")
+        slow = roll < self.error_rate + self.slow_rate
+        time.sleep(self.slow_latency if slow else random.uniform(0.5, 1.5) * self.latency)
+        return StubResponse(self.reply)
+
+
+def _percentile(ordered, q):
+    return ordered[int(q * (len(ordered) - 1))] if ordered else float("nan")
+
+
+def _demo(calls=400, concurrency=16):
+    model = FaultInjectingStubModel()
+
+    def run(label, fn):
+        latencies, errors = [], 0
+        def one(_):
+            start = time.monotonic()
+            try:
+                fn()
+                return time.monotonic() - start, None
+            except Exception as e:
+                return time.monotonic() - start, e
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for latency, err in pool.map(one, range(calls)):
+                if err is None:
+                    latencies.append(latency)
+                else:
+                    errors += 1
+        latencies.sort()
+        print(f"{label:<22} p50={_percentile(latencies, 0.5) * 1000:6.1f}ms "
+              f"p95={_percentile(latencies, 0.95) * 1000:6.1f}ms p99={_percentile(latencies, 0.99) * 1000:6.1f}ms "
+              f"errors={errors}/{calls}")
+
+    run("bare generate_content", lambda: model.generate_content("hi"))
+    gateway = LLMGateway("demo", deadline=2.0, base_backoff=0.01, max_backoff=0.05,
+                         hedge=True, min_hedge_delay=0.03, breaker=CircuitBreaker(failure_threshold=50))
+    for _ in range(40):  # warm the latency window so hedging has a p95
+        try:
+            gateway.generate(model, "warmup")
+        except Exception:
+            pass
+    run("gateway (retry+hedge)", lambda: gateway.generate(model, "hi"))
+    print("gateway stats:", gateway.stats())
+
+    # 20 identical concurrent requests against a slow model: one paid call
+    slow_model = FaultInjectingStubModel(latency=0.3, slow_rate=0.0, error_rate=0.0)
+    coalescing = LLMGateway("demo_coalesce", deadline=5.0, coalesce=True)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        replies = list(pool.map(lambda _: coalescing.generate(slow_model, "same journal text").text, range(20)))
+    print(f"single-flight: {len(replies)} callers, {slow_model.calls} model call(s), stats={coalescing.stats()}")
+
+    # 64-request burst against a quota of 4 concurrent calls, with and without the limiter
+    for label, limiter in (("burst, no limiter", None),
+                           ("burst, AIMD limiter", AdaptiveLimiter("demo_quota", initial_limit=8, max_queue=64,
+                                                                   decrease_interval=0.05))):
+        quota_model = QuotaStubModel(quota=4)
+        gw = LLMGateway(f"demo_{label}", deadline=3.0, base_backoff=0.05, max_backoff=0.5,
+                        breaker=CircuitBreaker(failure_threshold=1000), limiter=limiter)
+        def one(_):
+            try:
+                gw.generate(quota_model, "hi")
+                return True
+            except Exception:
+                return False
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=64) as pool:
+            ok = sum(pool.map(one, range(64)))
+        print(f"{label:<22} ok={ok}/64 upstream_429s={quota_model.throttled} "
+              f"elapsed={time.monotonic() - start:.2f}s limiter={limiter.stats() if limiter else None}")
+
+
+if __name__ == "__main__":
+    _demo()
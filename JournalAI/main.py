@@ -1,11 +1,18 @@
 # analyze_journal.py
 import os
-import json
+import random
+import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 import firebase_admin
 from firebase_admin import credentials, auth, db as firebase_db
 from google import genai
+from structured_output import enum_field, parse_stats, parse_structured, schema_config
+from llm_gateway import LLMGateway, limiter_for, metrics_snapshot
+from tracing import span, install_flask, timing_snapshot
+from async_logging import setup_logging, log_stats
 
 # ---------- CONFIG ----------
 PROJECT_ID = os.environ.get("PROJECT_ID", "clario-f60b0")
@@ -13,6 +20,11 @@ LOCATION = os.environ.get("LOCATION", "us-central1")
 MODEL = os.environ.get("MODEL", "gemini-2.5-flash")
 RTDB_URL = os.environ.get("RTDB_URL", f"https://{PROJECT_ID}.firebaseio.com")
 
+# ---------- Logging ----------
+# Queue-backed JSON logs: request threads enqueue, a background thread writes stdout
+setup_logging()
+log = logging.getLogger("journal_ai")
+
 # ---------- Initialize Firebase Admin (Auth + RTDB) ----------
 # Use Application Default Credentials when deployed to GCP.
 if not firebase_admin._apps:
@@ -23,38 +35,64 @@ if not firebase_admin._apps:
 # ---------- Initialize Gemini Client (Vertex AI GenAI wrapper) ----------
 # Uses Application Default Credentials as well
 client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
+# Deadline, retries and circuit breaker around the analysis call; the same
+# journal text submitted twice concurrently shares one model call
+mood_gateway = LLMGateway("journal_mood", deadline=20.0, coalesce=True, limiter=limiter_for(MODEL))
 
 app = Flask(__name__)
+install_flask(app)  # Server-Timing header + JSON timing log line on every route
+
+# ---------- Helper: client-side push keys ----------
+# Same alphabet and layout as the Firebase client SDKs: 8 chars of millisecond
+# timestamp followed by 12 random chars, so keys still sort chronologically.
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+def generate_push_key():
+    """
+    Build an RTDB push key locally. ref.push() performs its own POST to obtain a
+    key, which would cost an extra round-trip before the real write.
+    """
+    now = int(time.time() * 1000)
+    ts_chars = []
+    for _ in range(8):
+        ts_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    rand_chars = [random.choice(PUSH_CHARS) for _ in range(12)]
+    return "".join(reversed(ts_chars)) + "".join(rand_chars)
 
 # ---------- Helper: ask model to analyze journal ----------
+@dataclass
+class MoodAnalysis:
+    mood_score: int
+    mood_type: str = enum_field("sad", "anxious", "neutral", "happy", "angry", "calm", "mixed")
+    explanation: str = ""
+
+
+@span("generate")
 def analyze_with_model(journal_text):
     """
     Instruct model to produce a small JSON object:
     { "mood_score": int(0-100), "mood_type": "sad|anxious|neutral|happy|angry|calm|mixed", "explanation": "..." }
-    We'll parse the response strictly as JSON.
+    The reply is schema-constrained and validated into MoodAnalysis.
     """
     prompt = (
-        "You are an emotion and mood analyzer. Read the user's full journal below and output a single JSON object "
-        "with three keys exactly: mood_score (integer 0-100), mood_type (one-word tag like 'sad', 'anxious', 'neutral', 'happy', 'angry', 'calm', or 'mixed'), "
-        "and explanation (one brief sentence). Do not output anything else. Keep explanation <= 40 words.\n\n"
+        "You are an emotion and mood analyzer. Read the user's full journal below and rate it: "
+        "mood_score (integer 0-100), mood_type (one-word tag), and explanation (one brief sentence, <= 40 words).\n\n"
         "Journal:\n"
-        f"{journal_text}\n\n"
-        "Output JSON only (no surrounding text). Example: {\"mood_score\": 42, \"mood_type\": \"sad\", \"explanation\": \"...\"}"
+        f"{journal_text}\n"
     )
 
-    resp = client.models.generate_content(model=MODEL, contents=prompt)
     try:
+        resp = mood_gateway.generate_genai(client, MODEL, prompt, config=schema_config(MoodAnalysis, 128, thinking_budget=0))
         text = resp.candidates[0].content.parts[0].text.strip()
-    except Exception:
+    except Exception as e:
+        log.error("Mood analysis call failed: %s", e)
         text = ""
 
-    # Try to find first JSON object in output
-    try:
-        start = text.index("{")
-        end = text.rindex("}") + 1
-        json_text = text[start:end]
-        parsed = json.loads(json_text)
-    except Exception:
+    result = parse_structured("journal_mood", text, MoodAnalysis)
+    if result is not None:
+        parsed = {"mood_score": result.mood_score, "mood_type": result.mood_type, "explanation": result.explanation}
+    else:
         # fallback: conservative default
         parsed = {
             "mood_score": 50,
@@ -100,7 +138,8 @@ def analyze_journal():
         if auth_header.startswith("Bearer "):
             id_token = auth_header.split(" ", 1)[1]
             try:
-                decoded = auth.verify_id_token(id_token)
+                with span("auth"):
+                    decoded = auth.verify_id_token(id_token)
                 uid = decoded.get("uid")
             except Exception as e:
                 # If token invalid, ignore and allow uid from body (if present)
@@ -121,21 +160,26 @@ def analyze_journal():
         if uid:
             try:
                 # create a safe journal entry
+                timestamp = datetime.now(timezone.utc).isoformat()
                 entry = {
                     "text": journal_text,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "timestamp": timestamp,
                     "moodScore": mood_score,
                     "moodTag": mood_type,
                     "explanation": explanation
                 }
-                ref = firebase_db.reference(f"users/{uid}/journals")
-                new_ref = ref.push(entry)
-                saved_path = new_ref.path
-                
+                # Entry and derived profile fields go out as one atomic
+                # multi-path update, so they can never disagree.
+                journal_key = generate_push_key()
                 user_ref = firebase_db.reference(f"users/{uid}")
-                user_ref.update({
-                    "latestMood": mood_type
-                }) 
+                with span("rtdb_write"):
+                    user_ref.update({
+                        f"journals/{journal_key}": entry,
+                        "latestMood": mood_type,
+                        "latestMoodScore": mood_score,
+                        "lastJournalAt": timestamp
+                    })
+                saved_path = f"/users/{uid}/journals/{journal_key}"
             except Exception as e:
                 # don't fail whole response; include note
                 saved_path = f"error_writing:{str(e)}"
@@ -153,6 +197,17 @@ def analyze_journal():
         return jsonify({"error": str(e)}), 500
 
 
+# ---------- Route: metrics ----------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Model gateway and concurrency-limiter counters, per-endpoint stage latency
+    histograms, log queue stats, structured-output parse outcomes.
+    """
+    return jsonify({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                    "structured_output": parse_stats()}), 200
+
+
 # run locally (useful for testing)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
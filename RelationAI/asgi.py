@@ -0,0 +1,321 @@
+# asgi.py
+"""
+Async (ASGI) variant of the RelationAI service: /chat, /onboarding and
+/relations with the same request and response shapes as main.py, on Quart,
+Firestore's AsyncClient and google-genai's async API (client.aio).
+
+A request waiting on Gemini or Firestore yields the event loop instead of
+holding a gunicorn thread, so one instance keeps far more conversations in
+flight. Independent work inside a request overlaps: the profile and history
+reads, and in /chat the user-message write, relation extraction and the
+summary + reply generation.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+Model calls still share main.py's per-model AIMD limiter; that bounds load
+on the Gemini quota, not the number of open requests.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from quart import Quart, request, jsonify
+from firebase_admin import auth
+from google.cloud import firestore
+from crisis import scan_message, SAFETY_RESPONSE, CRISIS_RESOURCES
+from structured_output import parse_stats, schema_config
+from llm_gateway import AsyncLLMGateway, metrics_snapshot
+from tracing import span, install_quart, timing_snapshot
+from async_logging import log_stats
+from chat_archive import load_messages_async
+from relation_graph import record_mentions_async, read_graph_async, tracked_names_async
+from relation_gate import names_from_profile
+from relation_scores import (
+    LIST_FIELDS, record_interaction_async, rank_relations, relation_entry, relation_list_args,
+)
+from main import (
+    PROJECT_ID, MODEL, SUMMARY_TRIGGER, ONBOARDING_QUESTIONS_FULL, ONBOARDING_KEYS, CHAT_FALLBACK_REPLY, PeopleExtraction,
+    client, gemini_limiter, relation_gates,
+    build_prompt, build_extraction_prompt, build_summary_input, history_turn, parse_people,
+)
+
+log = logging.getLogger("relation_ai.asgi")
+
+# ------------------ Initialize Clients ------------------
+db = firestore.AsyncClient(project=PROJECT_ID)
+
+reply_gateway = AsyncLLMGateway("chat_reply_async", deadline=20.0, hedge=True, limiter=gemini_limiter)
+background_gateway = AsyncLLMGateway("chat_background_async", deadline=15.0, coalesce=True, limiter=gemini_limiter)
+
+app = Quart(__name__)
+install_quart(app)
+
+# ------------------ Auth ------------------
+async def authenticate():
+    """uid from the Bearer token, or None when the header is missing. Invalid tokens raise."""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+    # verify_id_token may fetch Google's signing certs over the network; keep it off the loop
+    with span("auth"):
+        decoded_token = await asyncio.to_thread(auth.verify_id_token, auth_header.split(" ")[1])
+    return decoded_token["uid"]
+
+# ------------------ Firestore Utilities ------------------
+async def get_user_profile(user_id):
+    with span("firestore_read"):
+        doc = await db.collection("users").document(user_id).get()
+    return doc.to_dict() if doc.exists else {}
+
+async def save_user_profile(user_id, profile_data):
+    with span("firestore_write"):
+        await db.collection("users").document(user_id).set(profile_data, merge=True)
+
+async def save_chat_message(user_id, role, text):
+    with span("firestore_write"):
+        await db.collection("users").document(user_id).collection("chats").document().set({
+            "role": role,
+            "text": text,
+            "ts": datetime.now(timezone.utc)
+        })
+
+async def load_history(user_id):
+    with span("firestore_read"):
+        messages = await load_messages_async(db, user_id)
+    return [history_turn(data) for data in messages]
+
+async def flag_crisis_follow_up(user_id, matched_phrase):
+    with span("firestore_write"):
+        await db.collection("users").document(user_id).set({
+            "crisis_follow_up": {
+                "pending": True,
+                "flagged_at": datetime.now(timezone.utc),
+                "matched_phrase": matched_phrase,
+            }
+        }, merge=True)
+
+# ------------------ AI Relation Mapping ------------------
+async def extract_person_and_relation_ai(message):
+    try:
+        with span("relation_extract"):
+            resp = await background_gateway.generate_genai(
+                client, MODEL, build_extraction_prompt(message), config=schema_config(PeopleExtraction, 256, thinking_budget=0))
+        text = resp.candidates[0].content.parts[0].text.strip()
+    except Exception as e:
+        log.error("Relation extraction error: %s", e)
+        return []
+    return parse_people(text)
+
+async def save_relation_interaction(user_id, person, interaction_type, message):
+    if not person or not interaction_type:
+        return
+    person = person.lower()
+    doc_ref = db.collection("users").document(user_id).collection("relationships").document(person)
+    with span("firestore_write"):
+        await record_interaction_async(db, doc_ref, interaction_type, {
+            "name": person,
+            "last_interaction": datetime.now(timezone.utc),
+            "last_type": interaction_type,
+            "history": firestore.ArrayUnion([{
+                "timestamp": datetime.now(timezone.utc),
+                "type": interaction_type,
+                "message": message
+            }])
+        })
+    log.info("Relation saved: %s (%s)", person, interaction_type)
+
+async def update_relation_graph(user_id, people):
+    try:
+        with span("firestore_write"):
+            await record_mentions_async(db, user_id, [(p.get("name"), p.get("relation_type")) for p in people
+                                                      if p.get("relation_type")])
+    except Exception as e:
+        log.error("Relation graph update error: %s", e)
+
+async def mentions_someone(user_id, profile, message):
+    try:
+        gate = relation_gates.get(user_id)
+        if gate is None:
+            with span("firestore_read"):
+                gate = relation_gates.put(user_id, await tracked_names_async(db, user_id) + names_from_profile(profile))
+        return relation_gates.check(gate, message)
+    except Exception as e:
+        log.error("Relation gate error for %s, extracting anyway: %s", user_id, e)
+        return True  # fail open, as in main.mentions_someone
+
+async def map_relations(user_id, message, profile):
+    if not await mentions_someone(user_id, profile, message):
+        return
+    people = await extract_person_and_relation_ai(message)
+    relation_gates.remember(user_id, [p["name"] for p in people])
+    # one graph transaction for the whole message, before the relationship writes it may backfill from
+    await update_relation_graph(user_id, people)
+    await asyncio.gather(*(
+        save_relation_interaction(user_id, p.get("name"), p.get("relation_type"), message) for p in people))
+
+# ------------------ AI Logic ------------------
+async def summarize_memory(history):
+    try:
+        with span("summarize"):
+            resp = await background_gateway.generate_genai(client, MODEL, build_summary_input(history))
+        return resp.candidates[0].content.parts[0].text.strip()
+    except Exception as e:
+        log.error("Memory summary error: %s", e)
+        return ""
+
+async def get_assistant_reply(history, user_message, profile):
+    memory_summary = await summarize_memory(history) if len(history) >= SUMMARY_TRIGGER else ""
+    temp_history = history + [{"role": "user", "text": user_message, "ts": datetime.now(timezone.utc).isoformat()}]
+    prompt = build_prompt(memory_summary, temp_history, profile)
+    try:
+        with span("generate"):
+            resp = await reply_gateway.generate_genai(client, MODEL, prompt)
+        return resp.candidates[0].content.parts[0].text.strip()
+    except Exception as e:
+        log.error("Reply generation error: %s", e)
+        return CHAT_FALLBACK_REPLY
+
+# ------------------ Routes ------------------
+@app.route("/chat", methods=["POST"])
+async def chat():
+    try:
+        user_id = await authenticate()
+        if user_id is None:
+            return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+        body = await request.get_json()
+        user_message = body.get("message", "").strip()
+
+        # ---- Crisis fast path: vetted reply before any model call ----
+        crisis_phrase = scan_message(user_message)
+        if crisis_phrase:
+            log.warning("Crisis phrase detected for user %s", user_id)
+            await save_chat_message(user_id, "user", user_message)
+            await asyncio.gather(
+                save_chat_message(user_id, "assistant", SAFETY_RESPONSE),
+                flag_crisis_follow_up(user_id, crisis_phrase))
+            return jsonify({"reply": SAFETY_RESPONSE, "crisis": True, "resources": CRISIS_RESOURCES})
+
+        # History is only needed once onboarding is done, but reading it alongside
+        # the profile costs one round trip instead of two on every chat turn.
+        profile, history = await asyncio.gather(get_user_profile(user_id), load_history(user_id))
+
+        # ---- Onboarding ----
+        if not profile.get("onboarding_complete", False):
+            answered_keys = [k for k in ONBOARDING_KEYS if k in profile]
+            current_index = len(answered_keys)
+
+            if current_index == 0 and not user_message:
+                return jsonify({
+                    "status": "in_progress",
+                    "question": ONBOARDING_QUESTIONS_FULL[0]
+                })
+
+            if user_message and current_index < len(ONBOARDING_KEYS):
+                profile[ONBOARDING_KEYS[current_index]] = user_message
+                await save_user_profile(user_id, profile)
+                current_index += 1
+
+            if current_index >= len(ONBOARDING_QUESTIONS_FULL):
+                profile["onboarding_complete"] = True
+                await save_user_profile(user_id, profile)
+                return jsonify({
+                    "status": "complete",
+                    "message": "Onboarding completed! You can now start chatting."
+                })
+
+            return jsonify({
+                "status": "in_progress",
+                "question": ONBOARDING_QUESTIONS_FULL[current_index]
+            })
+
+        # ---- Normal chat: the user write, relation mapping and reply run concurrently ----
+        _, _, reply = await asyncio.gather(
+            save_chat_message(user_id, "user", user_message),
+            map_relations(user_id, user_message, profile),
+            get_assistant_reply(history, user_message, profile),
+        )
+        await save_chat_message(user_id, "assistant", reply)
+
+        return jsonify({"reply": reply})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/onboarding", methods=["POST"])
+async def onboarding():
+    try:
+        user_id = await authenticate()
+        if user_id is None:
+            return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+        body = await request.get_json()
+        user_response = body.get("answer", "").strip()
+
+        profile_data = await get_user_profile(user_id)
+        answered_keys = [k for k in ONBOARDING_KEYS if k in profile_data]
+        current_index = len(answered_keys)
+
+        if user_response and current_index < len(ONBOARDING_KEYS):
+            profile_data[ONBOARDING_KEYS[current_index - 1]] = user_response
+            await save_user_profile(user_id, profile_data)
+            current_index += 1
+
+        if current_index >= len(ONBOARDING_QUESTIONS_FULL):
+            profile_data["onboarding_complete"] = True
+            await save_user_profile(user_id, profile_data)
+            return jsonify({"status": "complete", "message": "Onboarding completed!"})
+
+        return jsonify({"status": "in_progress", "question": ONBOARDING_QUESTIONS_FULL[current_index]})
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route("/relations", methods=["GET"])
+async def get_relations():
+    try:
+        user_id = await authenticate()
+        if user_id is None:
+            return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+        try:
+            options, include_history = relation_list_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        rel_ref = db.collection("users").document(user_id).collection("relationships")
+        query = rel_ref if include_history else rel_ref.select(LIST_FIELDS)
+        relations = []
+        with span("firestore_read"):
+            async for doc in query.stream():
+                relations.append(relation_entry(doc.to_dict(), include_history))
+
+        return jsonify({"relations": rank_relations(relations, **options)}), 200
+
+    except Exception as e:
+        log.exception("Error fetching relations: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/relation_graph", methods=["GET"])
+async def get_relation_graph():
+    try:
+        user_id = await authenticate()
+        if user_id is None:
+            return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+        since = request.args.get("since", type=int)
+        with span("firestore_read"):
+            graph = await read_graph_async(db, user_id, since)
+        return jsonify(graph), 200
+
+    except Exception as e:
+        log.exception("Error fetching relation graph: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    return jsonify({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                    "relation_gate": relation_gates.stats(), "structured_output": parse_stats()}), 200
@@ -1,12 +1,23 @@
 import os
-import re
 import json
+import logging
+from dataclasses import dataclass, field
+from typing import List
 from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 import firebase_admin
 from firebase_admin import auth, credentials
 from google import genai
 from google.cloud import firestore
+from crisis import scan_message, SAFETY_RESPONSE, CRISIS_RESOURCES
+from structured_output import enum_field, parse_stats, parse_structured, schema_config
+from llm_gateway import LLMGateway, limiter_for, metrics_snapshot
+from tracing import span, install_flask, timing_snapshot
+from async_logging import setup_logging, log_stats
+from chat_archive import load_messages
+from relation_graph import record_mentions, read_graph, tracked_names
+from relation_gate import GateCache, names_from_profile
+from relation_scores import LIST_FIELDS, record_interaction, rank_relations, relation_entry, relation_list_args
 
 # ------------------ CONFIG ------------------
 PROJECT_ID = "clario-f60b0"
@@ -15,6 +26,12 @@ MODEL = "gemini-2.5-flash"
 
 MAX_RECENT = 8
 SUMMARY_TRIGGER = 10
+CHAT_FALLBACK_REPLY = "Sorry, I couldn't generate a response right now." # sent with 200 when no model reply
+
+# ------------------ Logging ------------------
+# Queue-backed JSON logs: request threads enqueue, a background thread writes stdout
+setup_logging()
+log = logging.getLogger("relation_ai")
 
 # ------------------ Initialize Clients ------------------
 if not firebase_admin._apps:
@@ -24,7 +41,17 @@ if not firebase_admin._apps:
 db = firestore.Client(project=PROJECT_ID)
 client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
 
+# Deadlines, retries and circuit breaking around every model call. Both share
+# one AIMD limiter so the gunicorn threads don't all pile onto the quota at once.
+gemini_limiter = limiter_for(MODEL, initial_limit=8, max_queue=16)
+reply_gateway = LLMGateway("chat_reply", deadline=20.0, hedge=True, limiter=gemini_limiter)
+background_gateway = LLMGateway("chat_background", deadline=15.0, coalesce=True, limiter=gemini_limiter)
+
+# Local name/kinship gate: relation extraction only runs for messages that may mention someone
+relation_gates = GateCache()
+
 app = Flask(__name__)
+install_flask(app)  # Server-Timing header + JSON timing log line on every route
 
 # ------------------ Onboarding Questions ------------------
 ONBOARDING_QUESTIONS_FULL = [
@@ -56,14 +83,17 @@ ONBOARDING_KEYS = [
 ]
 
 # ------------------ Firestore Utilities ------------------
+@span("firestore_read")
 def get_user_profile(user_id):
     doc_ref = db.collection("users").document(user_id)
     doc = doc_ref.get()
     return doc.to_dict() if doc.exists else {}
 
+@span("firestore_write")
 def save_user_profile(user_id, profile_data):
     db.collection("users").document(user_id).set(profile_data, merge=True)
 
+@span("firestore_write")
 def save_chat_message(user_id, role, text):
     db.collection("users").document(user_id).collection("chats").document().set({
         "role": role,
@@ -71,62 +101,102 @@ def save_chat_message(user_id, role, text):
         "ts": datetime.now(timezone.utc)
     })
 
+@span("firestore_read")
 def load_history(user_id):
-    chats_ref = db.collection("users").document(user_id).collection("chats").order_by("ts")
-    docs = chats_ref.stream()
-    history = []
-    for doc in docs:
-        data = doc.to_dict()
-        history.append({
-            "role": data.get("role"),
-            "text": data.get("text"),
-            "ts": data.get("ts").isoformat() if hasattr(data.get("ts"), "isoformat") else str(data.get("ts"))
-        })
-    return history
+    # Live messages plus any compacted into chat_chunks (see chat_archive)
+    return [history_turn(data) for data in load_messages(db, user_id)]
+
+def history_turn(data):
+    return {
+        "role": data.get("role"),
+        "text": data.get("text"),
+        "ts": data.get("ts").isoformat() if hasattr(data.get("ts"), "isoformat") else str(data.get("ts"))
+    }
+
+@span("firestore_write")
+def flag_crisis_follow_up(user_id, matched_phrase):
+    """Marks the user for a check_in_if_low follow-up after a crisis-phrase match."""
+    db.collection("users").document(user_id).set({
+        "crisis_follow_up": {
+            "pending": True,
+            "flagged_at": datetime.now(timezone.utc),
+            "matched_phrase": matched_phrase,
+        }
+    }, merge=True)
 
 # ------------------ AI Relation Mapping ------------------
+@dataclass
+class PersonMention:
+    name: str
+    relation_type: str = enum_field("conflict", "positive", "neutral")
+
+
+@dataclass
+class PeopleExtraction:
+    people: List[PersonMention] = field(default_factory=list)
+
+
+@span("relation_extract")
 def extract_person_and_relation_ai(message: str):
     """
     Use Gemini model to extract name(s) and relation sentiment from a user message.
-    Output format example:
-    {
-        "people": [{"name": "John", "relation_type": "conflict"}]
-    }
+    The reply is schema-constrained to PeopleExtraction; returns a list like
+    [{"name": "John", "relation_type": "conflict"}]
     """
-    prompt = f"""
+    try:
+        resp = background_gateway.generate_genai(
+            client, MODEL, build_extraction_prompt(message), config=schema_config(PeopleExtraction, 256, thinking_budget=0))
+        text = resp.candidates[0].content.parts[0].text.strip()
+    except Exception as e:
+        log.error("Relation extraction error: %s", e)
+        return []
+    return parse_people(text)
+
+
+def mentions_someone(user_id, profile, message):
+    """
+    Local check before extract_person_and_relation_ai; loads the user's tracked
+    names once per TTL. Fails open: if the gate errors, extraction runs as it
+    did before there was a gate.
+    """
+    try:
+        gate = relation_gates.get(user_id)
+        if gate is None:
+            with span("firestore_read"):
+                gate = relation_gates.put(user_id, tracked_names(db, user_id) + names_from_profile(profile))
+        return relation_gates.check(gate, message)
+    except Exception as e:
+        log.error("Relation gate error for %s, extracting anyway: %s", user_id, e)
+        return True
+
+
+def build_extraction_prompt(message):
+    return f"""
 You are an AI relationship context extractor.
 Given the following user message, identify any person's name mentioned and the emotional tone
-of their relationship (conflict, positive, neutral).
-Return a valid JSON like:
-{{"people": [{{"name": "<name>", "relation_type": "<conflict|positive|neutral>"}}]}}
+of their relationship (conflict, positive, neutral). Return an empty list if nobody is mentioned.
 
 User message: "{message}"
 """
 
-    try:
-        resp = client.models.generate_content(model=MODEL, contents=prompt)
-        text = resp.candidates[0].content.parts[0].text.strip()
 
-        # Try to extract JSON
-        match = re.search(r"\{.*\}", text, re.DOTALL)
-        if not match:
-            return []
-        data = json.loads(match.group())
-        return data.get("people", [])
-    except Exception as e:
-        print("Relation extraction error:", e)
+def parse_people(text):
+    data = parse_structured("relation_extraction", text, PeopleExtraction)
+    if data is None:
         return []
+    return [{"name": p.name, "relation_type": p.relation_type} for p in data.people if p.name.strip()]
 
 
+@span("firestore_write")
 def save_relation_interaction(user_id: str, person: str, interaction_type: str, message: str):
-    """Saves relationship interactions in Firestore."""
+    """Saves relationship interactions in Firestore, updating the smoothed scores (relation_scores.py)."""
     if not person or not interaction_type:
         return
 
     person = person.lower()
     doc_ref = db.collection("users").document(user_id).collection("relationships").document(person)
 
-    doc_ref.set({
+    record_interaction(db, doc_ref, interaction_type, {
         "name": person,
         "last_interaction": datetime.now(timezone.utc),
         "last_type": interaction_type,
@@ -135,24 +205,38 @@ def save_relation_interaction(user_id: str, person: str, interaction_type: str,
             "type": interaction_type,
             "message": message
         }])
-    }, merge=True)
+    })
+
+    log.info("Relation saved: %s (%s)", person, interaction_type)
 
-    print(f"[RELATION SAVED] {person} ({interaction_type})")
+
+@span("firestore_write")
+def update_relation_graph(user_id, people):
+    """Folds one message's mentions into the materialized graph; runs before the relationship writes."""
+    try:
+        record_mentions(db, user_id, [(p.get("name"), p.get("relation_type")) for p in people
+                                      if p.get("relation_type")])
+    except Exception as e:
+        log.error("Relation graph update error: %s", e)
 
 # ------------------ AI Logic ------------------
+@span("summarize")
 def summarize_memory(history):
+    try:
+        resp = background_gateway.generate_genai(client, MODEL, build_summary_input(history))
+        return resp.candidates[0].content.parts[0].text.strip()
+    except Exception as e:
+        log.error("Memory summary error: %s", e)
+        return ""
+
+def build_summary_input(history):
     preamble = (
         "Summarize essential, stable facts from the conversation that will help in future therapy-style responses. "
         "Include user's background facts, ongoing problems, therapy preferences, exercises tried, and any safety concerns. "
         "Keep summary concise (<= 250 words)."
     )
     convo_text = [f"{t['role'].upper()} ({t['ts']}): {t['text']}" for t in history]
-    full_input = preamble + "\n\nConversation:\n" + "\n".join(convo_text)
-    resp = client.models.generate_content(model=MODEL, contents=full_input)
-    try:
-        return resp.candidates[0].content.parts[0].text.strip()
-    except Exception:
-        return ""
+    return preamble + "\n\nConversation:\n" + "\n".join(convo_text)
 
 def build_prompt(memory_summary, history, profile):
     instructions = (
@@ -170,7 +254,7 @@ def build_prompt(memory_summary, history, profile):
     parts = [instructions]
 
     if profile:
-        parts.append("User profile:\n" + json.dumps(profile, indent=2) + "\n")
+        parts.append("User profile:\n" + json.dumps(profile, indent=2, default=str) + "\n")
     if memory_summary:
         parts.append("Memory summary:\n" + memory_summary + "\n")
 
@@ -184,14 +268,16 @@ def build_prompt(memory_summary, history, profile):
     parts.append("Now respond to the user's latest message empathetically.")
     return "\n".join(parts)
 
+@span("generate")
 def get_assistant_reply(memory_summary, history, user_message, profile):
     temp_history = history + [{"role": "user", "text": user_message, "ts": datetime.now(timezone.utc).isoformat()}]
     prompt = build_prompt(memory_summary, temp_history, profile)
-    resp = client.models.generate_content(model=MODEL, contents=prompt)
     try:
+        resp = reply_gateway.generate_genai(client, MODEL, prompt)
         return resp.candidates[0].content.parts[0].text.strip()
-    except Exception:
-        return "Sorry, I couldn't generate a response right now."
+    except Exception as e:
+        log.error("Reply generation error: %s", e)
+        return CHAT_FALLBACK_REPLY
 
 # ------------------ Flask Routes ------------------
 @app.route("/chat", methods=["POST"])
@@ -202,13 +288,24 @@ def chat():
             return jsonify({"error": "Missing or invalid Authorization header"}), 401
 
         id_token = auth_header.split(" ")[1]
-        decoded_token = auth.verify_id_token(id_token)
+        with span("auth"):
+            decoded_token = auth.verify_id_token(id_token)
         user_id = decoded_token["uid"]
 
-        profile = get_user_profile(user_id)
         body = request.get_json()
         user_message = body.get("message", "").strip()
 
+        # ---- Crisis fast path: vetted reply before any model call ----
+        crisis_phrase = scan_message(user_message)
+        if crisis_phrase:
+            log.warning("Crisis phrase detected for user %s", user_id)
+            save_chat_message(user_id, "user", user_message)
+            save_chat_message(user_id, "assistant", SAFETY_RESPONSE)
+            flag_crisis_follow_up(user_id, crisis_phrase)
+            return jsonify({"reply": SAFETY_RESPONSE, "crisis": True, "resources": CRISIS_RESOURCES})
+
+        profile = get_user_profile(user_id)
+
         # ---- Onboarding ----
         if not profile.get("onboarding_complete", False):
             answered_keys = [k for k in ONBOARDING_KEYS if k in profile]
@@ -246,7 +343,10 @@ def chat():
         save_chat_message(user_id, "user", user_message)
 
         # 🔹 AI Relation Mapping
-        people = extract_person_and_relation_ai(user_message)
+        people = extract_person_and_relation_ai(user_message) \
+            if mentions_someone(user_id, profile, user_message) else []
+        relation_gates.remember(user_id, [p["name"] for p in people])
+        update_relation_graph(user_id, people)
         for p in people:
             save_relation_interaction(user_id, p.get("name"), p.get("relation_type"), user_message)
 
@@ -267,14 +367,16 @@ def onboarding():
             return jsonify({"error": "Missing or invalid Authorization header"}), 401
 
         id_token = auth_header.split(" ")[1]
-        decoded_token = auth.verify_id_token(id_token)
+        with span("auth"):
+            decoded_token = auth.verify_id_token(id_token)
         user_id = decoded_token["uid"]
 
         body = request.get_json()
         user_response = body.get("answer", "").strip()
 
         profile_ref = db.collection("users").document(user_id)
-        profile_doc = profile_ref.get()
+        with span("firestore_read"):
+            profile_doc = profile_ref.get()
         profile_data = profile_doc.to_dict() if profile_doc.exists else {}
 
         answered_keys = [k for k in ONBOARDING_KEYS if k in profile_data]
@@ -283,12 +385,14 @@ def onboarding():
         if user_response and current_index < len(ONBOARDING_KEYS):
             prev_key = ONBOARDING_KEYS[current_index - 1]
             profile_data[prev_key] = user_response
-            profile_ref.set(profile_data, merge=True)
+            with span("firestore_write"):
+                profile_ref.set(profile_data, merge=True)
             current_index += 1
 
         if current_index >= len(ONBOARDING_QUESTIONS_FULL):
             profile_data["onboarding_complete"] = True
-            profile_ref.set(profile_data, merge=True)
+            with span("firestore_write"):
+                profile_ref.set(profile_data, merge=True)
             return jsonify({"status": "complete", "message": "Onboarding completed!"})
 
         return jsonify({"status": "in_progress", "question": ONBOARDING_QUESTIONS_FULL[current_index]})
@@ -300,36 +404,78 @@ def onboarding():
 # ------------------ Relations Fetch Route ------------------
 @app.route("/relations", methods=["GET"])
 def get_relations():
+    """
+    The user's relationships with smoothed scores (sentiment_score,
+    sentiment_label, interaction_rate per week). Sorting and filtering:
+    ?sort=recent|sentiment|rate&order=desc|asc&label=&min_sentiment=
+    &max_sentiment=&min_rate=&limit=; ?history=0 leaves out the history arrays.
+    """
     try:
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
             return jsonify({"error": "Missing or invalid Authorization header"}), 401
 
         id_token = auth_header.split(" ")[1]
-        decoded_token = auth.verify_id_token(id_token)
+        with span("auth"):
+            decoded_token = auth.verify_id_token(id_token)
         user_id = decoded_token["uid"]
 
-        # Fetch all relationships for this user
+        try:
+            options, include_history = relation_list_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Fetch all relationships for this user; scores live on the docs, so history is optional
         rel_ref = db.collection("users").document(user_id).collection("relationships")
-        docs = rel_ref.stream()
-
-        relations = []
-        for doc in docs:
-            data = doc.to_dict()
-            relations.append({
-                "name": data.get("name", ""),
-                "last_interaction": data.get("last_interaction").isoformat()
-                if data.get("last_interaction") else None,
-                "last_type": data.get("last_type", "neutral"),
-                "history": data.get("history", []),
-            })
+        query = rel_ref if include_history else rel_ref.select(LIST_FIELDS)
+        with span("firestore_read"):
+            docs = list(query.stream())
 
-        return jsonify({"relations": relations}), 200
+        relations = [relation_entry(doc.to_dict(), include_history) for doc in docs]
+        return jsonify({"relations": rank_relations(relations, **options)}), 200
 
     except Exception as e:
-        print("Error fetching relations:", e)
+        log.exception("Error fetching relations: %s", e)
         return jsonify({"error": str(e)}), 500
 
+# ------------------ Relation Graph Route ------------------
+@app.route("/relation_graph", methods=["GET"])
+def get_relation_graph():
+    """
+    The user's relation graph in one read: nodes with mention counts and
+    decayed weights, edges from the user. ?since=<version> returns only the
+    nodes changed after that version.
+    """
+    try:
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+        id_token = auth_header.split(" ")[1]
+        with span("auth"):
+            decoded_token = auth.verify_id_token(id_token)
+        user_id = decoded_token["uid"]
+
+        since = request.args.get("since", type=int)
+        with span("firestore_read"):
+            graph = read_graph(db, user_id, since)
+        return jsonify(graph), 200
+
+    except Exception as e:
+        log.exception("Error fetching relation graph: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+# ------------------ Metrics Route ------------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Model gateway and concurrency-limiter counters, per-endpoint stage latency
+    histograms, log queue stats, relation gate decisions, structured-output
+    parse outcomes.
+    """
+    return jsonify({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                    "relation_gate": relation_gates.stats(), "structured_output": parse_stats()}), 200
+
 # ------------------ Entry ------------------
 if __name__ == "__main__":
     import os
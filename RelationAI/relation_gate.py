@@ -0,0 +1,193 @@
+# relation_gate.py
+"""
+Local gate in front of LLM relation extraction. Most chat messages mention
+nobody, yet each one used to cost a Gemini call to find that out. The gate
+fires only when a message could be about a person:
+
+    tracked      a name the user already tracks: relation graph nodes plus the
+                 profile's important_people / trusted_person answers, matched
+                 word by word through a token trie (multi-word names included)
+    kinship      a relationship word: mom, boss, girlfriend, roommate, ...
+    capitalized  a capitalized word that is not a common English word (new names)
+
+Any hit means the extraction call runs; no hit means it is skipped. The cost
+of a false positive is the call we make today, so the detectors lean towards
+firing. What the gate misses is a new name typed in lower case; the extractor
+then picks the person up the next time they are capitalized, kin-worded, or
+tracked. loadtest/relation_gate_eval.py measures skip rate and recall on a
+labelled corpus.
+
+Gates are cached per user for GATE_TTL_SECONDS and learn names the extractor
+returns, so the tracked names are read once per user per TTL, not per message.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+
+# ------------------ CONFIG ------------------
+GATE_TTL_SECONDS = 300 # tracked names are reloaded after this long
+GATE_CACHE_USERS = 1024 # per-process LRU bound
+
+KINSHIP_WORDS = frozenset("""
+mom mum mommy mother mama dad daddy father papa parents parent stepmom stepdad
+sister sis brother bro sibling siblings twin grandma grandmother granny nana
+grandpa grandfather grandparents aunt auntie uncle cousin niece nephew
+son daughter kid kids child children baby wife husband spouse partner
+fiance fiancee girlfriend boyfriend gf bf ex crush date friend friends bestie
+bff buddy mate roommate roomie flatmate neighbor neighbour boss manager
+coworker coworkers colleague colleagues classmate classmates teammate
+teacher professor coach therapist counselor counsellor doctor mentor
+in-law in-laws landlord
+""".split())
+
+# Capitalized words that are not names: sentence starters, pronouns, days, ...
+COMMON_WORDS = frozenset("""
+i i'm im i've i'd i'll me my mine myself we we're our us you you're your he he's
+him his she she's her they they're them their it it's its this that these those
+there here the a an and but or so because since if when while after before then
+also just still really very maybe perhaps well yes yeah yep no nope not ok okay
+hi hey hello thanks thank please sorry lol idk omg ugh wow hmm oh ah
+what why how who where which whatever whenever today tonight tomorrow yesterday
+lately recently sometimes always never often usually every everyone everything
+nothing nobody someone something anyone anything all some any most many much
+feeling feel felt think thought know knew want wanted need needed tried trying
+had have has got get getting went going go gone did do does doing done made make
+was were is are am be been being can could would should will won't can't don't
+didn't doesn't isn't wasn't couldn't wouldn't shouldn't let let's
+honestly actually basically literally seriously anyway finally hopefully
+work school college class office home life
+at in on of for from to with without about into over under again
+started starting spent spending studying watched watching worked working slept sleeping
+talked talking called calling told telling met meeting saw seeing came coming left stayed
+monday tuesday wednesday thursday friday saturday sunday weekend
+mondays tuesdays wednesdays thursdays fridays saturdays sundays weekends
+january february march april may june july august september october november december
+christmas easter new year god
+best close closest good older younger little big old family people person none n/a
+""".split())
+
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+_POSSESSIVE = re.compile(r"'s$")
+
+
+def tokens(text):
+    """Words of `text`, case kept, curly apostrophes normalized and possessive 's stripped."""
+    return [_POSSESSIVE.sub("", w) for w in _TOKEN.findall((text or "").replace("’", "'"))]
+
+
+def names_from_profile(profile):
+    """Candidate names from the free-text important_people / trusted_person answers."""
+    names = []
+    for key in ("important_people", "trusted_person"):
+        answer = profile.get(key)
+        if isinstance(answer, list):
+            answer = ", ".join(str(a) for a in answer)
+        if not isinstance(answer, str):
+            continue
+        for part in re.split(r",|;|/|&|\band\b|\bor\b", answer):
+            words = [w for w in tokens(part) if w.lower() not in COMMON_WORDS and w.lower() not in KINSHIP_WORDS]
+            capitalized = [w for w in words if w[0].isupper()]
+            # "my best friend Jake Miller" -> "Jake Miller"; all lower case -> every leftover word
+            names.extend([" ".join(capitalized)] if capitalized else words)
+    return names
+
+
+class NameGate:
+    """Token trie of tracked names plus the kinship and capitalized-word detectors."""
+
+    _END = object()
+
+    def __init__(self, names=()):
+        self._trie = {}
+        self.size = 0
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        words = [w.lower() for w in tokens(name)]
+        if not words:
+            return
+        node = self._trie
+        for word in words:
+            node = node.setdefault(word, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.size += 1
+
+    def _tracked(self, words, i):
+        """Longest tracked name starting at words[i], or None."""
+        node, found = self._trie, None
+        for j in range(i, len(words)):
+            node = node.get(words[j])
+            if node is None:
+                break
+            if self._END in node:
+                found = " ".join(words[i:j + 1])
+        return found
+
+    def match(self, message):
+        """(reason, word) for the first hit, or None when the message mentions nobody."""
+        toks = tokens(message)
+        words = [w.lower() for w in toks]
+        for i, word in enumerate(toks):
+            lower = words[i]
+            name = self._tracked(words, i)
+            if name:
+                return "tracked", name
+            if lower in KINSHIP_WORDS:
+                return "kinship", lower
+            if word[0].isupper() and not (len(word) > 1 and word.isupper()) and lower not in COMMON_WORDS:
+                return "capitalized", word
+        return None
+
+
+class GateCache:
+    """Per-user NameGates with a TTL, plus counters of what the gate decided."""
+
+    def __init__(self, ttl=GATE_TTL_SECONDS, max_users=GATE_CACHE_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._gates = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "skipped": 0, "tracked": 0, "kinship": 0, "capitalized": 0}
+
+    def get(self, user_id):
+        """The user's gate, or None when it needs (re)loading with put()."""
+        with self._lock:
+            entry = self._gates.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            self._gates.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, names):
+        gate = NameGate(names)
+        with self._lock:
+            self._gates[user_id] = (time.monotonic(), gate)
+            self._gates.move_to_end(user_id)
+            while len(self._gates) > self.max_users:
+                self._gates.popitem(last=False)
+        return gate
+
+    def remember(self, user_id, names):
+        """Adds names the extractor found, so later lower-case mentions still pass the gate."""
+        gate = self.get(user_id)
+        if gate is not None:
+            with self._lock:
+                for name in names:
+                    gate.add(name)
+
+    def check(self, gate, message):
+        """True when extraction should run; counts the decision."""
+        hit = gate.match(message)
+        with self._lock:
+            self._stats["checked"] += 1
+            self._stats["skipped" if hit is None else hit[0]] += 1
+        return hit is not None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, cached_users=len(self._gates))
+        stats["skip_rate"] = round(stats["skipped"] / stats["checked"], 3) if stats["checked"] else None
+        return stats
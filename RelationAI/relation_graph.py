@@ -0,0 +1,277 @@
+# relation_graph.py
+"""
+Materialized relation graph: one document per user,
+users/{uid}/relation_graph/current, holding every person the user has talked
+about as a node with a weighted edge to the user. It is updated in a
+transaction whenever a mention is recorded (main.py, asgi.py, test.py), so a
+client draws the whole graph with one document read instead of streaming
+every relation document.
+
+Edge weight is a decayed mention count: a mention adds 1, and the total
+halves every HALF_LIFE without new mentions. Nodes store (score, score_at);
+the weight is decayed to the read time when the graph is served, so a person
+not mentioned in months fades without anything being written.
+
+Versioning: `version` goes up by one per update and each node keeps the
+version that last changed it, so graph_payload(data, since=v) returns only
+the nodes changed after version v. Relations are never removed, so a delta
+needs no tombstones (account deletion removes the graph document with the
+user).
+
+The document grows with the number of people tracked (~200 bytes a node),
+far below the 1 MiB limit for realistic graphs.
+"""
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+# ------------------ CONFIG ------------------
+GRAPH_COLLECTION = "relation_graph"
+GRAPH_DOC = "current"
+HALF_LIFE = timedelta(days=30) # a mention counts half as much after this long
+
+USER_NODE = {"id": "user", "label": "You", "color": "#3B82F6"}  # Blue
+SENTIMENT_COLORS = {
+    "positive": "#22C55E",  # Green
+    "negative": "#EF4444",  # Red
+    "conflict": "#EF4444",
+}
+NEUTRAL_COLOR = "#FACC15"  # Yellow
+
+
+def graph_ref(db, user_id):
+    return db.collection("users").document(user_id).collection(GRAPH_COLLECTION).document(GRAPH_DOC)
+
+
+def node_key(name):
+    return name.strip().lower()
+
+
+def _as_datetime(value):
+    if isinstance(value, str):  # test.py stores ISO strings
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return None
+
+
+def decayed(score, score_at, now):
+    """score (as of score_at) decayed to now."""
+    score_at = _as_datetime(score_at)
+    if not score or score_at is None:
+        return score or 0.0
+    age = max((now - score_at).total_seconds(), 0.0)
+    return score * 0.5 ** (age / HALF_LIFE.total_seconds())
+
+
+# ------------------ Updates ------------------
+def _apply_mentions(current, mentions, now):
+    """The merge-set that folds (name, sentiment) mentions into the graph document `current`."""
+    version = current.get("version", 0) + 1
+    nodes = current.get("nodes", {})
+    changed = {}
+    for name, sentiment in mentions:
+        key = node_key(name)
+        node = changed.get(key) or nodes.get(key, {})
+        changed[key] = {
+            "label": name.strip(),
+            "sentiment": sentiment,
+            "mentions": node.get("mentions", 0) + 1,
+            "score": decayed(node.get("score", 0.0), node.get("score_at"), now) + 1.0,
+            "score_at": now,
+            "last_mentioned": now,
+            "version": version,
+        }
+    return {"version": version, "updated_at": now, "nodes": changed}
+
+
+def _backfill(relations, now):
+    """Graph nodes (version 1) from relationships docs (RelationAI) or relations docs (test.py)."""
+    nodes = {}
+    for data in relations:
+        if not data.get("name"):
+            continue
+        history = data.get("history") or []
+        if history:
+            stamps = [ts for ts in (_as_datetime(h.get("timestamp")) for h in history) if ts is not None]
+            mentions = len(history)
+            score = sum(decayed(1.0, ts, now) for ts in stamps)
+            last = max(stamps, default=None)
+        else:
+            mentions = data.get("times_mentioned", 1)
+            last = _as_datetime(data.get("last_mentioned"))
+            score = decayed(float(mentions), last, now)
+        nodes[node_key(data["name"])] = {
+            "label": data["name"],
+            "sentiment": data.get("last_type") or data.get("sentiment", "neutral"),
+            "mentions": mentions,
+            "score": score,
+            "score_at": now,
+            "last_mentioned": last or _as_datetime(data.get("last_interaction")),
+            "version": 1,
+        }
+    return nodes
+
+
+def _updates(snapshot, relations, mentions, now):
+    if snapshot.exists:
+        return _apply_mentions(snapshot.to_dict(), mentions, now)
+    current = {"nodes": _backfill(relations, now)}
+    updates = _apply_mentions(current, mentions, now)
+    updates["nodes"] = {**current["nodes"], **updates["nodes"]}
+    return updates
+
+
+def _record(transaction, ref, source, mentions, now):
+    snapshot = ref.get(transaction=transaction)
+    relations = [] if snapshot.exists else [doc.to_dict() for doc in source.stream()]
+    updates = _updates(snapshot, relations, mentions, now)
+    transaction.set(ref, updates, merge=True)
+    return updates
+
+
+async def _record_async(transaction, ref, source, mentions, now):
+    snapshot = await ref.get(transaction=transaction)
+    relations = [] if snapshot.exists else [doc.to_dict() async for doc in source.stream()]
+    updates = _updates(snapshot, relations, mentions, now)
+    transaction.set(ref, updates, merge=True)
+    return updates
+
+
+def _ensure(transaction, ref, source, now):
+    """The graph document; when there is none yet, backfilled from `source` and written."""
+    snapshot = ref.get(transaction=transaction)
+    if snapshot.exists:
+        return snapshot.to_dict()
+    data = _updates(snapshot, [doc.to_dict() for doc in source.stream()], [], now)
+    transaction.set(ref, data)
+    return data
+
+
+async def _ensure_async(transaction, ref, source, now):
+    snapshot = await ref.get(transaction=transaction)
+    if snapshot.exists:
+        return snapshot.to_dict()
+    data = _updates(snapshot, [doc.to_dict() async for doc in source.stream()], [], now)
+    transaction.set(ref, data)
+    return data
+
+
+def _clean(mentions):
+    return [(name, sentiment) for name, sentiment in mentions if name and name.strip()]
+
+
+def record_mentions(db, user_id, mentions, source="relationships", now=None):
+    """
+    Folds one message's mentions, [(name, sentiment), ...], into the graph in
+    one transaction and returns the new version (None if there was nothing to
+    record). The first write for a user backfills the graph from the `source`
+    relation collection, so call this before writing the message's relation
+    documents, or the message is counted twice.
+    """
+    mentions = _clean(mentions)
+    if not mentions:
+        return None
+    record = firestore.transactional(_record)
+    user_ref = db.collection("users").document(user_id)
+    return record(db.transaction(), graph_ref(db, user_id), user_ref.collection(source), mentions,
+                  now or datetime.now(timezone.utc))["version"]
+
+
+async def record_mentions_async(db, user_id, mentions, source="relationships", now=None):
+    mentions = _clean(mentions)
+    if not mentions:
+        return None
+    record = firestore.async_transactional(_record_async)
+    user_ref = db.collection("users").document(user_id)
+    updates = await record(db.transaction(), graph_ref(db, user_id), user_ref.collection(source), mentions,
+                           now or datetime.now(timezone.utc))
+    return updates["version"]
+
+
+# ------------------ Reading ------------------
+def graph_payload(data, since=None, now=None):
+    """
+    The graph document as {"version", "half_life_days", "nodes", "edges"}.
+    With `since`, only nodes changed after that version ("delta": true); a
+    `since` ahead of the document (deleted and backfilled again) returns everything.
+    """
+    now = now or datetime.now(timezone.utc)
+    version = data.get("version", 0)
+    delta = since is not None and since <= version
+    nodes, edges = [], []
+    if not delta:
+        nodes.append(dict(USER_NODE))
+    for key, node in sorted(data.get("nodes", {}).items()):
+        if delta and node.get("version", 0) <= since:
+            continue
+        weight = round(decayed(node.get("score", 0.0), node.get("score_at"), now), 4)
+        last = _as_datetime(node.get("last_mentioned"))
+        nodes.append({
+            "id": key,
+            "label": node.get("label") or key,
+            "sentiment": node.get("sentiment", "neutral"),
+            "color": SENTIMENT_COLORS.get(node.get("sentiment"), NEUTRAL_COLOR),
+            "mentions": node.get("mentions", 0),
+            "weight": weight,
+            "last_mentioned": last.isoformat() if last else None,
+            "version": node.get("version", 0),
+        })
+        edges.append({"source": USER_NODE["id"], "target": key, "weight": weight})
+    return {
+        "version": version,
+        "delta": delta,
+        "since": since if delta else None,
+        "half_life_days": HALF_LIFE.total_seconds() / 86400,
+        "nodes": nodes,
+        "edges": edges,
+    }
+
+
+def _load(db, user_id, source):
+    """The graph document: one read, or for a user without one, a backfill from `source` first."""
+    ref = graph_ref(db, user_id)
+    snapshot = ref.get()
+    if snapshot.exists:
+        return snapshot.to_dict()
+    ensure = firestore.transactional(_ensure)
+    user_ref = db.collection("users").document(user_id)
+    return ensure(db.transaction(), ref, user_ref.collection(source), datetime.now(timezone.utc))
+
+
+async def _load_async(db, user_id, source):
+    ref = graph_ref(db, user_id)
+    snapshot = await ref.get()
+    if snapshot.exists:
+        return snapshot.to_dict()
+    ensure = firestore.async_transactional(_ensure_async)
+    user_ref = db.collection("users").document(user_id)
+    return await ensure(db.transaction(), ref, user_ref.collection(source), datetime.now(timezone.utc))
+
+
+def _labels(data):
+    return [node.get("label") or key for key, node in (data.get("nodes") or {}).items()]
+
+
+def tracked_names(db, user_id, source="relationships"):
+    """
+    Labels of every person in the graph: one document read, no relation
+    history. Users tracked before the graph existed get it backfilled, as in
+    read_graph, so their people still pass the relation gate.
+    """
+    return _labels(_load(db, user_id, source))
+
+
+async def tracked_names_async(db, user_id, source="relationships"):
+    return _labels(await _load_async(db, user_id, source))
+
+
+def read_graph(db, user_id, since=None, source="relationships"):
+    """One document read; a user without a graph document gets it backfilled from `source` first."""
+    return graph_payload(_load(db, user_id, source), since)
+
+
+async def read_graph_async(db, user_id, since=None, source="relationships"):
+    return graph_payload(await _load_async(db, user_id, source), since)
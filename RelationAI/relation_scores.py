@@ -0,0 +1,209 @@
+# relation_scores.py
+"""
+Smoothed relationship state kept on each relation document, so one message
+no longer flips a relationship from positive to conflict and /relations can
+rank people without reading their history arrays.
+
+Two exponentially weighted scores, each updated in O(1) from its previous
+value and the time since the last interaction:
+
+    sentiment_score    in [-1, 1] (conflict/negative -1, neutral 0, positive 1).
+                       Each interaction moves it by at least SENTIMENT_ALPHA, and
+                       by more the longer it has been since the last one
+                       (towards all of it after several SENTIMENT_HALF_LIFEs).
+    interaction_rate   interactions per week, an exponentially decayed count
+                       with time constant RATE_WINDOW. It is decayed to the read
+                       time when served, so people who drop out of
+                       conversation sink without a write.
+
+record_interaction() reads just these fields (a field mask, not the history
+array) and writes them back with the caller's own fields in one
+transaction. Documents written before the scores existed start from their
+last label.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+# ------------------ CONFIG ------------------
+SENTIMENT_ALPHA = 0.3 # weight of a new interaction right after the previous one
+SENTIMENT_HALF_LIFE = timedelta(days=14) # gap after which the old score counts half as much again
+RATE_WINDOW = timedelta(days=7) # time constant of the interaction rate (reported per week)
+POSITIVE_ABOVE = 0.25 # sentiment_score > this -> "positive"
+CONFLICT_BELOW = -0.25 # sentiment_score < this -> "conflict"
+
+SENTIMENT_VALUES = {"positive": 1.0, "neutral": 0.0, "negative": -1.0, "conflict": -1.0}
+SCORE_FIELDS = ["sentiment_score", "interaction_rate", "interactions", "scores_at", "last_type", "sentiment"]
+
+
+def _as_datetime(value):
+    if isinstance(value, str):  # test.py stores ISO strings
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return None
+
+
+def _label_value(data):
+    return SENTIMENT_VALUES.get(data.get("last_type") or data.get("sentiment"), 0.0)
+
+
+def sentiment_label(score):
+    if score > POSITIVE_ABOVE:
+        return "positive"
+    if score < CONFLICT_BELOW:
+        return "conflict"
+    return "neutral"
+
+
+def decayed_rate(rate, rate_at, now):
+    rate_at = _as_datetime(rate_at)
+    if not rate or rate_at is None:
+        return 0.0
+    age = max((now - rate_at).total_seconds(), 0.0)
+    return rate * math.exp(-age / RATE_WINDOW.total_seconds())
+
+
+def score_update(current, sentiment, now):
+    """New score fields after one interaction with `sentiment`, given the document's current fields."""
+    value = SENTIMENT_VALUES.get(sentiment, 0.0)
+    scores_at = _as_datetime(current.get("scores_at"))
+    if scores_at is None:
+        # first scored interaction: an existing doc starts from its last label, a new one from this one
+        previous = _label_value(current) if current else value
+        gap = 0.0
+        rate = 0.0
+    else:
+        previous = current.get("sentiment_score", 0.0)
+        gap = max((now - scores_at).total_seconds(), 0.0)
+        rate = decayed_rate(current.get("interaction_rate", 0.0), scores_at, now)
+    keep = (1 - SENTIMENT_ALPHA) * 0.5 ** (gap / SENTIMENT_HALF_LIFE.total_seconds())
+    return {
+        "sentiment_score": round(keep * previous + (1 - keep) * value, 6),
+        "interaction_rate": rate + 1.0,  # per RATE_WINDOW, i.e. per week
+        "interactions": current.get("interactions", 0) + 1,
+        "scores_at": now,
+    }
+
+
+def current_scores(data, now=None):
+    """The scores as of now, for serving: smoothed label, decayed weekly rate."""
+    now = now or datetime.now(timezone.utc)
+    if "scores_at" in data:
+        score = data.get("sentiment_score", 0.0)
+        rate = decayed_rate(data.get("interaction_rate", 0.0), data.get("scores_at"), now)
+    else:
+        score, rate = _label_value(data), 0.0
+    return {
+        "sentiment_score": round(score, 3),
+        "sentiment_label": sentiment_label(score),
+        "interaction_rate": round(rate, 3),
+    }
+
+
+# ------------------ Updates ------------------
+def _record(transaction, ref, sentiment, fields, now):
+    snapshot = ref.get(field_paths=SCORE_FIELDS, transaction=transaction)
+    scores = score_update(snapshot.to_dict() if snapshot.exists else {}, sentiment, now)
+    transaction.set(ref, {**fields, **scores}, merge=True)
+    return scores
+
+
+async def _record_async(transaction, ref, sentiment, fields, now):
+    snapshot = await ref.get(field_paths=SCORE_FIELDS, transaction=transaction)
+    scores = score_update(snapshot.to_dict() if snapshot.exists else {}, sentiment, now)
+    transaction.set(ref, {**fields, **scores}, merge=True)
+    return scores
+
+
+def record_interaction(db, ref, sentiment, fields, now=None):
+    """
+    Merges `fields` (name, last_type, history ArrayUnion, ...) into the relation
+    document `ref` together with the updated scores, in one transaction.
+    Returns the new score fields.
+    """
+    record = firestore.transactional(_record)
+    return record(db.transaction(), ref, sentiment, fields, now or datetime.now(timezone.utc))
+
+
+async def record_interaction_async(db, ref, sentiment, fields, now=None):
+    record = firestore.async_transactional(_record_async)
+    return await record(db.transaction(), ref, sentiment, fields, now or datetime.now(timezone.utc))
+
+
+# ------------------ Listing ------------------
+# Fields /relations reads when the caller doesn't want the history arrays
+LIST_FIELDS = ["name", "last_interaction", "last_type"] + SCORE_FIELDS[:4]
+
+SORT_KEYS = {
+    "recent": lambda r: r.get("last_interaction") or "",
+    "sentiment": lambda r: r["sentiment_score"],
+    "rate": lambda r: r["interaction_rate"],
+}
+
+
+def rank_relations(relations, sort="recent", descending=True, label=None, min_sentiment=None,
+                   max_sentiment=None, min_rate=None, limit=None):
+    """Filters and orders /relations entries (each carrying current_scores()) in memory."""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    out = [r for r in relations
+           if (label is None or r["sentiment_label"] == label)
+           and (min_sentiment is None or r["sentiment_score"] >= min_sentiment)
+           and (max_sentiment is None or r["sentiment_score"] <= max_sentiment)
+           and (min_rate is None or r["interaction_rate"] >= min_rate)]
+    out.sort(key=SORT_KEYS[sort], reverse=descending)
+    return out[:limit] if limit else out
+
+
+def relation_list_args(args):
+    """
+    /relations query parameters -> (rank_relations kwargs, include_history).
+    ?sort=recent|sentiment|rate &order=desc|asc &label=positive|neutral|conflict
+    &min_sentiment= &max_sentiment= &min_rate= &limit= &history=0
+    ValueError on bad values.
+    """
+    def number(name, kind=float):
+        raw = args.get(name)
+        if raw in (None, ""):
+            return None
+        try:
+            return kind(raw)
+        except ValueError:
+            raise ValueError(f"{name} must be a number") from None
+
+    label = args.get("label") or None
+    if label is not None and label not in ("positive", "neutral", "conflict"):
+        raise ValueError("label must be positive, neutral or conflict")
+    order = args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    kwargs = {
+        "sort": args.get("sort", "recent"),
+        "descending": order == "desc",
+        "label": label,
+        "min_sentiment": number("min_sentiment"),
+        "max_sentiment": number("max_sentiment"),
+        "min_rate": number("min_rate"),
+        "limit": number("limit", int),
+    }
+    if kwargs["sort"] not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    return kwargs, args.get("history", "1") not in ("0", "false", "no")
+
+
+def relation_entry(data, include_history=True, now=None):
+    """One /relations item: the stored fields plus the scores as of now."""
+    last = data.get("last_interaction")
+    entry = {
+        "name": data.get("name", ""),
+        "last_interaction": last.isoformat() if hasattr(last, "isoformat") else last,
+        "last_type": data.get("last_type", "neutral"),
+        **current_scores(data, now),
+    }
+    if include_history:
+        entry["history"] = data.get("history", [])
+    return entry
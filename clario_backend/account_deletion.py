@@ -0,0 +1,215 @@
+# account_deletion.py
+"""
+Deletes everything stored about one user across the backends: the
+users/{uid} document with all nested subcollections (chats, chat_chunks,
+relationships, notifications, usage, ...) in the main project, the same tree
+in every other project a backend writes to (emptyChair's
+sessions/{id}/messages live in its own project), and the RTDB users/{uid}
+node with its journals.
+
+Subcollections are discovered, not listed by hand, so collections added
+later are covered. Each collection is one task on a bounded thread pool;
+documents are deleted a page at a time through a Firestore BulkWriter, and
+any subcollections found under a document become new tasks. Parents may go
+before their children: a deleted document that still has subcollections is
+listed as "missing" and is found again on a rerun.
+
+Progress is checkpointed in deletionJobs/{uid} (outside the user's tree) every
+CHECKPOINT_INTERVAL seconds: status, phases done, documents deleted, elapsed
+time, docs/sec. Each project is its own phase.
+A rerun after an interruption picks up where the data stops; pages already
+deleted are simply gone, so no cursor is needed. A rerun of a finished job
+starts a fresh pass over every phase, since a client still holding a valid
+token may have written users/{uid} back in the meantime. (clario's
+verify_token refuses a uid once its job document exists, and the job document
+is never deleted, so clario's own endpoints can't.) The Auth user is deleted
+by the caller, after run() returns.
+"""
+import time
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from google.cloud import firestore
+
+log = logging.getLogger("account_deletion")
+
+# ------------------ CONFIG ------------------
+DELETE_PARALLELISM = 8 # collections deleted concurrently
+DELETE_PAGE_SIZE = 500 # documents listed and flushed per page
+RTDB_PAGE_SIZE = 500 # journal keys removed per multi-path update
+CHECKPOINT_INTERVAL = 2.0 # seconds between progress writes (one job document, many workers)
+JOBS_COLLECTION = "deletionJobs"
+
+# Documents in these collections never have subcollections, so skip the
+# per-document ListCollectionIds call (chats alone can hold thousands).
+LEAF_COLLECTIONS = frozenset({
+    "chats", "chat_chunks", "messages", "notifications", "notificationState",
+    "usage", "usageStats", "relationships", "relations",
+})
+
+
+class DeletionStalled(Exception):
+    """Documents were still there after their collection was deleted (writes failing)."""
+
+
+class AccountDeletion:
+    def __init__(self, db, user_id, rtdb_reference=None, other_dbs=None, parallelism=DELETE_PARALLELISM,
+                 page_size=DELETE_PAGE_SIZE):
+        self.db = db
+        self.user_id = user_id
+        self.rtdb_reference = rtdb_reference
+        self.other_dbs = other_dbs or {}  # name -> client of another project holding a users/{uid} tree
+        self.parallelism = parallelism
+        self.page_size = page_size
+        self.job_ref = db.collection(JOBS_COLLECTION).document(user_id)
+        self.deleted = 0
+        self._unsaved = 0
+        self._last_saved = 0.0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        self._errors = []
+
+    # ---- checkpoint ----
+    def _checkpoint(self, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc)
+        self.job_ref.set(fields, merge=True)
+
+    def run(self):
+        """Deletes the account's data; returns the job stats. Safe to call again after a failure."""
+        job = self.job_ref.get()
+        state = job.to_dict() if job.exists else {}
+        phases_done = set(state.get("phases_done", []))
+        if state.get("status") == "done":
+            # a fresh pass: anything written back since the last one goes too
+            phases_done = set()
+            self._checkpoint(status="running", phases_done=[], resumes=firestore.Increment(1))
+        elif job.exists:
+            self._checkpoint(status="running", resumes=firestore.Increment(1))
+        else:
+            self._checkpoint(status="running", started_at=datetime.now(timezone.utc), docs_deleted=0, resumes=0)
+        started = time.monotonic()
+        try:
+            stores = [("firestore", self.db)] + [(f"firestore:{name}", db) for name, db in self.other_dbs.items()]
+            for phase, db in stores:
+                if phase not in phases_done:
+                    self._delete_firestore(db)
+                    self._checkpoint(phases_done=firestore.ArrayUnion([phase]))
+            if "rtdb" not in phases_done and self.rtdb_reference is not None:
+                rtdb_deleted = self._delete_rtdb()
+                self._checkpoint(phases_done=firestore.ArrayUnion(["rtdb"]),
+                                 rtdb_entries_deleted=firestore.Increment(rtdb_deleted))
+        except Exception as e:
+            self._save_count()
+            self._finish(started, "failed", error=str(e))
+            raise
+        return self._finish(started, "done")
+
+    def _finish(self, started, status, **extra):
+        elapsed = time.monotonic() - started
+        self._checkpoint(status=status, elapsed_s=firestore.Increment(round(elapsed, 3)), **extra)
+        stats = self.job_ref.get().to_dict()
+        total_s = stats.get("elapsed_s") or 0
+        stats["docs_per_sec"] = round(stats.get("docs_deleted", 0) / total_s, 1) if total_s else None
+        self._checkpoint(docs_per_sec=stats["docs_per_sec"])
+        log.info("Account deletion %s for %s: %s docs in %.1fs (%s docs/sec)", status, self.user_id,
+                 stats.get("docs_deleted", 0), total_s, stats["docs_per_sec"])
+        return stats
+
+    # ---- Firestore ----
+    def _delete_firestore(self, db):
+        user_ref = db.collection("users").document(self.user_id)
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            self._pool = pool
+            for collection in user_ref.collections():
+                self._submit(db, collection)
+            with self._idle:
+                while self._pending:
+                    self._idle.wait()
+        if self._errors:
+            raise self._errors[0]
+        user_ref.delete()  # last, so a rerun still starts from the user document
+        self._count(1)
+        self._save_count()
+
+    def _submit(self, db, collection):
+        with self._lock:
+            self._pending += 1
+        self._pool.submit(self._run_task, db, collection)
+
+    def _run_task(self, db, collection):
+        try:
+            self._delete_collection(db, collection)
+        except Exception as e:
+            log.exception("Deleting %s failed: %s", collection.id, e)
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _delete_collection(self, db, collection):
+        leaf = collection.id in LEAF_COLLECTIONS
+        writer = db.bulk_writer()
+        handled = set()  # deleted parents stay listed as "missing" until their subcollections are gone
+        try:
+            while not self._errors:
+                listing = collection.list_documents(page_size=self.page_size)
+                refs = list(itertools.islice((r for r in listing if r.path not in handled), self.page_size))
+                if not refs:
+                    break
+                for ref in refs:
+                    handled.add(ref.path)
+                    if not leaf:
+                        for sub in ref.collections():
+                            self._submit(db, sub)
+                    writer.delete(ref)
+                writer.flush()
+                self._count(len(refs))
+        finally:
+            writer.close()
+        if not self._errors and list(collection.limit(1).stream()):
+            raise DeletionStalled(f"{collection.id}: documents left after deletion")
+
+    def _count(self, n):
+        with self._lock:
+            self.deleted += n
+            self._unsaved += n
+            due = time.monotonic() - self._last_saved >= CHECKPOINT_INTERVAL
+        if due:
+            self._save_count()
+
+    def _save_count(self):
+        with self._lock:
+            n, self._unsaved = self._unsaved, 0
+            self._last_saved = time.monotonic()
+        if n:
+            self._checkpoint(docs_deleted=firestore.Increment(n))
+
+    # ---- Realtime Database ----
+    def _delete_rtdb(self):
+        """Journals go in pages of keys (one multi-path update each), then the user node itself."""
+        user_node = self.rtdb_reference(f"users/{self.user_id}")
+        journals = user_node.child("journals")
+        deleted = 0
+        while True:
+            keys = list(itertools.islice(journals.get(shallow=True) or {}, RTDB_PAGE_SIZE))
+            if not keys:
+                break
+            journals.update({key: None for key in keys})
+            deleted += len(keys)
+        user_node.delete()
+        return deleted
+
+
+def delete_account(db, user_id, rtdb_reference=None, other_dbs=None, **kwargs):
+    """
+    Runs (or resumes) the deletion in `db` (which also holds the job document)
+    and in each of `other_dbs` ({name: client}); returns stats incl.
+    docs_deleted, elapsed_s and docs_per_sec.
+    """
+    return AccountDeletion(db, user_id, rtdb_reference, other_dbs, **kwargs).run()
@@ -0,0 +1,177 @@
+# asgi.py
+"""
+Async (ASGI) variant of Clario's /chat and /onboarding routes, with the same
+request and response shapes as the Flask routes in main.py, on Quart,
+Firestore's AsyncClient and google-generativeai's generate_content_async.
+
+A request waiting on Gemini or Firestore yields the event loop instead of
+holding a worker thread, so one instance keeps far more chats in flight. The
+profile and history reads overlap, as do the user-message write and the
+reply generation.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+The Cloud Functions (analyzeMood, generateAvatar, ...) stay in main.py.
+Model calls share main.py's per-quota AIMD limiter.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from quart import Quart, request, jsonify
+from firebase_admin import auth
+from google.cloud import firestore
+import google.generativeai as genai
+from crisis import scan_message, SAFETY_RESPONSE, CRISIS_RESOURCES
+from llm_gateway import AsyncLLMGateway, metrics_snapshot
+from structured_output import parse_stats
+from tracing import span, install_quart, timing_snapshot
+from async_logging import log_payload, log_stats
+from chat_archive import load_recent_messages_async
+from account_deletion import JOBS_COLLECTION
+from main import (
+    PROJECT_ID, GEMINI_MODEL_CHAT, MAX_RECENT_HISTORY, ONBOARDING_QUESTIONS_FULL, CHAT_FALLBACK_REPLY, gemini_api_limiter,
+    build_chat_prompt, history_turn, next_onboarding_index, record_onboarding_answer,
+)
+
+log = logging.getLogger("clario.asgi")
+
+# ------------------ Initialize Clients ------------------
+db_firestore = firestore.AsyncClient(project=PROJECT_ID)
+chat_gateway = AsyncLLMGateway("chat_reply_async", deadline=20.0, hedge=True, limiter=gemini_api_limiter)
+
+app = Quart(__name__)
+install_quart(app)
+
+# ------------------ Authentication Helper ------------------
+async def verify_token():
+    """
+    Verifies the Firebase Auth token on the current request; None if missing
+    or invalid, or if an account deletion has started for the uid (as in
+    main.verify_token).
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        log.info("Missing or invalid Authorization header")
+        return None
+    id_token = auth_header.split(' ').pop()
+    try:
+        # verify_id_token may fetch Google's signing certs over the network; keep it off the loop
+        with span("auth"):
+            decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token)
+            deletion = await db_firestore.collection(JOBS_COLLECTION).document(decoded_token["uid"]).get()
+        if deletion.exists:
+            log.warning("Refusing token for %s: account deletion started", decoded_token["uid"])
+            return None
+        return decoded_token
+    except Exception as e:
+        log.warning("Error verifying token: %s", e)
+        return None
+
+# ------------------ Firestore Utilities ------------------
+async def get_user_profile(user_id):
+    with span("firestore_read"):
+        doc = await db_firestore.collection("users").document(user_id).get()
+    return doc.to_dict() if doc.exists else {}
+
+async def save_user_profile(user_id, profile_data):
+    with span("firestore_write"):
+        await db_firestore.collection("users").document(user_id).set(profile_data, merge=True)
+
+async def save_chat_message(user_id, role, text):
+    with span("firestore_write"):
+        await db_firestore.collection("users").document(user_id).collection("chats").document().set({
+            "role": role, "text": text, "ts": datetime.now(timezone.utc)
+        })
+
+async def load_history(user_id):
+    with span("firestore_read"):
+        messages = await load_recent_messages_async(db_firestore, user_id, MAX_RECENT_HISTORY * 2)
+    return [history_turn(m) for m in messages]
+
+async def flag_crisis_follow_up(user_id, matched_phrase):
+    with span("firestore_write"):
+        await db_firestore.collection("users").document(user_id).set({
+            "crisis_follow_up": {
+                "pending": True,
+                "flagged_at": datetime.now(timezone.utc),
+                "matched_phrase": matched_phrase,
+            }
+        }, merge=True)
+
+# --- Gemini Chat Helper ---
+async def generate_gemini_chat_reply(history, user_message, profile):
+    try:
+        model = genai.GenerativeModel(GEMINI_MODEL_CHAT)
+        with span("generate"):
+            response = await chat_gateway.generate(model, build_chat_prompt(history, user_message, profile))
+        reply_text = response.text.strip()
+        log_payload("chat_reply", "Gemini chat reply generated", reply_text)
+        return reply_text
+    except Exception as e:
+        log.error("Error generating Gemini chat reply: %s", e)
+        return CHAT_FALLBACK_REPLY
+
+# --- Routes ---
+@app.route("/chat", methods=["POST"])
+async def chat():
+    try:
+        decoded_token = await verify_token()
+        if not decoded_token: return jsonify({"error": "Unauthorized"}), 401
+        user_id = decoded_token["uid"]
+
+        body = await request.get_json()
+        user_message = body.get("message", "").strip()
+
+        # --- Crisis fast path: answer locally, before any Firestore read or model call ---
+        crisis_phrase = scan_message(user_message)
+        if crisis_phrase:
+            log.warning("Crisis phrase detected for user %s; returning safety response.", user_id)
+            await save_chat_message(user_id, "user", user_message)
+            await asyncio.gather(
+                save_chat_message(user_id, "assistant", SAFETY_RESPONSE),
+                flag_crisis_follow_up(user_id, crisis_phrase))
+            return jsonify({"reply": SAFETY_RESPONSE, "crisis": True, "resources": CRISIS_RESOURCES})
+
+        # Onboarded users are the common case, so read the history alongside the profile
+        profile, history = await asyncio.gather(get_user_profile(user_id), load_history(user_id))
+        if not profile.get("onboarding_complete", False):
+           return jsonify({"error": "Please complete onboarding first via /onboarding route."}), 400
+
+        _, reply = await asyncio.gather(
+            save_chat_message(user_id, "user", user_message),
+            generate_gemini_chat_reply(history, user_message, profile))
+
+        await save_chat_message(user_id, "assistant", reply)
+        return jsonify({"reply": reply})
+
+    except Exception as e:
+        log.exception("Error in /chat route: %s", e)
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@app.route("/onboarding", methods=["POST"])
+async def onboarding():
+    try:
+        decoded_token = await verify_token()
+        if not decoded_token: return jsonify({"error": "Unauthorized"}), 401
+        user_id = decoded_token["uid"]
+        body = await request.get_json()
+        user_response = body.get("answer", "").strip()
+        profile_data = await get_user_profile(user_id)
+        if record_onboarding_answer(profile_data, user_response):
+            await save_user_profile(user_id, profile_data)
+        next_question_index = next_onboarding_index(profile_data)
+        if next_question_index >= len(ONBOARDING_QUESTIONS_FULL):
+            profile_data["onboarding_complete"] = True
+            await save_user_profile(user_id, profile_data)
+            return jsonify({"status": "complete", "message": "Onboarding completed!"})
+        return jsonify({"status": "in_progress", "question": ONBOARDING_QUESTIONS_FULL[next_question_index]})
+    except Exception as e:
+        log.exception("Error in /onboarding route: %s", e)
+        return jsonify({"status": "error", "message": "An internal server error occurred"}), 500
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    return jsonify({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                    "structured_output": parse_stats()}), 200
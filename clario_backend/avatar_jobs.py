@@ -0,0 +1,87 @@
+# avatar_jobs.py
+import os
+import logging
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("avatar_jobs")
+
+# ------------------ CONFIG ------------------
+AVATAR_JOB_WORKERS = int(os.environ.get("AVATAR_JOB_WORKERS", "4"))
+AVATAR_JOB_TTL_SECONDS = 15 * 60  # finished jobs are forgotten after this long
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class AvatarJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = JOB_PENDING
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        out = {"job_id": self.job_id, "status": self.status}
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+class AvatarJobQueue:
+    """
+    Runs avatar generation on a background thread pool.
+    Jobs are keyed by the caller (the avatar content hash), so a submission
+    for a prompt that is already in flight joins the existing job instead of
+    starting a second Imagen call.
+    Note: background work needs CPU after the response is sent, so deploy with
+    CPU always allocated (Cloud Run --no-cpu-throttling).
+    """
+
+    def __init__(self, workers=AVATAR_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="avatar-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, fn):
+        """Schedules fn() under job_id unless that job is already pending/running. Returns the job."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job and job.status in (JOB_PENDING, JOB_RUNNING):
+                return job
+            job = AvatarJob(job_id)
+            self._jobs[job_id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn):
+        job.status = JOB_RUNNING
+        try:
+            fn()
+            job.status = JOB_DONE
+        except Exception as e:
+            log.error("Avatar job %s failed: %s", job.job_id, e)
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+
+    def _prune(self):
+        cutoff = time.time() - AVATAR_JOB_TTL_SECONDS
+        stale = [k for k, j in self._jobs.items() if j.finished_at and j.finished_at < cutoff]
+        for k in stale:
+            del self._jobs[k]
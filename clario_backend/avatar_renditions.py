@@ -0,0 +1,70 @@
+# avatar_renditions.py
+import io
+import sys
+from PIL import Image
+
+# ------------------ CONFIG ------------------
+RENDITION_SIZES = (64, 128, 512)
+RENDITION_FORMATS = {
+    # format name -> (Pillow encoder, content type, save options)
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+DEFAULT_RENDITION_FORMAT = "webp"
+
+
+def rendition_key(avatar_id, size, fmt):
+    return f"{avatar_id}-{size}.{fmt}"
+
+
+def pick_size(requested):
+    """Smallest rendition that is at least the requested size, else the largest one."""
+    for size in RENDITION_SIZES:
+        if size >= requested:
+            return size
+    return RENDITION_SIZES[-1]
+
+
+def make_renditions(image_bytes):
+    """
+    Decodes the source image once and returns {(size, fmt): bytes} for every
+    configured size and format.
+    """
+    source = Image.open(io.BytesIO(image_bytes))
+    source.load()
+    renditions = {}
+    for size in RENDITION_SIZES:
+        resized = source.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for fmt, (encoder, _, options) in RENDITION_FORMATS.items():
+            img = resized
+            if encoder == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buf = io.BytesIO()
+            img.save(buf, format=encoder, **options)
+            renditions[(size, fmt)] = buf.getvalue()
+    return renditions
+
+
+def payload_report(original_bytes, renditions):
+    """Bytes per rendition and reduction vs the original, for logs and measurement."""
+    original_len = len(original_bytes)
+    report = {"original_bytes": original_len, "renditions": {}}
+    for (size, fmt), data in sorted(renditions.items()):
+        report["renditions"][f"{size}.{fmt}"] = {
+            "bytes": len(data),
+            "reduction_pct": round(100.0 * (1 - len(data) / original_len), 1) if original_len else 0.0,
+        }
+    return report
+
+
+# Measure payload reduction for a local image: python avatar_renditions.py avatar.png
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "../assets/images/default_neutral_avatar.png"
+    with open(path, "rb") as f:
+        original = f.read()
+    report = payload_report(original, make_renditions(original))
+    # base64 inflates by 4/3, which is what generateAvatar used to return inline
+    print(f"original: {report['original_bytes']} bytes ({len(original) * 4 // 3} as base64)")
+    for name, r in report["renditions"].items():
+        print(f"{name:>10}: {r['bytes']:>8} bytes  (-{r['reduction_pct']}%)")
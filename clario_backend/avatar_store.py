@@ -0,0 +1,99 @@
+# avatar_store.py
+import os
+import logging
+import hashlib
+import base64
+
+log = logging.getLogger("avatar_store")
+
+# ------------------ CONFIG ------------------
+AVATAR_STORE_DIR = os.environ.get("AVATAR_STORE_DIR", "/tmp/clario_avatars")
+AVATAR_BUCKET = os.environ.get("AVATAR_BUCKET")  # if set, store avatars in GCS instead
+DEFAULT_AVATAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_avatar_base64.txt")
+DEFAULT_AVATAR_ID = "default"
+
+
+def avatar_key(safe_prompt: str) -> str:
+    """Content address for an avatar: sha256 of the sanitized prompt."""
+    return hashlib.sha256(safe_prompt.encode("utf-8")).hexdigest()
+
+
+def sniff_content_type(data: bytes) -> str:
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class LocalAvatarStore:
+    """Avatars as files named by their key. Writes go through a temp file + rename."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data: bytes):
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+
+class GCSAvatarStore:
+    """Same interface as LocalAvatarStore, backed by a Cloud Storage bucket."""
+
+    def __init__(self, bucket_name, prefix="avatars/"):
+        from google.cloud import storage  # only needed when AVATAR_BUCKET is configured
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+
+    def get(self, key):
+        blob = self.bucket.blob(self.prefix + key)
+        try:
+            return blob.download_as_bytes()
+        except Exception:
+            return None
+
+    def exists(self, key):
+        """A metadata request; the image itself isn't downloaded."""
+        try:
+            return self.bucket.blob(self.prefix + key).exists()
+        except Exception:
+            return False
+
+    def put(self, key, data: bytes):
+        blob = self.bucket.blob(self.prefix + key)
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_string(data, content_type=sniff_content_type(data))
+
+
+def create_store():
+    if AVATAR_BUCKET:
+        return GCSAvatarStore(AVATAR_BUCKET)
+    return LocalAvatarStore(AVATAR_STORE_DIR)
+
+
+def load_default_avatar(path=DEFAULT_AVATAR_FILE):
+    """Reads and decodes the static fallback avatar. Called once per instance."""
+    try:
+        with open(path, "r") as f:
+            return base64.b64decode(f.read().strip())
+    except Exception as e:
+        log.warning("Could not load default avatar from %s: %s", path, e)
+        return None
@@ -0,0 +1,168 @@
+# chat_archive.py
+"""
+Chunked, compressed archive of users/{uid}/chats, shared by the backends
+that read chat history (identical copies live next to each main.py).
+
+Every chat message is its own document, so reading a long-time user's full
+history costs one read per message. compact_history() packs messages older
+than a cutoff into users/{uid}/chat_chunks documents of CHUNK_SIZE messages:
+zlib-compressed JSON in a bytes field, plus the chunk's time range and count.
+The chunk write and the deletes of its messages commit in one batch, so an
+interrupted run leaves nothing half-moved and is safe to repeat.
+
+Readers merge chunks and live messages, oldest first:
+
+    load_messages(db, uid)              # full history: 1 read per chunk + 1 per live message
+    load_recent_messages(db, uid, 20)   # last 20; opens chunks only if live messages run short
+
+Both read the live messages before the chunks and drop duplicates by message
+id, so a compaction committing in between neither loses nor repeats messages.
+The *_async variants take a firestore.AsyncClient.
+"""
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+# ------------------ CONFIG ------------------
+CHUNK_SIZE = 200 # messages per chunk document
+ARCHIVE_AFTER = timedelta(days=30) # messages older than this are compacted
+MAX_CHUNK_BYTES = 900_000 # compressed payload cap, under Firestore's 1 MiB document limit
+MAX_BATCH_WRITES = 500 # Firestore batch limit: one chunk write + its message deletes
+CHUNK_FORMAT = "zlib-json-v1"
+CHUNKS_COLLECTION = "chat_chunks"
+
+
+# ------------------ Encoding ------------------
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    raise TypeError(f"cannot archive {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def pack_messages(messages):
+    """Messages (dicts, datetimes allowed) -> compressed bytes for a chunk's `data` field."""
+    raw = json.dumps(messages, default=_encode, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(raw.encode("utf-8"), 6)
+
+
+def unpack_chunk(chunk):
+    """A chunk document's dict -> its messages, oldest first."""
+    if chunk.get("format") != CHUNK_FORMAT:
+        raise ValueError(f"unknown chat chunk format {chunk.get('format')!r}")
+    return json.loads(zlib.decompress(chunk["data"]).decode("utf-8"), object_hook=_decode)
+
+
+def _message(doc):
+    return {"id": doc.id, **doc.to_dict()}
+
+
+def _merge(archived, live):
+    seen = {m.get("id") for m in archived}
+    return archived + [m for m in live if m["id"] not in seen]
+
+
+def _chunk_id(first):
+    ts = first.get("ts")
+    stamp = ts.strftime("%Y%m%dT%H%M%S%f") if isinstance(ts, datetime) else "0"
+    return f"{stamp}-{first['id']}"  # sorts by time, unique per first message
+
+
+# ------------------ Compaction ------------------
+def compact_history(db, user_id, older_than=None, chunk_size=CHUNK_SIZE, max_chunks=None):
+    """
+    Moves messages with ts < older_than (default: now - ARCHIVE_AFTER) into
+    chunk documents. Only full chunks are written; the remainder stays live
+    until enough messages age past the cutoff. Returns (chunks, messages).
+    """
+    cutoff = older_than or datetime.now(timezone.utc) - ARCHIVE_AFTER
+    chunk_size = min(chunk_size, MAX_BATCH_WRITES - 1)
+    user_ref = db.collection("users").document(user_id)
+    chats = user_ref.collection("chats")
+    chunks = user_ref.collection(CHUNKS_COLLECTION)
+
+    written = archived = 0
+    while max_chunks is None or written < max_chunks:
+        docs = list(chats.where("ts", "<", cutoff).order_by("ts").limit(chunk_size).stream())
+        if len(docs) < chunk_size:
+            break
+        messages = [_message(doc) for doc in docs]
+        data = pack_messages(messages)
+        while len(data) > MAX_CHUNK_BYTES and len(messages) > 1:  # unusually long messages
+            messages = messages[:len(messages) // 2]
+            data = pack_messages(messages)
+
+        batch = db.batch()
+        batch.set(chunks.document(_chunk_id(messages[0])), {
+            "format": CHUNK_FORMAT,
+            "start_ts": messages[0].get("ts"),
+            "end_ts": messages[-1].get("ts"),
+            "count": len(messages),
+            "data": data,
+            "created_at": firestore.SERVER_TIMESTAMP,
+        })
+        for doc in docs[:len(messages)]:
+            batch.delete(doc.reference)
+        batch.commit()
+        written += 1
+        archived += len(messages)
+    return written, archived
+
+
+# ------------------ Readers ------------------
+def load_messages(db, user_id):
+    """Full history, oldest first, as dicts with id, role, text, ts."""
+    user_ref = db.collection("users").document(user_id)
+    live = [_message(doc) for doc in user_ref.collection("chats").order_by("ts").stream()]
+    archived = []
+    for chunk in user_ref.collection(CHUNKS_COLLECTION).order_by("start_ts").stream():
+        archived.extend(unpack_chunk(chunk.to_dict()))
+    return _merge(archived, live)
+
+
+def load_recent_messages(db, user_id, limit):
+    """The last `limit` messages, oldest first."""
+    user_ref = db.collection("users").document(user_id)
+    live = [_message(doc) for doc in user_ref.collection("chats")
+            .order_by("ts", direction=firestore.Query.DESCENDING).limit(limit).stream()]
+    live.reverse()
+    if len(live) >= limit:
+        return live
+    archived = []
+    for chunk in user_ref.collection(CHUNKS_COLLECTION).order_by(
+            "end_ts", direction=firestore.Query.DESCENDING).stream():
+        archived[:0] = unpack_chunk(chunk.to_dict())
+        if len(archived) + len(live) >= limit:
+            break
+    return _merge(archived, live)[-limit:]
+
+
+async def load_messages_async(db, user_id):
+    user_ref = db.collection("users").document(user_id)
+    live = [_message(doc) async for doc in user_ref.collection("chats").order_by("ts").stream()]
+    archived = []
+    async for chunk in user_ref.collection(CHUNKS_COLLECTION).order_by("start_ts").stream():
+        archived.extend(unpack_chunk(chunk.to_dict()))
+    return _merge(archived, live)
+
+
+async def load_recent_messages_async(db, user_id, limit):
+    user_ref = db.collection("users").document(user_id)
+    live = [_message(doc) async for doc in user_ref.collection("chats")
+            .order_by("ts", direction=firestore.Query.DESCENDING).limit(limit).stream()]
+    live.reverse()
+    if len(live) >= limit:
+        return live
+    archived = []
+    async for chunk in user_ref.collection(CHUNKS_COLLECTION).order_by(
+            "end_ts", direction=firestore.Query.DESCENDING).stream():
+        archived[:0] = unpack_chunk(chunk.to_dict())
+        if len(archived) + len(live) >= limit:
+            break
+    return _merge(archived, live)[-limit:]
@@ -0,0 +1,115 @@
+# crisis.py
+"""
+Local crisis-phrase scanner. Runs before any model call so that messages
+showing self-harm risk get a vetted safety reply immediately instead of
+waiting on Gemini. Kept identical (with crisis_corpus.jsonl) in clario_backend/
+and RelationAI/.
+
+    python crisis.py [corpus.jsonl]   # labelled-corpus accuracy + per-message benchmark
+"""
+import os
+import re
+import sys
+import json
+import time
+
+# One alternation compiled once at import; the regex engine walks every
+# phrase in a single pass over the message.
+CRISIS_PHRASES = [
+    r"kill(?:ing)? my ?self",
+    r"end(?:ing)? (?:my (?:own )?life|it all)",
+    r"take my (?:own )?life",
+    r"suicid(?:e|al)",
+    r"want(?:s|ed)? to die",
+    r"wish (?:i was|i were|i'd) (?:dead|never born)",
+    r"(?:don't|dont|do not|no longer|never) want to (?:live|be alive|exist|wake up)",
+    r"better off (?:dead|without me)",
+    r"(?:no|nothing) (?:reason )?(?:left )?to live for",
+    r"no reason to live",
+    r"can't go on (?:anymore|like this|living)",
+    r"(?:hurt|harm|cut|cutting|hurting|harming) my ?self",
+    r"self[- ]harm(?:ing)?",
+    r"overdos(?:e|ing) on",
+    r"hang(?:ing)? my ?self",
+    r"jump(?:ing)? (?:off|from) (?:a|the) (?:bridge|building|roof|cliff)",
+]
+CRISIS_REGEX = re.compile(r"\b(?:" + "|".join(CRISIS_PHRASES) + r")\b", re.IGNORECASE)
+
+# A negator cancels a match only when it modifies the phrase itself: right
+# before it ("I'm not suicidal", "I don't want to die") or joined to it by
+# words that carry the same verb phrase on ("I'm not going to kill myself",
+# "I would never ever hurt myself"). Anything else in between, including
+# punctuation, ends the negation: "I'm not okay i want to die" and "no point
+# i want to die" are crises.
+NEGATORS = {"not", "never", "no", "don't", "dont", "won't", "wouldn't", "isn't", "aren't", "wasn't"}
+NEGATION_BRIDGE = {"going", "gonna", "want", "wanna", "to", "ever", "really", "actually", "even", "be",
+                   "planning", "trying", "thinking", "about", "of", "feeling"}
+NEGATION_WINDOW = 3 # bridge words allowed between the negator and the phrase
+
+SAFETY_RESPONSE = (
+    "I'm really sorry you're feeling this way, and I'm glad you told me. "
+    "You don't have to go through this alone. Please reach out right now to someone who can help: "
+    "a crisis line, emergency services, or someone you trust. "
+    "If you're in immediate danger, please call your local emergency number."
+)
+CRISIS_RESOURCES = [
+    {"name": "Tele-MANAS (India)", "contact": "14416 or 1-800-891-4416"},
+    {"name": "988 Suicide & Crisis Lifeline (US)", "contact": "Call or text 988"},
+    {"name": "Samaritans (UK & ROI)", "contact": "116 123"},
+    {"name": "Find a helpline in your country", "contact": "https://findahelpline.com"},
+]
+
+
+def normalize(text):
+    return " ".join(text.replace("’", "'").replace("‘", "'").lower().split())
+
+
+def _is_negated(text, start):
+    for word in reversed(text[:start].split()[-(NEGATION_WINDOW + 1):]):
+        if word in NEGATORS:
+            return True
+        if word not in NEGATION_BRIDGE:
+            return False
+    return False
+
+
+def scan_message(text):
+    """Returns the first non-negated crisis phrase found in text, or None."""
+    if not text:
+        return None
+    text = normalize(text)
+    for match in CRISIS_REGEX.finditer(text):
+        if not _is_negated(text, match.start()):
+            return match.group(0)
+    return None
+
+
+def _evaluate(corpus_path):
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    tp = fp = fn = 0
+    for s in samples:
+        hit = scan_message(s["text"]) is not None
+        if hit and s["crisis"]:
+            tp += 1
+        elif hit:
+            fp += 1
+            print(f"  false positive: {s['text']}")
+        elif s["crisis"]:
+            fn += 1
+            print(f"  missed: {s['text']}")
+    print(f"{len(samples)} samples: recall={tp / max(tp + fn, 1):.2f} precision={tp / max(tp + fp, 1):.2f}")
+
+    rounds = 2000
+    texts = [s["text"] for s in samples]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            scan_message(t)
+    per_msg_us = (time.perf_counter() - start) / (rounds * len(texts)) * 1e6
+    print(f"scan_message: {per_msg_us:.1f} µs/message")
+
+
+if __name__ == "__main__":
+    default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_corpus.jsonl")
+    _evaluate(sys.argv[1] if len(sys.argv) > 1 else default_corpus)
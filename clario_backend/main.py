@@ -1,8 +1,10 @@
 import os
 import json
+import logging
 import re # For parsing Gemini response
-from datetime import datetime, timezone
-from flask import Flask, request, jsonify
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from flask import Flask, Response, request, jsonify, stream_with_context
 import firebase_admin
 from firebase_admin import auth, credentials, initialize_app, db as rtdb # Use RTDB for simplicity with getCurrentAvatar example
 from google.cloud import firestore # Keep if used by Flask routes
@@ -17,17 +19,58 @@ from vertexai.generative_models import GenerativeModel
 import vertexai
 import base64
 from vertexai.preview.vision_models import ImageGenerationModel
+from avatar_store import (
+    avatar_key, create_store, load_default_avatar, sniff_content_type, DEFAULT_AVATAR_ID
+)
+from avatar_jobs import AvatarJobQueue, JOB_DONE
+from crisis import scan_message, SAFETY_RESPONSE, CRISIS_RESOURCES
+from structured_output import parse_stats, parse_structured, schema_config
+from llm_gateway import LLMGateway, canonical_key, limiter_for, metrics_snapshot
+from tracing import span, traced, install_flask, timing_snapshot
+from async_logging import setup_logging, log_payload, log_stats
+from usage_sketch import UsageSketch
+from quote_service import QuoteService, load_local_pool, utc_today
+from chat_archive import compact_history, load_recent_messages
+from user_export import EXPORT_FORMATS, iter_user_export, stream_ndjson, stream_zip
+from account_deletion import JOBS_COLLECTION, delete_account
+from avatar_renditions import (
+    make_renditions, payload_report, pick_size, rendition_key, RENDITION_FORMATS, DEFAULT_RENDITION_FORMAT
+)
 
 # ------------------ CONFIG ------------------
 PROJECT_ID = "clario-f60b0" # Your Project ID
 LOCATION = "us-central1"
 GEMINI_MODEL_CHAT = "gemini-pro" # Model for chat
-GEMINI_MODEL_ANALYSIS = "gemini-pro"# Model for sentiment analysis
+GEMINI_MODEL_ANALYSIS = "gemini-2.0-flash" # Sentiment + quotes: structured output, no thinking tokens
 
 CRON_SECRET = os.environ.get("DAILY_QUOTE_SECRET", "REPLACE_THIS_WITH_A_REAL_SECRET")
+AVATAR_JOB_MAX_WAIT = 25.0 # seconds a getAvatarJob long-poll may hold the request
+# Public URL of the getAvatar function; avatar ids are appended as ?id=<hash>
+AVATAR_BASE_URL = os.environ.get("AVATAR_BASE_URL", f"https://{LOCATION}-{PROJECT_ID}.cloudfunctions.net/getAvatar")
+AVATAR_FALLBACK_MAX_AGE = 300 # seconds a rendition URL answered with the original may be cached
 # --- END NEW ADDITION ---
 
 MAX_RECENT_HISTORY = 10 # How many turns of recent history to include in chat prompt
+CHAT_FALLBACK_REPLY = "I'm having trouble thinking right now. Could you try rephrasing?" # sent with 200 when no model reply
+SCREEN_TIME_THRESHOLD_MINUTES = 30 # Reminder threshold per app/day until a user has a baseline
+USAGE_PERCENTILE = float(os.environ.get("USAGE_PERCENTILE", "0.9")) # Adaptive threshold: user's own p90 daily minutes
+MIN_SKETCH_DAYS = 7 # Days of history before the adaptive threshold replaces the default
+MIN_ADAPTIVE_THRESHOLD_MINUTES = 10 # Never remind below this, however low the baseline
+MAX_SENSOR_BATCH = 500 # Max events per processSensorData batch (one Firestore batch)
+NOTIFICATION_COOLDOWN = timedelta(hours=1) # Repeat triggers inside this window update one notification
+NOTIFICATION_TTL = timedelta(days=30) # Notifications expire (Firestore TTL on expires_at) after this
+NOTIFICATIONS_PAGE_SIZE = 20
+RTDB_URL = os.environ.get("RTDB_URL", f"https://{PROJECT_ID}.firebaseio.com") # JournalAI's journals, for exports
+COMPACTION_USERS_PER_RUN = 200 # users per compactChatHistory call; the next call resumes after the last one
+COMPACTION_MAX_CHUNKS_PER_USER = 50 # chunks per user per call; a bigger backlog finishes on later passes
+EMPTY_CHAIR_PROJECT_ID = os.environ.get("EMPTY_CHAIR_PROJECT_ID", "clario-4558") # emptyChair_backend's sessions/messages
+DELETION_RESUMES_PER_RUN = 20 # account deletions resumeAccountDeletions finishes per call
+DELETION_STALE_AFTER = timedelta(minutes=15) # a "running" job without a checkpoint this long died with its instance
+
+# ------------------ Logging ------------------
+# Queue-backed JSON logs: request threads enqueue, a background thread writes stdout
+setup_logging()
+log = logging.getLogger("clario")
 
 # ------------------ Initialize Clients ------------------
 # Initialize Firebase Admin SDK (runs only once per instance)
@@ -35,8 +78,18 @@ if not firebase_admin._apps:
     initialize_app()
 
 db_firestore = firestore.Client(project=PROJECT_ID) # Keep for Flask routes if needed
+db_empty_chair = firestore.Client(project=EMPTY_CHAIR_PROJECT_ID) # account export / deletion only
 language_client_nlp = language_v1.LanguageServiceClient() # Keep for fallback sentiment
 
+# --- Avatar store + default avatar (loaded once per instance, not per request) ---
+avatar_store = create_store()
+DEFAULT_AVATAR_BYTES = load_default_avatar()
+DEFAULT_AVATAR_RENDITIONS = make_renditions(DEFAULT_AVATAR_BYTES) if DEFAULT_AVATAR_BYTES else {}
+avatar_jobs = AvatarJobQueue()
+
+# --- Daily quote: local pool preloaded, today's quote cached in memory ---
+quote_service = QuoteService(db_firestore, load_local_pool())
+
 # --- Configure Gemini ---
 # IMPORTANT: Set GOOGLE_API_KEY environment variable during deployment
 try:
@@ -44,31 +97,58 @@ try:
     if not gemini_api_key:
         raise ValueError("GOOGLE_API_KEY environment variable not set.")
     genai.configure(api_key=gemini_api_key)
-    print("Gemini configured successfully.")
+    log.info("Gemini configured successfully.")
 except Exception as e:
-    print(f"ERROR: Failed to configure Gemini: {e}")
+    log.error("Failed to configure Gemini: %s", e)
     # Handle this case - maybe disable Gemini features?
 
+# --- Model call gateways: deadlines, jittered retries, hedging, circuit breakers ---
+# coalesce=True: identical concurrent calls (same text analyzed twice, scheduler
+# retries) share one model call instead of each paying for their own.
+# Gateways on the same quota share one AIMD concurrency limiter.
+gemini_api_limiter = limiter_for(f"{GEMINI_MODEL_CHAT}:api_key")
+vertex_gemini_limiter = limiter_for(f"{GEMINI_MODEL_ANALYSIS}:vertex")
+imagen_limiter = limiter_for("imagegeneration@006", initial_limit=2, max_limit=8, max_queue=8, latency_target=30.0)
+chat_gateway = LLMGateway("chat_reply", deadline=20.0, hedge=True, limiter=gemini_api_limiter)
+analysis_gateway = LLMGateway("analysis", deadline=15.0, coalesce=True, limiter=gemini_api_limiter)
+quote_gateway = LLMGateway("daily_quote", deadline=30.0, coalesce=True, limiter=vertex_gemini_limiter)
+image_gateway = LLMGateway("imagen", deadline=60.0, max_retries=1, limiter=imagen_limiter)
+
 # Initialize Flask app (used for /chat and /onboarding routes IF deploying as Cloud Run)
 app = Flask(__name__)
+install_flask(app) # Server-Timing header + JSON timing log line on every route
 
 # ------------------ Authentication Helper ------------------
-def verify_token(req):
-    """Verifies the Firebase Auth token from the request header."""
-    # ... (Keep existing verify_token function) ...
+@span("auth")
+def verify_token(req, during_deletion=False):
+    """
+    Verifies the Firebase Auth token from the request header. Once an account
+    deletion has started for the uid (deletionJobs/{uid} exists) the token is
+    refused, except by deleteAccount itself (during_deletion=True): ID tokens
+    stay valid for up to an hour, and the apps must not write the user's data
+    back while it is deleted, or after.
+    """
     auth_header = req.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
-        print("Missing or invalid Authorization header")
+        log.info("Missing or invalid Authorization header")
         return None
     id_token = auth_header.split(' ').pop()
     try:
         decoded_token = auth.verify_id_token(id_token)
+        if not during_deletion and deletion_started(decoded_token["uid"]):
+            log.warning("Refusing token for %s: account deletion started", decoded_token["uid"])
+            return None
         return decoded_token
     except Exception as e:
-        print(f"Error verifying token: {e}")
+        log.warning("Error verifying token: %s", e)
         return None
 
 
+def deletion_started(user_id):
+    """One document read: has deleteAccount run for this uid?"""
+    return db_firestore.collection(JOBS_COLLECTION).document(user_id).get().exists
+
+
 # ------------------ Onboarding Data (Keep as is) ------------------
 ONBOARDING_QUESTIONS_FULL = [
     "", "Hi, I am Clario. Before we begin, I’d love to get to know you a little better. I’ll ask you a few quick questions about yourself so I can support you in a way that feels personal and meaningful. So, what’s your name (or nickname you’d like me to use)?",
@@ -98,156 +178,148 @@ ONBOARDING_KEYS = [
 
 # ------------------ Firestore Utilities (Keep as is) ------------------
 # These use db_firestore
+@span("firestore_read")
 def get_user_profile(user_id):
     doc_ref = db_firestore.collection("users").document(user_id)
     doc = doc_ref.get()
     return doc.to_dict() if doc.exists else {}
 
+@span("firestore_write")
 def save_user_profile(user_id, profile_data):
     db_firestore.collection("users").document(user_id).set(profile_data, merge=True)
 
+@span("firestore_write")
 def save_chat_message(user_id, role, text):
      db_firestore.collection("users").document(user_id).collection("chats").document().set({
         "role": role, "text": text, "ts": datetime.now(timezone.utc)
     })
 
+@span("firestore_read")
 def load_history(user_id):
-    chats_ref = db_firestore.collection("users").document(user_id).collection("chats").order_by("ts", direction=firestore.Query.DESCENDING).limit(MAX_RECENT_HISTORY * 2) # Limit history load
-    docs = chats_ref.stream()
-    history = []
-    for doc in docs:
-        data = doc.to_dict()
-        ts_val = data.get("ts")
-        ts_str = ts_val.isoformat() if hasattr(ts_val, "isoformat") else str(ts_val)
-        history.append({ "role": data.get("role"), "text": data.get("text"), "ts": ts_str })
-    return history[::-1] # Reverse to get chronological order
+    # Limit history load; older messages may sit in compressed chat_chunks (see chat_archive)
+    return [history_turn(m) for m in load_recent_messages(db_firestore, user_id, MAX_RECENT_HISTORY * 2)]
+
+def history_turn(message):
+    ts_val = message.get("ts")
+    ts_str = ts_val.isoformat() if hasattr(ts_val, "isoformat") else str(ts_val)
+    return { "role": message.get("role"), "text": message.get("text"), "ts": ts_str }
+
+@span("firestore_write")
+def flag_crisis_follow_up(user_id, matched_phrase):
+    """Marks the user for a check_in_if_low follow-up after a crisis-phrase match."""
+    db_firestore.collection("users").document(user_id).set({
+        "crisis_follow_up": {
+            "pending": True,
+            "flagged_at": datetime.now(timezone.utc),
+            "matched_phrase": matched_phrase,
+        }
+    }, merge=True)
 
 
 # --- Gemini Chat Helper ---
+def build_chat_prompt(history, user_message, profile):
+    """Single-turn prompt: persona, profile, recent turns, then the new message for the model to answer."""
+    context_prompt = (
+        "You are Clario, a compassionate mental health companion. "
+        "Behave like a supportive therapist and friend: validate feelings, ask clarifying questions. "
+        "Speak warmly, 2-3 sentences. Prioritize empathy. "
+        "If self-harm risk, direct user to professional help.\n"
+        "User profile:\n"
+        f"{json.dumps(profile, indent=2, default=str)}\n\n"
+        "Recent conversation history (user and assistant turns):\n"
+    )
+    prompt_parts = [context_prompt]
+    for turn in history: # Add history turns explicitly
+         prompt_parts.append(f"{turn.get('role', '').upper()}: {turn.get('text', '')}")
+    prompt_parts.append(f"USER: {user_message}")
+    prompt_parts.append("ASSISTANT:") # Ask model to complete as assistant
+    return "\n".join(prompt_parts)
+
+
+@span("generate")
 def generate_gemini_chat_reply(history, user_message, profile):
     """Generates a chat reply using the Gemini API."""
     try:
         model = genai.GenerativeModel(GEMINI_MODEL_CHAT)
-        
-        # Build context for Gemini
-        context_prompt = (
-            "You are Clario, a compassionate mental health companion. "
-            "Behave like a supportive therapist and friend: validate feelings, ask clarifying questions. "
-            "Speak warmly, 2-3 sentences. Prioritize empathy. "
-            "If self-harm risk, direct user to professional help.\n"
-            "User profile:\n"
-            f"{json.dumps(profile, indent=2)}\n\n"
-            "Recent conversation history (user and assistant turns):\n"
-        )
-        
-        # Format history for the model (ensure user/model roles)
-        gemini_history = []
-        for turn in history:
-             # Adjust role based on Gemini's expectation ('user'/'model')
-             role = 'user' if turn.get('role') == 'user' else 'model' 
-             gemini_history.append({'role': role, 'parts': [turn.get('text', '')]})
-
-        # Start chat with context and history
-        chat_session = model.start_chat(history=gemini_history)
-        
-        # Send the latest user message (append context if desired, or let history handle it)
-        full_user_prompt = f"{context_prompt}\nUSER: {user_message}\nASSISTANT:" # Or just user_message if using start_chat history
-        
-        # Use generate_content for single turn with full context, or send_message with chat_session
-        # Using generate_content for simplicity here, including history in the prompt text
-        prompt_parts = [context_prompt]
-        for turn in history: # Add history turns explicitly
-             prompt_parts.append(f"{turn.get('role', '').upper()}: {turn.get('text', '')}")
-        prompt_parts.append(f"USER: {user_message}")
-        prompt_parts.append("ASSISTANT:") # Ask model to complete as assistant
-
-        response = model.generate_content("\n".join(prompt_parts))
-
-        # response = chat_session.send_message(user_message) # Alternative using chat session state
-        
+        response = chat_gateway.generate(model, build_chat_prompt(history, user_message, profile))
         reply_text = response.text.strip()
-        print(f"Gemini chat reply generated: '{reply_text[:60]}...'")
+        log_payload("chat_reply", "Gemini chat reply generated", reply_text)
         return reply_text
         
     except Exception as e:
-        print(f"ERROR generating Gemini chat reply: {e}")
+        log.error("Error generating Gemini chat reply: %s", e)
         # Consider checking specific error types (e.g., BlockedPromptException)
-        return "I'm having trouble thinking right now. Could you try rephrasing?"
+        return CHAT_FALLBACK_REPLY
+
+
+# --- Structured outputs (schema passed to the model, validated on return) ---
+@dataclass
+class SentimentOutput:
+    score: float
+    tag: str
+
 
+@dataclass
+class QuoteOutput:
+    text: str
+    author: str
 
+
+@span("generate")
 def analyze_sentiment_with_gemini(text_content):
     """
     Analyzes sentiment using Gemini, aiming for a 0-10 score and tag.
-    Improved JSON parsing and validation.
+    The reply is schema-constrained JSON, validated into SentimentOutput.
     """
     if not text_content: # Handle empty input
-        print("WARN: analyze_sentiment_with_gemini received empty text.")
+        log.warning("analyze_sentiment_with_gemini received empty text.")
         return {"score": 0.0, "tag": "Neutral"}
 
     try:
         model = genai.GenerativeModel(GEMINI_MODEL_ANALYSIS)
         prompt = (
             "Analyze the sentiment of the following journal entry. Provide a sentiment score from 0 (very negative) to 10 (very positive) "
-            "and a single descriptive tag (e.g., Positive, Negative, Neutral, Anxious, Grateful, Frustrated, Hopeful, Mixed). "
-            "Format the output strictly as JSON: {\"score\": SCORE, \"tag\": \"TAG\"}\n\n"
-            f"Journal Entry:\n\"\"\"\n{text_content}\n\"\"\"\n\n"
-            "JSON Output:"
+            "and a single descriptive tag (e.g., Positive, Negative, Neutral, Anxious, Grateful, Frustrated, Hopeful, Mixed).\n\n"
+            f"Journal Entry:\n\"\"\"\n{text_content}\n\"\"\"\n"
         )
 
         # Generate content with safety settings if needed (optional)
         # response = model.generate_content(prompt, safety_settings={'HARASSMENT': 'BLOCK_NONE', ...})
-        response = model.generate_content(prompt)
+        response = analysis_gateway.generate(model, prompt, generation_config=schema_config(SentimentOutput, 64))
 
         # Check for empty or blocked response *before* accessing text
         if not response.candidates:
-             print("WARN: Gemini response blocked or empty.")
+             log.warning("Gemini response blocked or empty.")
              # Check response.prompt_feedback if needed for block reason
              return {"score": 0.0, "tag": "Neutral"} # Fallback
 
         response_text = response.text.strip()
-        print(f"Gemini sentiment analysis raw response: {response_text}")
-
-        # Attempt to extract and parse the JSON response more robustly
-        try:
-            # Find the first JSON object using regex
-            match = re.search(r"\{.*\}", response_text, re.DOTALL)
-            if not match:
-                raise ValueError("No JSON object found in the response.")
+        log_payload("sentiment", "Gemini sentiment analysis raw response", response_text)
 
-            json_string = match.group(0)
-            result = json.loads(json_string)
-
-            # Validate structure and types
-            score_val = result.get("score")
-            tag_val = result.get("tag")
-
-            if isinstance(score_val, (int, float)) and isinstance(tag_val, str):
-                score_0_10 = float(score_val)
-                # Clamp score to 0-10 range just in case
-                score_0_10 = max(0.0, min(10.0, score_0_10))
+        result = parse_structured("sentiment", response_text, SentimentOutput)
+        if result is None:
+            # Fallback to neutral
+            return {"score": 0.0, "tag": "Neutral"}
 
-                # Convert 0-10 score to -1.0 to +1.0
-                score_neg1_pos1 = (score_0_10 / 5.0) - 1.0
+        # Clamp score to 0-10 range just in case
+        score_0_10 = max(0.0, min(10.0, result.score))
 
-                print(f"Gemini sentiment parsed: Score={score_neg1_pos1:.2f} (from {score_0_10}), Tag={tag_val}")
-                return {"score": score_neg1_pos1, "tag": tag_val}
-            else:
-                raise ValueError(f"Parsed JSON has incorrect structure or types. Score: {score_val}, Tag: {tag_val}")
+        # Convert 0-10 score to -1.0 to +1.0
+        score_neg1_pos1 = (score_0_10 / 5.0) - 1.0
 
-        except (json.JSONDecodeError, ValueError, AttributeError) as json_e:
-            print(f"ERROR: Failed to extract or parse Gemini sentiment JSON: {json_e}. Raw response: '{response_text}'")
-            # Fallback to neutral
-            return {"score": 0.0, "tag": "Neutral"}
+        log.debug("Gemini sentiment parsed: Score=%.2f (from %s), Tag=%s", score_neg1_pos1, score_0_10, result.tag)
+        return {"score": score_neg1_pos1, "tag": result.tag}
 
     # Catch potential errors during the API call itself
     except Exception as e:
-        print(f"ERROR analyzing sentiment with Gemini API call: {e}")
+        log.error("Error analyzing sentiment with Gemini API call: %s", e)
         # Fallback to neutral on error
         return {"score": 0.0, "tag": "Neutral"}
 
 
 # --- Cloud Function: analyzeMood (Keep as is) ---
 @functions_framework.http
+@traced("analyzeMood")
 def analyzeMood(req):
     """HTTP Cloud Function: Analyzes journal entry mood using Gemini. Requires Auth."""
     decoded_token = verify_token(req) # Assuming verify_token is defined
@@ -264,21 +336,30 @@ def analyzeMood(req):
 
     journal_text = request_json["text"]
     if not journal_text.strip(): # Check if text is empty after stripping whitespace
-         print(f"analyzeMood: Received empty journal text for user {decoded_token.get('uid', 'unknown')}. Returning Neutral.")
+         log.info("analyzeMood: Received empty journal text for user %s. Returning Neutral.", decoded_token.get('uid', 'unknown'))
          return (jsonify({"score": 0.0, "tag": "Neutral"}), 200, headers) # Return neutral for empty text
 
     try:
         # --- USE FIXED GEMINI HELPER ---
         sentiment_result = analyze_sentiment_with_gemini(journal_text)
-        print(f"analyzeMood (Gemini): User {decoded_token.get('uid', 'unknown')}, Result: {sentiment_result}")
+        log.info("analyzeMood (Gemini): User %s, Result: %s", decoded_token.get('uid', 'unknown'), sentiment_result)
         return (jsonify(sentiment_result), 200, headers)
     except Exception as e:
         # This catches errors *within* analyzeMood, not necessarily in the helper
-        print(f"Unexpected error in analyzeMood function: {e}")
+        log.exception("Unexpected error in analyzeMood function: %s", e)
         return ("Internal Server Error", 500, headers)
 @functions_framework.http
+@traced("generateAvatar")
 def generateAvatar(req):
-    """Generates an avatar with fallback to safe prompt if filters trigger."""
+    """
+    Generates an avatar with fallback to safe prompt if filters trigger.
+    Avatars are content-addressed by the sanitized prompt, so a repeated prompt
+    is served from the avatar store without calling Imagen again. The response
+    carries a URL for getAvatar; pass "inline": true to also get base64.
+    With "mode": "async" the call returns a job id right away and generation
+    runs in the background; poll getAvatarJob for the result.
+    Optional "size" (px) and "format" (webp|jpeg) select a resized rendition.
+    """
     decoded_token = verify_token(req)
     if not decoded_token:
         return ("Unauthorized", 401)
@@ -299,30 +380,189 @@ def generateAvatar(req):
     prompt = data.get("prompt", "").strip()
     if not prompt:
         return ("'prompt' cannot be empty", 400, headers)
+    inline = bool(data.get("inline", False))
+    async_mode = data.get("mode") == "async"
+    size, fmt = parse_rendition_args(data.get("size"), data.get("format"))
 
     # --- SANITIZE PROMPT ---
     safe_prompt = sanitize_prompt(prompt)
+    avatar_id = avatar_key(safe_prompt)
+
+    image_bytes = None  # only needed when generated here; a cached avatar is served from the store
+    cached = avatar_store.exists(avatar_id)
+
+    if async_mode:
+        if cached:
+            return (jsonify({"job_id": avatar_id, "status": JOB_DONE, "image_url": avatar_url(avatar_id, size, fmt)}), 200, headers)
+        # Job id is the avatar id, so duplicate in-flight prompts share one job
+        job = avatar_jobs.submit(avatar_id, lambda: store_avatar(avatar_id, generate_avatar_image(safe_prompt)))
+        return (jsonify(job.to_dict()), 202, headers)
+    if not cached:
+        try:
+            image_bytes = generate_avatar_image(safe_prompt)
+            store_avatar(avatar_id, image_bytes)
+        except Exception as e:
+            log.error("Avatar generation failed: %s", e)
+            # final fallback → static default avatar, decoded once at startup
+            if DEFAULT_AVATAR_BYTES is None:
+                return (jsonify({"error": "Avatar generation failed"}), 500, headers)
+            avatar_id = DEFAULT_AVATAR_ID
+            image_bytes = DEFAULT_AVATAR_BYTES
+
+    result = {"avatar_id": avatar_id, "image_url": avatar_url(avatar_id, size, fmt), "cached": cached}
+    if inline:
+        inline_bytes = load_avatar_bytes(avatar_id, size, fmt)[0] or image_bytes
+        if inline_bytes is not None:
+            result["image_base64"] = base64.b64encode(inline_bytes).decode('utf-8')
+    return (jsonify(result), 200, headers)
+
+
+@span("imagen")
+def generate_avatar_image(safe_prompt):
+    """Calls Imagen, retrying once with a neutral prompt if the safety filter blocks it."""
+    vertexai.init(project=PROJECT_ID, location=LOCATION)
+    model = ImageGenerationModel.from_pretrained("imagegeneration@006")
+    response = image_gateway.call(
+        lambda: model.generate_images(prompt=safe_prompt, number_of_images=1, aspect_ratio="1:1"),
+        key=canonical_key("imagen", safe_prompt))
+    if not response.images:
+        # fallback prompt if blocked
+        log.warning("Safety filter triggered. Retrying with neutral prompt.")
+        fallback_prompt = "A friendly abstract avatar of a person in cartoon style"
+        response = image_gateway.call(
+            lambda: model.generate_images(prompt=fallback_prompt, number_of_images=1, aspect_ratio="1:1"))
+    return response.images[0]._image_bytes
+
+
+@span("avatar_store_write")
+def store_avatar(avatar_id, image_bytes):
+    """
+    Stores every resized rendition, then the original. Runs once per generated
+    avatar. The original is the commit marker: generateAvatar and getAvatarJob
+    treat the avatar as done once it exists, so it goes last and nobody is
+    handed a rendition URL before the rendition is there.
+    """
+    try:
+        renditions = make_renditions(image_bytes)
+    except Exception as e:
+        log.warning("Could not build renditions for avatar %s: %s", avatar_id, e)
+        renditions = {}
+    for (size, fmt), data in renditions.items():
+        avatar_store.put(rendition_key(avatar_id, size, fmt), data)
+    avatar_store.put(avatar_id, image_bytes)
+    if not renditions:
+        return
+    report = payload_report(image_bytes, renditions)
+    log.info("Avatar %s renditions: original=%sB, %s", avatar_id[:12], report['original_bytes'],
+             ", ".join(f"{k}={v['bytes']}B (-{v['reduction_pct']}%)" for k, v in report["renditions"].items()))
+
+
+def parse_rendition_args(size, fmt):
+    """Maps optional size/format request values to a stored rendition; (None, None) means the original."""
+    if fmt not in RENDITION_FORMATS:
+        fmt = DEFAULT_RENDITION_FORMAT
+    try:
+        size = int(size) if size is not None else None
+    except (TypeError, ValueError):
+        size = None
+    if not size or size <= 0:
+        return None, None
+    return pick_size(size), fmt
+
+
+@span("avatar_store_read")
+def load_avatar_bytes(avatar_id, size=None, fmt=None):
+    """(bytes, key): the rendition if one was requested and exists, otherwise the original under its own key."""
+    if avatar_id == DEFAULT_AVATAR_ID:
+        data = DEFAULT_AVATAR_RENDITIONS.get((size, fmt))
+        if data is not None:
+            return data, rendition_key(avatar_id, size, fmt)
+        return DEFAULT_AVATAR_BYTES, avatar_id
+    if size:
+        key = rendition_key(avatar_id, size, fmt)
+        data = avatar_store.get(key)
+        if data is not None:
+            return data, key
+    # avatars stored before renditions existed only have the original
+    return avatar_store.get(avatar_id), avatar_id
+
 
+@functions_framework.http
+@traced("getAvatarJob")
+def getAvatarJob(req):
+    """
+    HTTP Cloud Function: Status of an async avatar job.
+    Query params: id=<job id>, wait=<seconds, optional, max 25> to long-poll,
+    size/format (optional) to pick the rendition returned in image_url.
+    """
+    decoded_token = verify_token(req)
+    if not decoded_token:
+        return ("Unauthorized", 401)
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    job_id = req.args.get("id", "")
+    if not re.fullmatch(r"[0-9a-f]{64}", job_id):
+        return ("Invalid job id", 400, headers)
     try:
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        model = ImageGenerationModel.from_pretrained("imagegeneration@006")
-        response = model.generate_images(prompt=safe_prompt, number_of_images=1, aspect_ratio="1:1")
-        if not response.images:
-            # fallback prompt if blocked
-            print("⚠️ Safety filter triggered. Retrying with neutral prompt.")
-            fallback_prompt = "A friendly abstract avatar of a person in cartoon style"
-            response = model.generate_images(prompt=fallback_prompt, number_of_images=1, aspect_ratio="1:1")
-
-        image_bytes = response.images[0]._image_bytes
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        return (jsonify({"image_base64": base64_image}), 200, headers)
+        wait_seconds = min(max(float(req.args.get("wait", 0)), 0.0), AVATAR_JOB_MAX_WAIT)
+    except ValueError:
+        wait_seconds = 0.0
+
+    job = avatar_jobs.get(job_id)
+    if job and wait_seconds:
+        job.wait(wait_seconds)
+
+    if job and job.status != JOB_DONE:
+        return (jsonify(job.to_dict()), 200, headers)
+
+    # Finished here, or the job ran on another instance: the store is the source of truth
+    if avatar_store.exists(job_id):
+        size, fmt = parse_rendition_args(req.args.get("size"), req.args.get("format"))
+        return (jsonify({"job_id": job_id, "status": JOB_DONE, "image_url": avatar_url(job_id, size, fmt)}), 200, headers)
+    return (jsonify({"job_id": job_id, "status": "unknown"}), 404, headers)
 
-    except Exception as e:
-        print("Avatar generation failed:", e)
-        # final fallback → your static default avatar
-        with open("default_avatar_base64.txt", "r") as f:
-            default_avatar = f.read().strip()
-        return (jsonify({"image_base64": default_avatar}), 200, headers)
+
+def avatar_url(avatar_id, size=None, fmt=None):
+    if size:
+        return f"{AVATAR_BASE_URL}?id={avatar_id}&size={size}&format={fmt}"
+    return f"{AVATAR_BASE_URL}?id={avatar_id}"
+
+
+@functions_framework.http
+@traced("getAvatar")
+def getAvatar(req):
+    """
+    HTTP Cloud Function: Serves avatar bytes by id. Ids are content hashes, so
+    responses never change and can be cached by clients and CDNs indefinitely,
+    except a rendition request answered with the original (no rendition
+    stored): that is cached briefly under the original's ETag, so the
+    rendition is picked up once it exists.
+    """
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if req.method == "OPTIONS":
+        headers.update({"Access-Control-Allow-Methods": "GET", "Access-Control-Max-Age": "3600"})
+        return ("", 204, headers)
+
+    avatar_id = req.args.get("id", "")
+    if avatar_id != DEFAULT_AVATAR_ID and not re.fullmatch(r"[0-9a-f]{64}", avatar_id):
+        return ("Invalid avatar id", 400, headers)
+    size, fmt = parse_rendition_args(req.args.get("size"), req.args.get("format"))
+    image_bytes, key = load_avatar_bytes(avatar_id, size, fmt)
+
+    if image_bytes is None:
+        return ("Not Found", 404, headers)
+
+    etag = f'"{key}"'
+    fell_back = size is not None and key == avatar_id
+    headers.update({
+        "Cache-Control": f"public, max-age={AVATAR_FALLBACK_MAX_AGE}" if fell_back
+                         else "public, max-age=31536000, immutable",
+        "ETag": etag,
+    })
+    if req.headers.get("If-None-Match") == etag:
+        return ("", 304, headers)
+    headers["Content-Type"] = sniff_content_type(image_bytes)
+    return (image_bytes, 200, headers)
 
 
 # --- HELPER FUNCTION: prompt sanitizer ---
@@ -338,6 +578,23 @@ def sanitize_prompt(prompt: str) -> str:
     clean += " | high quality portrait in digital art style, neutral lighting"
     return clean
 
+# --- Onboarding steps (shared with the ASGI app) ---
+def next_onboarding_index(profile_data):
+    answered_keys = [k for k in ONBOARDING_KEYS if k in profile_data and k != "intro"]
+    return len(answered_keys) + 1
+
+
+def record_onboarding_answer(profile_data, user_response):
+    """Stores the answer under the key of the question last asked; returns whether profile_data changed."""
+    current_question_index = next_onboarding_index(profile_data)
+    if user_response and current_question_index > 0:
+        previous_key_index = current_question_index - 1
+        if previous_key_index < len(ONBOARDING_KEYS):
+            profile_data[ONBOARDING_KEYS[previous_key_index]] = user_response
+            return True
+    return False
+
+
 # --- Flask Routes (Keep as is) ---
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -347,10 +604,19 @@ def chat():
         if not decoded_token: return jsonify({"error": "Unauthorized"}), 401
         user_id = decoded_token["uid"]
 
-        profile = get_user_profile(user_id)
         body = request.get_json()
         user_message = body.get("message", "").strip()
 
+        # --- Crisis fast path: answer locally, before any Firestore read or model call ---
+        crisis_phrase = scan_message(user_message)
+        if crisis_phrase:
+            log.warning("Crisis phrase detected for user %s; returning safety response.", user_id)
+            save_chat_message(user_id, "user", user_message)
+            save_chat_message(user_id, "assistant", SAFETY_RESPONSE)
+            flag_crisis_follow_up(user_id, crisis_phrase)
+            return jsonify({"reply": SAFETY_RESPONSE, "crisis": True, "resources": CRISIS_RESOURCES})
+
+        profile = get_user_profile(user_id)
         if not profile.get("onboarding_complete", False):
            return jsonify({"error": "Please complete onboarding first via /onboarding route."}), 400
 
@@ -365,7 +631,7 @@ def chat():
         return jsonify({"reply": reply})
 
     except Exception as e:
-        print(f"Error in /chat route: {e}")
+        log.exception("Error in /chat route: %s", e)
         return jsonify({"error": "An internal server error occurred"}), 500
 
 @app.route("/onboarding", methods=["POST"])
@@ -379,33 +645,228 @@ def onboarding():
         body = request.get_json()
         user_response = body.get("answer", "").strip()
         profile_data = get_user_profile(user_id)
-        answered_keys = [k for k in ONBOARDING_KEYS if k in profile_data and k != "intro"]
-        current_question_index = len(answered_keys) + 1 
-        if user_response and current_question_index > 0: 
-            previous_key_index = current_question_index -1 
-            if previous_key_index < len(ONBOARDING_KEYS): 
-                 previous_key = ONBOARDING_KEYS[previous_key_index]
-                 profile_data[previous_key] = user_response
-                 save_user_profile(user_id, profile_data) 
-        answered_keys_after_save = [k for k in ONBOARDING_KEYS if k in profile_data and k != "intro"]
-        next_question_index = len(answered_keys_after_save) + 1
+        if record_onboarding_answer(profile_data, user_response):
+            save_user_profile(user_id, profile_data)
+        next_question_index = next_onboarding_index(profile_data)
         if next_question_index >= len(ONBOARDING_QUESTIONS_FULL):
             profile_data["onboarding_complete"] = True
             save_user_profile(user_id, profile_data) 
             return jsonify({"status": "complete", "message": "Onboarding completed!"})
         return jsonify({"status": "in_progress", "question": ONBOARDING_QUESTIONS_FULL[next_question_index]})
     except Exception as e:
-        print(f"Error in /onboarding route: {e}")
+        log.exception("Error in /onboarding route: %s", e)
         return jsonify({"status": "error", "message": "An internal server error occurred"}), 500
 
 
 
-# --- Cloud Function: processSensorData (Keep as is) ---
+# --- Notification coalescing ---
+# Triggers for the same user/app within NOTIFICATION_COOLDOWN update one
+# notification in place instead of adding a new document each time.
+# users/{uid}/notificationState/{key} points at the notification currently
+# absorbing triggers. Old notifications carry expires_at for a Firestore TTL policy:
+#   gcloud firestore fields ttls update expires_at --collection-group=notifications --enable-ttl
+# The unread count is an aggregation query, not a stored counter, so TTL
+# deletes are reflected without anything decrementing it.
+def _write_coalesced_notification(transaction, user_ref, key, title, message, extra):
+    now = datetime.now(timezone.utc)
+    state_ref = user_ref.collection("notificationState").document(key)
+    state = state_ref.get(transaction=transaction).to_dict() or {}
+
+    notif_ref = None
+    last_at = state.get("last_triggered_at")
+    if last_at and now - last_at < NOTIFICATION_COOLDOWN and state.get("notification_id"):
+        notif_ref = user_ref.collection("notifications").document(state["notification_id"])
+        if not notif_ref.get(transaction=transaction).exists:
+            notif_ref = None  # expired or deleted; start a fresh one
+
+    fields = {
+        "title": title,
+        "message": message,
+        "timestamp": now,
+        "expires_at": now + NOTIFICATION_TTL,
+        "read": False,
+        **extra,
+    }
+    if notif_ref is None:
+        notif_ref = user_ref.collection("notifications").document()
+        transaction.set(notif_ref, {**fields, "trigger_count": 1})
+    else:
+        transaction.update(notif_ref, {**fields, "trigger_count": firestore.Increment(1)})
+
+    transaction.set(state_ref, {"notification_id": notif_ref.id, "last_triggered_at": now}, merge=True)
+    return notif_ref.id
+
+
+def _mark_notifications_read(transaction, refs):
+    """Marks the existing, unread notifications among refs read; returns how many."""
+    newly_read = [snap.reference for snap in transaction.get_all(refs)
+                  if snap.exists and not snap.to_dict().get("read", False)]
+    for ref in newly_read:
+        transaction.update(ref, {"read": True})
+    return len(newly_read)
+
+
+def unread_notification_count(notifications_ref):
+    """
+    One count() aggregation (billed one read per 1000 matches). Expired
+    notifications still count until the TTL policy deletes them, usually
+    within a day of expires_at.
+    """
+    return notifications_ref.where("read", "==", False).count(alias="unread").get()[0][0].value
+
+
+@span("notification_write")
+def create_screen_time_notification(user_id, app_name, minutes):
+    message = f"You’ve spent {int(minutes)} mins on {app_name}. Maybe take a short break?"
+    user_ref = db_firestore.collection("users").document(user_id)
+    key = "screen_time_" + _app_slug(app_name)
+    transactional_write = firestore.transactional(_write_coalesced_notification)
+    transactional_write(db_firestore.transaction(), user_ref, key, "Mindful Reminder", message,
+                        {"type": "screen_time", "app": app_name})
+    log.info("Notification upserted for user %s: %s", user_id, message)
+    return message
+
+
+def _event_day(event):
+    """UTC day (YYYY-MM-DD) of an event's optional 'timestamp' (epoch ms or ISO string)."""
+    ts = event.get("timestamp")
+    try:
+        if isinstance(ts, (int, float)):
+            return datetime.fromtimestamp(ts / 1000.0, tz=timezone.utc).strftime("%Y-%m-%d")
+        if isinstance(ts, str) and ts:
+            return datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(timezone.utc).strftime("%Y-%m-%d")
+    except (ValueError, OverflowError, OSError):
+        pass
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def aggregate_usage_events(events):
+    """
+    Folds raw screen_time events into {(app, day): {"minutes": total, "events": count}}.
+    Returns (aggregates, number_of_skipped_events).
+    """
+    aggregates = {}
+    skipped = 0
+    for event in events:
+        if not isinstance(event, dict) or event.get("type") != "screen_time" or not event.get("app"):
+            skipped += 1
+            continue
+        try:
+            minutes = float(event.get("minutes", 0))
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if minutes <= 0:
+            skipped += 1
+            continue
+        key = (str(event["app"]), _event_day(event))
+        agg = aggregates.setdefault(key, {"minutes": 0.0, "events": 0})
+        agg["minutes"] += minutes
+        agg["events"] += 1
+    return aggregates, skipped
+
+
+def usage_doc_ref(user_id, app_name, day):
+    return db_firestore.collection("users").document(user_id).collection("usage").document(f"{day}_{_app_slug(app_name)}")
+
+
+def _app_slug(app_name):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(app_name))[:100]
+
+
+def adaptive_threshold(sketch):
+    """The user's own daily-usage percentile for an app, or the fixed default until enough days are seen."""
+    if sketch.count < MIN_SKETCH_DAYS:
+        return SCREEN_TIME_THRESHOLD_MINUTES
+    return max(sketch.quantile(USAGE_PERCENTILE), MIN_ADAPTIVE_THRESHOLD_MINUTES)
+
+
+def _update_usage_stats(transaction, stats_ref, app_name, day_minutes):
+    """
+    Folds this batch's per-day minutes for one app into users/{uid}/usageStats/{app}.
+    When a newer day starts, the finished day's total goes into the sketch, so
+    the stored state stays a fixed-size sketch plus the running day.
+    Returns (threshold, total_before_batch, total_after_batch) for the current day.
+    """
+    state = stats_ref.get(transaction=transaction).to_dict() or {}
+    sketch = UsageSketch.from_bytes(state.get("daily_sketch"))
+    current_day = state.get("current_day")
+    current_total = float(state.get("current_day_minutes", 0.0))
+    before = current_total
+
+    for day in sorted(day_minutes):
+        if current_day and day < current_day:
+            continue  # late event for a closed day: counted in usage/, not in the sketch
+        if day != current_day:
+            if current_day:
+                sketch.add(current_total)
+            current_day, current_total, before = day, 0.0, 0.0
+        current_total += day_minutes[day]
+
+    transaction.set(stats_ref, {
+        "app": app_name,
+        "daily_sketch": sketch.to_bytes(),
+        "current_day": current_day,
+        "current_day_minutes": current_total,
+        "updated_at": datetime.now(timezone.utc),
+    })
+    return adaptive_threshold(sketch), before, current_total
+
+
+@span("usage_write")
+def ingest_usage_batch(user_id, events):
+    """
+    Writes one atomic increment per (app, day) for the whole batch, then
+    evaluates the reminder rule once per app: it fires when today's total
+    crosses the user's own usage percentile for that app.
+    """
+    aggregates, skipped = aggregate_usage_events(events)
+    if not aggregates:
+        return {"accepted": 0, "skipped": skipped, "notifications": []}
+
+    batch = db_firestore.batch()
+    for (app_name, day), agg in aggregates.items():
+        ref = usage_doc_ref(user_id, app_name, day)
+        batch.set(ref, {
+            "app": app_name,
+            "day": day,
+            "minutes": firestore.Increment(agg["minutes"]),
+            "events": firestore.Increment(agg["events"]),
+            "updated_at": datetime.now(timezone.utc),
+        }, merge=True)
+    batch.commit()
+
+    per_app = {}
+    for (app_name, day), agg in aggregates.items():
+        per_app.setdefault(app_name, {})[day] = agg["minutes"]
+
+    # Notify only when this batch pushed today's total over the user's threshold
+    notifications = []
+    stats_col = db_firestore.collection("users").document(user_id).collection("usageStats")
+    update_stats = firestore.transactional(_update_usage_stats)
+    for app_name, day_minutes in per_app.items():
+        threshold, before, total = update_stats(
+            db_firestore.transaction(), stats_col.document(_app_slug(app_name)), app_name, day_minutes)
+        if before <= threshold < total:
+            notifications.append(create_screen_time_notification(user_id, app_name, total))
+
+    return {
+        "accepted": sum(a["events"] for a in aggregates.values()),
+        "skipped": skipped,
+        "notifications": notifications,
+    }
+
+
+# --- Cloud Function: processSensorData ---
 @functions_framework.http
+@traced("processSensorData")
 def processSensorData(req):
     """
     HTTP Cloud Function that receives sensor or app usage data,
     analyzes it, and stores reminder/notification info in Firestore.
+    Accepts a single event, or a batch as {"events": [...]} which is
+    aggregated per app/day into users/{uid}/usage before rules run.
+    Reminders fire against each user's own per-app daily percentile.
     """
     decoded_token = verify_token(req)
     if not decoded_token:
@@ -428,51 +889,131 @@ def processSensorData(req):
         payload = req.get_json()
         user_id = decoded_token["uid"]
 
+        # Batch: {"events": [{"type": "screen_time", "app": "Instagram", "minutes": 5, "timestamp": 1718000000000}, ...]}
+        if isinstance(payload.get("events"), list):
+            events = payload["events"]
+            if len(events) > MAX_SENSOR_BATCH:
+                return (jsonify({"error": f"At most {MAX_SENSOR_BATCH} events per batch"}), 400, headers)
+            result = ingest_usage_batch(user_id, events)
+            log.info("Ingested %s usage events for user %s (%s skipped).", result['accepted'], user_id, result['skipped'])
+            return (jsonify({"status": "ok", **result}), 200, headers)
+
         # Example: {"type": "screen_time", "app": "Instagram", "minutes": 50}
+        # A single event goes through the same aggregation and adaptive rule as a batch of one.
         event_type = payload.get("type")
-        app_name = payload.get("app")
-        minutes = float(payload.get("minutes", 0))
 
         if event_type == "screen_time":
-            if minutes > 30:
-                message = f"You’ve spent {int(minutes)} mins on {app_name}. Maybe take a short break?"
-                db_firestore.collection("users").document(user_id).collection("notifications").add({
-                    "title": "Mindful Reminder",
-                    "message": message,
-                    "timestamp": datetime.now(timezone.utc),
-                    "type": "screen_time",
-                    "app": app_name,
-                    "read": False
-                })
-                print(f"Notification created for user {user_id}: {message}")
-                return (jsonify({"status": "ok", "notification": message}), 200, headers)
-            else:
-                print(f"No notification needed for {app_name} ({minutes} mins).")
-                return (jsonify({"status": "ok", "notification": None}), 200, headers)
+            result = ingest_usage_batch(user_id, [payload])
+            message = result["notifications"][0] if result["notifications"] else None
+            if not message:
+                log.debug("No notification needed for %s (%s mins).", payload.get('app'), payload.get('minutes'))
+            return (jsonify({"status": "ok", "notification": message}), 200, headers)
 
         else:
-            print(f"Unhandled event type: {event_type}")
+            log.warning("Unhandled event type: %s", event_type)
             return (jsonify({"status": "ignored", "message": "Unknown event type"}), 200, headers)
 
     except Exception as e:
-        print(f"Error in processSensorData: {e}")
+        log.exception("Error in processSensorData: %s", e)
+        return (jsonify({"error": str(e)}), 500, headers)
+
+# --- Cloud Function: getNotifications ---
+@functions_framework.http
+@traced("getNotifications")
+def getNotifications(req):
+    """
+    HTTP Cloud Function: One page of the user's notifications, newest first.
+    Query params: limit (default 20, max 100), cursor (id of the last
+    notification from the previous page).
+    POST {"mark_read": ["<id>", ...]} marks notifications read (in one transaction).
+    """
+    decoded_token = verify_token(req)
+    if not decoded_token:
+        return ("Unauthorized", 401)
+
+    if req.method == "OPTIONS":  # Handle CORS
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            "Access-Control-Max-Age": "3600"
+        }
+        return ("", 204, headers)
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    user_id = decoded_token["uid"]
+    user_ref = db_firestore.collection("users").document(user_id)
+    notifications_ref = user_ref.collection("notifications")
+
+    try:
+        if req.method == "POST":
+            ids = (req.get_json(silent=True) or {}).get("mark_read", [])
+            if not isinstance(ids, list) or len(ids) > 100:
+                return (jsonify({"error": "'mark_read' must be a list of at most 100 ids"}), 400, headers)
+            refs = [notifications_ref.document(i) for i in dict.fromkeys(map(str, ids))]
+            marked = firestore.transactional(_mark_notifications_read)(db_firestore.transaction(), refs) if refs else 0
+            return (jsonify({"status": "ok", "marked_read": marked}), 200, headers)
+
+        try:
+            limit = max(1, min(int(req.args.get("limit", NOTIFICATIONS_PAGE_SIZE)), 100))
+        except ValueError:
+            limit = NOTIFICATIONS_PAGE_SIZE
+        query = notifications_ref.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
+        cursor = req.args.get("cursor")
+        if cursor:
+            cursor_snap = notifications_ref.document(cursor).get()
+            if cursor_snap.exists:
+                query = query.start_after(cursor_snap)
+
+        now = datetime.now(timezone.utc)
+        items = []
+        last_id = None
+        fetched = 0
+        for doc in query.stream():
+            last_id = doc.id
+            fetched += 1
+            data = doc.to_dict()
+            expires_at = data.get("expires_at")
+            if expires_at and expires_at < now:
+                continue  # TTL deletion is lazy; hide expired ones
+            items.append({
+                "id": doc.id,
+                "title": data.get("title"),
+                "message": data.get("message"),
+                "type": data.get("type"),
+                "app": data.get("app"),
+                "read": data.get("read", False),
+                "trigger_count": data.get("trigger_count", 1),
+                "timestamp": data["timestamp"].isoformat() if hasattr(data.get("timestamp"), "isoformat") else None,
+            })
+
+        return (jsonify({
+            "notifications": items,
+            "next_cursor": last_id if fetched == limit else None,
+            "unread_count": unread_notification_count(notifications_ref),
+        }), 200, headers)
+
+    except Exception as e:
+        log.exception("Error in getNotifications: %s", e)
         return (jsonify({"error": str(e)}), 500, headers)
 
 # --- NEW ADDITION: Daily Quote Generation Function ---
 @functions_framework.http
+@traced("updateDailyQuote")
 def updateDailyQuote(req):
     """
     HTTP Cloud Function: Generates a daily quote using Vertex AI (no API key needed)
     and saves it to Firestore.
     Intended to be called by Cloud Scheduler.
     Requires a 'secret' query parameter to run for security.
+    If generation fails, today's quote comes from the local pool instead.
     """
     
     # --- Security Check ---
     # We still need this secret to protect the public function URL
     provided_secret = req.args.get("secret")
     if provided_secret != CRON_SECRET:
-        print(f"Unauthorized attempt to run updateDailyQuote. Provided secret: '{provided_secret}'")
+        log.warning("Unauthorized attempt to run updateDailyQuote.")
         return ("Unauthorized", 401)
 
     # Handle CORS preflight (good practice)
@@ -481,7 +1022,7 @@ def updateDailyQuote(req):
         return ("", 204, headers)
     headers = {"Access-Control-Allow-Origin": "*"}
 
-    print("Daily quote update job started (using Vertex AI)...")
+    log.info("Daily quote update job started (using Vertex AI)...")
 
     try:
         # --- Initialize Vertex AI ---
@@ -493,46 +1034,298 @@ def updateDailyQuote(req):
         
         prompt = (
             "You are an assistant that provides one inspirational quote for mental wellness. "
-            "Provide a short, insightful, and supportive quote. "
-            "Format the output strictly as JSON: {\"text\": \"QUOTE_TEXT\", \"author\": \"AUTHOR_NAME\"}\n\n"
-            "JSON Output:"
+            "Provide a short, insightful, and supportive quote and its author."
         )
 
         # Generate content using the Vertex AI SDK
-        response = model.generate_content(prompt)
+        with span("generate"):
+            response = quote_gateway.generate(model, prompt, generation_config=schema_config(QuoteOutput, 128))
 
         if not response.candidates:
-            print("WARN: Daily quote Vertex AI response blocked or empty.")
-            return ("Gemini response was blocked or empty", 500, headers)
+            raise ValueError("Gemini response was blocked or empty")
 
         response_text = response.text.strip()
-        print(f"Daily quote raw response: {response_text}")
+        log_payload("daily_quote", "Daily quote raw response", response_text)
 
-        # Use the same robust JSON parsing
-        match = re.search(r"\{.*\}", response_text, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON object found in the quote response.")
-        
-        json_string = match.group(0)
-        quote_data = json.loads(json_string)
+        quote = parse_structured("daily_quote", response_text, QuoteOutput)
+        if quote is None or not quote.text.strip():
+            raise ValueError("Quote response did not match the schema.")
+
+        quote_data = {"text": quote.text.strip(), "author": quote.author.strip() or "Anonymous", "source": "gemini"}
+        status = "success"
 
-        if "text" not in quote_data or "author" not in quote_data:
-            raise ValueError(f"Parsed JSON has incorrect structure: {quote_data}")
+    except Exception as e:
+        log.error("updateDailyQuote (Vertex AI) failed: %s. Falling back to local quote pool.", e)
+        quote_data = quote_service.fallback_for(utc_today())
+        status = "fallback"
 
+    try:
         quote_data["updated_at"] = datetime.now(timezone.utc)
 
         # Save to Firestore (same as before)
         doc_ref = db_firestore.collection("config").document("dailyQuote")
-        doc_ref.set(quote_data)
+        with span("firestore_write"):
+            doc_ref.set(quote_data)
+        quote_service.set_today(quote_data)
 
-        print(f"Successfully saved daily quote to Firestore: {quote_data['text']}")
-        return (jsonify({"status": "success", "quote": quote_data}), 200, headers)
+        log.info("Successfully saved daily quote to Firestore (%s): %s", status, quote_data['text'])
+        return (jsonify({"status": status, "quote": quote_data}), 200, headers)
 
     except Exception as e:
-        print(f"ERROR in updateDailyQuote (Vertex AI): {e}")
+        log.error("Error saving daily quote: %s", e)
         return (jsonify({"status": "error", "message": str(e)}), 500, headers)
 
 
+# --- Cloud Function: exportUserData ---
+@functions_framework.http
+@traced("exportUserData")
+def exportUserData(req):
+    """
+    HTTP Cloud Function: Streams everything stored about the caller (all
+    backends) as NDJSON or a zip, one page of documents in memory at a time.
+    Query params: format (ndjson | zip), cursor (resume point from a checkpoint
+    line or a previous part's next_cursor), max_records (split into parts),
+    embeddings (0 to leave out embedding vectors).
+    """
+    if req.method == "OPTIONS":  # Handle CORS
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            "Access-Control-Max-Age": "3600"
+        }
+        return ("", 204, headers)
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    decoded_token = verify_token(req)
+    if not decoded_token:
+        return ("Unauthorized", 401, headers)
+    user_id = decoded_token["uid"]
+
+    fmt = req.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return (jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400, headers)
+    try:
+        max_records = int(req.args.get("max_records", "0")) or None
+        items = iter_user_export(
+            db_firestore, user_id, cursor=req.args.get("cursor"),
+            rtdb_reference=lambda path: rtdb.reference(path, url=RTDB_URL),
+            other_dbs={EMPTY_CHAIR_PROJECT_ID: db_empty_chair},
+            embeddings=req.args.get("embeddings", "1") != "0")
+        first = next(items, None)  # fail on a bad cursor now, not mid-stream
+    except ValueError as e:
+        return (jsonify({"error": str(e)}), 400, headers)
+
+    def all_items():
+        if first is not None:
+            yield first
+        yield from items
+
+    log.info("Export started for %s (%s)", user_id, fmt)
+    if fmt == "zip":
+        body = stream_zip(all_items(), user_id, max_records)
+        headers["Content-Disposition"] = f'attachment; filename="clario-export-{user_id}.zip"'
+        return Response(stream_with_context(body), 200, headers, mimetype="application/zip")
+    return Response(stream_with_context(stream_ndjson(all_items(), max_records)), 200, headers,
+                    mimetype="application/x-ndjson")
+
+
+# --- Cloud Function: deleteAccount ---
+@functions_framework.http
+@traced("deleteAccount")
+def deleteAccount(req):
+    """
+    HTTP Cloud Function: Deletes all of the caller's data (every backend's
+    Firestore subcollections and RTDB journals), then their Firebase Auth user.
+    Requires POST {"confirm": true}. Progress is checkpointed, so a request
+    that times out can simply be repeated; the response reports docs/sec.
+    """
+    if req.method == "OPTIONS":  # Handle CORS
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            "Access-Control-Max-Age": "3600"
+        }
+        return ("", 204, headers)
+    headers = {"Access-Control-Allow-Origin": "*"}
+
+    decoded_token = verify_token(req, during_deletion=True)
+    if not decoded_token:
+        return ("Unauthorized", 401, headers)
+    user_id = decoded_token["uid"]
+
+    body = req.get_json(silent=True) or {}
+    if req.method != "POST" or body.get("confirm") is not True:
+        return (jsonify({"error": 'POST {"confirm": true} to delete the account'}), 400, headers)
+
+    try:
+        stats = finish_account_deletion(user_id)
+    except Exception as e:
+        log.exception("Account deletion failed for %s: %s", user_id, e)
+        return (jsonify({"status": "error", "message": "Deletion incomplete; retry to resume."}), 500, headers)
+
+    return (jsonify({
+        "status": "deleted",
+        "docs_deleted": stats.get("docs_deleted", 0),
+        "rtdb_entries_deleted": stats.get("rtdb_entries_deleted", 0),
+        "elapsed_s": stats.get("elapsed_s"),
+        "docs_per_sec": stats.get("docs_per_sec"),
+    }), 200, headers)
+
+
+# --- Chat history compaction (Cloud Scheduler) ---
+def finish_account_deletion(user_id):
+    """
+    Deletes (or resumes deleting) the user's data in every project, then the
+    Auth user. The user stays enabled until the data is gone, so a failed
+    run can still be retried from the app; verify_token keeps the apps from
+    writing in the meantime. Returns the job stats.
+    """
+    with span("account_delete"):
+        stats = delete_account(db_firestore, user_id,
+                               rtdb_reference=lambda path: rtdb.reference(path, url=RTDB_URL),
+                               other_dbs={EMPTY_CHAIR_PROJECT_ID: db_empty_chair})
+    try:
+        with span("auth"):
+            auth.delete_user(user_id)
+    except auth.UserNotFoundError:
+        pass  # deleted by an earlier run
+    except Exception as e:
+        # the data is gone but the user isn't: leave the job for resumeAccountDeletions
+        db_firestore.collection(JOBS_COLLECTION).document(user_id).set(
+            {"status": "failed", "error": f"auth: {e}"}, merge=True)
+        raise
+    return stats
+
+
+@functions_framework.http
+@traced("resumeAccountDeletions")
+def resumeAccountDeletions(req):
+    """
+    HTTP Cloud Function (scheduled): finishes account deletions that a
+    deleteAccount request left incomplete, i.e. jobs marked "failed" and
+    "running" jobs whose instance died (no checkpoint for
+    DELETION_STALE_AFTER). At most DELETION_RESUMES_PER_RUN per call.
+    Requires the same 'secret' query parameter as updateDailyQuote.
+    """
+    if req.args.get("secret") != CRON_SECRET:
+        log.warning("Unauthorized attempt to run resumeAccountDeletions.")
+        return ("Unauthorized", 401)
+
+    jobs = db_firestore.collection(JOBS_COLLECTION)
+    stale = datetime.now(timezone.utc) - DELETION_STALE_AFTER
+    user_ids = [doc.id for doc in jobs.where("status", "==", "failed").limit(DELETION_RESUMES_PER_RUN).stream()]
+    if len(user_ids) < DELETION_RESUMES_PER_RUN:
+        user_ids += [doc.id for doc in jobs.where("status", "==", "running").where("updated_at", "<", stale)
+                     .limit(DELETION_RESUMES_PER_RUN - len(user_ids)).stream()]
+    totals = {"deleted": 0, "failed": 0}
+    for user_id in user_ids:
+        try:
+            finish_account_deletion(user_id)
+            totals["deleted"] += 1
+        except Exception as e:
+            log.exception("Resumed account deletion failed for %s: %s", user_id, e)
+            totals["failed"] += 1
+
+    log.info("Account deletion resume done: %s", totals)
+    return (jsonify(totals), 500 if totals["failed"] and not totals["deleted"] else 200)
+
+
+@functions_framework.http
+@traced("compactChatHistory")
+def compactChatHistory(req):
+    """
+    HTTP Cloud Function: packs chat messages older than ?days= (default 30) into
+    compressed chat_chunks documents, for ?uid= or else for the next
+    COMPACTION_USERS_PER_RUN users in id order. The position is kept in
+    config/chatCompaction, so each scheduled call does one bounded page and
+    the pass wraps around after the last user. Requires the same 'secret'
+    query parameter as updateDailyQuote.
+    """
+    if req.args.get("secret") != CRON_SECRET:
+        log.warning("Unauthorized attempt to run compactChatHistory.")
+        return ("Unauthorized", 401)
+
+    try:
+        days = int(req.args.get("days", "30"))
+    except ValueError:
+        return (jsonify({"error": "days must be an integer"}), 400)
+    if days <= 0:
+        return (jsonify({"error": "days must be positive"}), 400)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+
+    uid = req.args.get("uid")
+    cursor_ref = db_firestore.collection("config").document("chatCompaction")
+    if uid:
+        user_ids = [uid]
+    else:
+        after = (cursor_ref.get().to_dict() or {}).get("after")
+        query = (db_firestore.collection("users").order_by("__name__").select(["__name__"])
+                 .limit(COMPACTION_USERS_PER_RUN))
+        if after:
+            query = query.start_after({"__name__": after})
+        user_ids = [doc.id for doc in query.stream()]
+    totals = {"users": 0, "chunks": 0, "messages": 0, "failed": 0}
+    for user_id in user_ids:
+        try:
+            with span("compact"):
+                chunks, messages = compact_history(db_firestore, user_id, older_than=cutoff,
+                                                   max_chunks=COMPACTION_MAX_CHUNKS_PER_USER)
+        except Exception as e:
+            log.exception("Chat compaction failed for %s: %s", user_id, e)
+            totals["failed"] += 1
+            continue
+        totals["users"] += 1
+        totals["chunks"] += chunks
+        totals["messages"] += messages
+
+    if not uid:
+        # a short page means the pass reached the last user; the next call starts over
+        next_after = user_ids[-1] if len(user_ids) == COMPACTION_USERS_PER_RUN else None
+        state = {"after": next_after, "updated_at": datetime.now(timezone.utc)}
+        if next_after is None:
+            state["pass_completed_at"] = state["updated_at"]
+        cursor_ref.set(state, merge=True)
+        totals["next_after"] = next_after
+
+    log.info("Chat compaction done: %s", totals)
+    return (jsonify(totals), 500 if totals["failed"] and not totals["users"] else 200)
+
+
+@functions_framework.http
+@traced("getDailyQuote")
+def getDailyQuote(req):
+    """
+    HTTP Cloud Function: Today's quote from the instance's in-memory copy.
+    Public and cacheable (Cache-Control + ETag), so app opens don't each read Firestore.
+    """
+    headers = {"Access-Control-Allow-Origin": "*"}
+    if req.method == "OPTIONS":
+        headers.update({"Access-Control-Allow-Methods": "GET", "Access-Control-Allow-Headers": "If-None-Match", "Access-Control-Max-Age": "3600"})
+        return ("", 204, headers)
+
+    quote, etag = quote_service.get_today()
+    headers.update({
+        "Cache-Control": f"public, max-age={quote_service.cache_max_age()}",
+        "ETag": etag,
+    })
+    if req.headers.get("If-None-Match") == etag:
+        return ("", 304, headers)
+    return (jsonify(quote), 200, headers)
+
+
+# --- Flask Route: metrics ---
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Model gateway and concurrency-limiter counters, per-endpoint stage latency
+    histograms, log queue stats, structured-output parse outcomes.
+    """
+    return jsonify({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                    "structured_output": parse_stats()}), 200
+
+
 # ------------------ Entry for Local Flask Development ------------------
 if __name__ == "__main__":
     print("Starting Flask server for local development...")
@@ -0,0 +1,95 @@
+# quote_service.py
+import os
+import logging
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+log = logging.getLogger("quote_service")
+
+# ------------------ CONFIG ------------------
+# Same curated pool the app ships in assets/quotes/mental_health_quotes.json
+QUOTES_FILE = os.environ.get(
+    "QUOTES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mental_health_quotes.json"))
+QUOTE_REFRESH_SECONDS = 300  # how long an instance trusts its in-memory copy before re-reading Firestore
+MAX_CLIENT_CACHE_SECONDS = 3600
+
+
+def load_local_pool(path=QUOTES_FILE):
+    """Reads the curated quotes once at startup as [{"text", "author"}]."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        return [{"text": q["quote"], "author": q.get("author", "Anonymous")} for q in raw if q.get("quote")]
+    except Exception as e:
+        log.warning("Could not load local quote pool from %s: %s", path, e)
+        return []
+
+
+def utc_today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class QuoteService:
+    """
+    Today's quote, held in memory per instance. Reads config/dailyQuote at most
+    once per QUOTE_REFRESH_SECONDS; if that doc is missing or not from today,
+    serves a quote picked deterministically by date from the local pool, so
+    every instance agrees on the fallback without coordination.
+    """
+
+    def __init__(self, db, pool):
+        self.db = db
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._quote = None
+        self._etag = None
+        self._day = None
+        self._loaded_at = 0.0
+
+    def fallback_for(self, day):
+        if not self.pool:
+            return {"text": "Be gentle with yourself today.", "author": "Clario", "source": "builtin", "day": day}
+        index = datetime.strptime(day, "%Y-%m-%d").toordinal() % len(self.pool)
+        return {**self.pool[index], "source": "local_pool", "day": day}
+
+    def set_today(self, quote):
+        """Installs a freshly generated (or fallback) quote without waiting for the next refresh."""
+        with self._lock:
+            self._install(quote, utc_today())
+
+    def _install(self, quote, day):
+        public = {"text": quote["text"], "author": quote.get("author", "Anonymous"),
+                  "source": quote.get("source", "gemini"), "day": day}
+        self._quote = public
+        self._etag = '"' + hashlib.sha1(json.dumps(public, sort_keys=True).encode("utf-8")).hexdigest() + '"'
+        self._day = day
+        self._loaded_at = time.monotonic()
+
+    def get_today(self):
+        """Returns (quote, etag) for today's UTC date."""
+        day = utc_today()
+        with self._lock:
+            fresh = self._day == day and time.monotonic() - self._loaded_at < QUOTE_REFRESH_SECONDS
+            if fresh:
+                return self._quote, self._etag
+            quote = None
+            try:
+                snap = self.db.collection("config").document("dailyQuote").get()
+                data = snap.to_dict() if snap.exists else None
+                updated_at = data.get("updated_at") if data else None
+                if data and hasattr(updated_at, "strftime") and updated_at.strftime("%Y-%m-%d") == day:
+                    quote = data
+            except Exception as e:
+                log.warning("Could not read config/dailyQuote, using local pool: %s", e)
+            self._install(quote or self.fallback_for(day), day)
+            return self._quote, self._etag
+
+    @staticmethod
+    def cache_max_age():
+        """Seconds clients may cache today's quote: up to an hour, never past UTC midnight."""
+        now = datetime.now(timezone.utc)
+        until_midnight = 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+        return max(0, min(MAX_CLIENT_CACHE_SECONDS, until_midnight))
@@ -0,0 +1,149 @@
+# structured_output.py
+"""
+Schema-constrained JSON output for Gemini calls, shared by the backends
+(identical copies live next to each main.py).
+
+Describe the expected output as a dataclass, pass schema_config(cls, n) as the
+generation config, and parse the reply with parse_structured(). The schema
+makes the model emit bare JSON, so there is no regex scraping, and the token
+cap keeps replies short. Thinking models (gemini-2.5-*) count their thoughts
+against that cap, so google-genai callers pass thinking_budget=0; the other
+two SDKs should be given a non-thinking model. Failures are counted per call
+site.
+"""
+import json
+import logging
+import threading
+import typing
+import dataclasses
+from collections import Counter
+
+_TYPE_NAMES = {str: "STRING", int: "INTEGER", float: "NUMBER", bool: "BOOLEAN"}
+
+_log = logging.getLogger("structured_output")
+_stats_lock = threading.Lock()
+_parse_stats = Counter()
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+def enum_field(*values, default=dataclasses.MISSING):
+    """Dataclass field restricted to the given string values (enforced by schema and parser)."""
+    return dataclasses.field(default=default, metadata={"enum": list(values)})
+
+
+def _schema_for_type(tp, metadata=None):
+    origin = typing.get_origin(tp)
+    if origin is typing.Union:  # Optional[X]
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        schema = _schema_for_type(args[0], metadata)
+        schema["nullable"] = True
+        return schema
+    if origin is list:
+        return {"type": "ARRAY", "items": _schema_for_type(typing.get_args(tp)[0])}
+    if dataclasses.is_dataclass(tp):
+        return response_schema(tp)
+    schema = {"type": _TYPE_NAMES[tp]}
+    if metadata and "enum" in metadata:
+        schema["enum"] = metadata["enum"]
+    return schema
+
+
+def response_schema(cls):
+    """OpenAPI-subset schema (the form genai, google-generativeai and Vertex all accept) for a dataclass."""
+    hints = typing.get_type_hints(cls)
+    properties = {}
+    required = []
+    for f in dataclasses.fields(cls):
+        properties[f.name] = _schema_for_type(hints[f.name], f.metadata)
+        if f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+            required.append(f.name)
+    return {"type": "OBJECT", "properties": properties, "required": required}
+
+
+def schema_config(cls, max_output_tokens, thinking_budget=None):
+    """
+    Generation config dict for any of the three SDKs: JSON mime type, schema and
+    token cap. thinking_budget (google-genai only) caps a thinking model's thoughts.
+    """
+    config = {
+        "response_mime_type": "application/json",
+        "response_schema": response_schema(cls),
+        "max_output_tokens": max_output_tokens,
+    }
+    if thinking_budget is not None:
+        config["thinking_config"] = {"thinking_budget": thinking_budget}
+    return config
+
+
+def _coerce(value, tp, metadata=None):
+    origin = typing.get_origin(tp)
+    if origin is typing.Union:
+        if value is None:
+            return None
+        tp = [a for a in typing.get_args(tp) if a is not type(None)][0]
+        origin = typing.get_origin(tp)
+    if origin is list:
+        if not isinstance(value, list):
+            raise StructuredOutputError(f"expected list, got {type(value).__name__}")
+        item_tp = typing.get_args(tp)[0]
+        return [_coerce(v, item_tp) for v in value]
+    if dataclasses.is_dataclass(tp):
+        return _build(tp, value)
+    if tp is bool:
+        if not isinstance(value, bool):
+            raise StructuredOutputError(f"expected bool, got {value!r}")
+        return value
+    if tp in (int, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise StructuredOutputError(f"expected number, got {value!r}")
+        try:
+            return tp(float(value)) if tp is int else float(value)
+        except (ValueError, OverflowError):  # "abc", or int(inf)
+            raise StructuredOutputError(f"expected number, got {value!r}")
+    if not isinstance(value, str):
+        raise StructuredOutputError(f"expected string, got {value!r}")
+    if metadata and "enum" in metadata and value.lower() not in metadata["enum"]:
+        raise StructuredOutputError(f"{value!r} not in {metadata['enum']}")
+    return value.lower() if metadata and "enum" in metadata else value
+
+
+def _build(cls, data):
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"expected object for {cls.__name__}")
+    hints = typing.get_type_hints(cls)
+    kwargs = {}
+    for f in dataclasses.fields(cls):
+        if f.name in data:
+            kwargs[f.name] = _coerce(data[f.name], hints[f.name], f.metadata)
+        elif f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+            raise StructuredOutputError(f"missing field '{f.name}' for {cls.__name__}")
+    return cls(**kwargs)
+
+
+def parse_structured(name, text, cls):
+    """
+    Validates a schema-constrained reply into an instance of cls.
+    Returns None (and counts a failure under name) when the reply is unusable.
+    """
+    try:
+        result = _build(cls, json.loads(text or ""))
+    except (json.JSONDecodeError, StructuredOutputError, TypeError) as e:
+        with _stats_lock:
+            _parse_stats[(name, "failed")] += 1
+        _log.warning("structured output '%s' failed to parse: %s; reply: %.200r", name, e, text)
+        return None
+    with _stats_lock:
+        _parse_stats[(name, "ok")] += 1
+    return result
+
+
+def parse_stats():
+    """{name: {"ok": n, "failed": m}} since process start."""
+    with _stats_lock:
+        out = {}
+        for (name, outcome), count in _parse_stats.items():
+            out.setdefault(name, {"ok": 0, "failed": 0})[outcome] = count
+        return out
@@ -3,6 +3,7 @@ import json
 from datetime import datetime, timezone
 import google_genai as genai
 from google.cloud import firestore
+from chat_archive import load_messages
 
 # ------------------ CONFIG ------------------
 PROJECT_ID = "clario-f60b0"  # Your Firebase project ID
@@ -68,15 +69,14 @@ def save_chat_message(user_id, role, text):
     })
 
 def load_history(user_id):
-    chats_ref = db.collection("users").document(user_id).collection("chats").order_by("ts")
-    docs = chats_ref.stream()
+    # includes messages compacted into chat_chunks
     return [
         {
             "role": d.get("role"),
             "text": d.get("text"),
             "ts": d.get("ts").isoformat() if hasattr(d.get("ts"), "isoformat") else str(d.get("ts"))
         }
-        for d in (doc.to_dict() for doc in docs)
+        for d in load_messages(db, user_id)
     ]
 
 # ------------------ Onboarding Helper ------------------
@@ -201,7 +201,7 @@ def build_prompt(memory_summary, history, profile):
     parts = [system_instructions]
 
     if profile:
-        parts.append("User profile:\n" + json.dumps(profile, indent=2) + "\n")
+        parts.append("User profile:\n" + json.dumps(profile, indent=2, default=str) + "\n")
     if memory_summary:
         parts.append("Memory summary:\n" + memory_summary + "\n")
 
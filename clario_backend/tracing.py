@@ -0,0 +1,208 @@
+# tracing.py
+"""
+Per-stage request timing, shared by the backends (identical copies live next
+to each main.py).
+
+A request trace collects named spans (auth, firestore_read, embedding,
+rag_rank, generate, firestore_write, ...). When the request ends the trace is
+  - returned to the client as a Server-Timing header (visible in browser
+    devtools and to the Flutter client),
+  - logged as one structured line (logger "timing"), which Cloud Logging
+    indexes as jsonPayload,
+  - folded into per-endpoint, per-stage latency histograms that
+    timing_snapshot() exposes for the /metrics endpoints.
+
+Flask apps call install_flask(app), Quart (ASGI) apps install_quart(app);
+functions_framework handlers are wrapped with @traced("name"). Inside a request:
+
+    with span("firestore_read"):
+        profile = get_user_profile(uid)
+
+or as a decorator on a helper, so every caller is timed:
+
+    @span("firestore_read")
+    def get_user_profile(user_id): ...
+
+A span outside any request is a no-op, so helpers can be instrumented freely.
+In coroutines use the `with` form around the await; the decorator form would
+only time creating the coroutine. Tasks started inside a request (asyncio.gather)
+inherit its trace, so their spans land in the same entry.
+Repeated spans with the same name add up (two writes -> one firestore_write
+entry with count 2).
+"""
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (ms) of the histogram buckets; the last bucket is +Inf.
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_log = logging.getLogger("timing")
+_current = contextvars.ContextVar("request_trace", default=None)
+_histograms_lock = threading.Lock()
+_histograms = {}  # (endpoint, stage) -> Histogram
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.count = 0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, ms)] += 1
+        self.total_ms += ms
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None for the +Inf bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return HISTOGRAM_BUCKETS_MS[i] if i < len(HISTOGRAM_BUCKETS_MS) else None
+        return None
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_le_ms": self.quantile(0.5),
+            "p95_le_ms": self.quantile(0.95),
+            "p99_le_ms": self.quantile(0.99),
+            "buckets": {f"le_{b}": c for b, c in zip(HISTOGRAM_BUCKETS_MS, self.counts)} | {"le_inf": self.counts[-1]},
+        }
+
+
+class Trace:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [total_ms, count], in first-seen order
+
+    def add(self, name, ms):
+        entry = self.spans.setdefault(name, [0.0, 0])
+        entry[0] += ms
+        entry[1] += 1
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms):
+        parts = [f"{name};dur={ms:.1f}" for name, (ms, _) in self.spans.items()]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def span(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - start) * 1000)
+
+
+def start_trace(endpoint):
+    trace = Trace(endpoint)
+    return trace, _current.set(trace)
+
+
+def finish_trace(trace, token, status):
+    """Ends the trace: records histograms, logs the timing line, returns the Server-Timing value."""
+    try:
+        _current.reset(token)
+    except ValueError:  # finished from a different context than it started in
+        _current.set(None)
+    total_ms = trace.total_ms()
+    with _histograms_lock:
+        for stage, (ms, _) in list(trace.spans.items()) + [("total", (total_ms, 1))]:
+            _histograms.setdefault((trace.endpoint, stage), Histogram()).observe(ms)
+    _log.info("%s %s %.0fms", trace.endpoint, status, total_ms, extra={"json_fields": {
+        "endpoint": trace.endpoint,
+        "status": status,
+        "total_ms": round(total_ms, 1),
+        "stages": {name: {"ms": round(ms, 1), "count": n} for name, (ms, n) in trace.spans.items()},
+    }})
+    return trace.server_timing(total_ms)
+
+
+def traced(endpoint):
+    """Decorator for functions_framework handlers returning (body, status[, headers]) or a Response."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(req, *args, **kwargs):
+            trace, token = start_trace(endpoint)
+            try:
+                result = fn(req, *args, **kwargs)
+            except Exception:
+                finish_trace(trace, token, 500)
+                raise
+            return _with_header(result, trace, token)
+        return wrapper
+    return decorate
+
+
+def _with_header(result, trace, token):
+    if isinstance(result, tuple):
+        body = result[0]
+        status = result[1] if len(result) > 1 else 200
+        headers = dict(result[2] or {}) if len(result) > 2 else {}
+        headers["Server-Timing"] = finish_trace(trace, token, status)
+        return body, status, headers
+    if hasattr(result, "headers"):  # flask.Response
+        result.headers["Server-Timing"] = finish_trace(trace, token, result.status_code)
+        return result
+    return result, 200, {"Server-Timing": finish_trace(trace, token, 200)}
+
+
+def install_flask(app):
+    """Traces every request to a Flask app, keyed by its route rule (e.g. /chat)."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        g._trace = start_trace(request.url_rule.rule if request.url_rule else request.path)
+
+    @app.after_request
+    def _finish_trace(response):
+        started = g.pop("_trace", None)
+        if started is not None:
+            response.headers["Server-Timing"] = finish_trace(*started, response.status_code)
+        return response
+
+
+def install_quart(app):
+    """install_flask() for Quart apps; the hooks run in the request's task, so spans in it see the trace."""
+    from quart import g, request
+
+    @app.before_request
+    async def _start_trace():
+        g._trace = start_trace(request.url_rule.rule if request.url_rule else request.path)
+
+    @app.after_request
+    async def _finish_trace(response):
+        started = g.pop("_trace", None)
+        if started is not None:
+            response.headers["Server-Timing"] = finish_trace(*started, response.status_code)
+        return response
+
+
+def timing_snapshot():
+    """{endpoint: {stage: histogram}} since process start."""
+    with _histograms_lock:
+        out = {}
+        for (endpoint, stage), hist in _histograms.items():
+            out.setdefault(endpoint, {})[stage] = hist.snapshot()
+        return out
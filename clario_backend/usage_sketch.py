@@ -0,0 +1,70 @@
+# usage_sketch.py
+import math
+from array import array
+
+# ------------------ CONFIG ------------------
+# Log-bucketed quantile sketch (DDSketch-style) with a fixed bucket range, so
+# every user/app sketch is the same size no matter how many values it has seen.
+# Values are minutes; anything under 1 lands in bucket 0, anything over
+# MAX_VALUE in the last bucket.
+RELATIVE_ACCURACY = 0.05
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MAX_VALUE = 24 * 60.0
+NUM_BUCKETS = int(math.ceil(math.log(MAX_VALUE) / LOG_GAMMA)) + 2
+
+
+class UsageSketch:
+    """Mergeable quantile sketch; quantiles are accurate to ~5% relative error."""
+
+    def __init__(self, counts=None):
+        self.counts = counts if counts is not None else array("I", [0] * NUM_BUCKETS)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @staticmethod
+    def _bucket(value):
+        if value < 1.0:
+            return 0
+        return min(int(math.ceil(math.log(value) / LOG_GAMMA)) + 1, NUM_BUCKETS - 1)
+
+    @staticmethod
+    def _bucket_value(index):
+        if index == 0:
+            return 0.5
+        # midpoint (in relative terms) of (gamma^(i-2), gamma^(i-1)]
+        return 2 * GAMMA ** (index - 1) / (GAMMA + 1)
+
+    def add(self, value, count=1):
+        self.counts[self._bucket(value)] += count
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+
+    def quantile(self, q):
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen > rank:
+                return self._bucket_value(i)
+        return self._bucket_value(NUM_BUCKETS - 1)
+
+    def to_bytes(self):
+        return self.counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        counts = array("I")
+        counts.frombytes(bytes(data))
+        if len(counts) != NUM_BUCKETS:
+            return cls()  # layout changed; start over rather than misread buckets
+        return cls(counts)
@@ -0,0 +1,302 @@
+# user_export.py
+"""
+Streaming export of everything stored about one user, across the backends:
+
+    users/{uid}                          profile (clario, RelationAI)
+    users/{uid}/<collection>/...         every subcollection found under the user
+                                         document: chats (chat_chunks expanded back
+                                         into chat records), relationships,
+                                         relation_graph, notifications,
+                                         notificationState, usage, ...
+    the same in each other project       emptyChair's sessions/{id}/messages live
+                                         in their own project (other_dbs)
+    RTDB /users/{uid}/journals           journal entries (JournalAI)
+
+Collections are discovered, not listed by hand, as in account_deletion, so
+data added by a later feature is exported without touching this file.
+Subcollections of documents (sessions/{id}/messages) follow their parent
+document, depth first; a record's "source" is its collection path without the
+document ids ("sessions/messages"), prefixed with the project for other
+projects ("clario-4558/sessions").
+
+Collections are walked in document-id order one page at a time, so memory
+stays at one page whatever the history size. Output is NDJSON or a zip with
+one .ndjson file per source, produced incrementally.
+
+Resuming: after every page the NDJSON stream carries a checkpoint line with
+an opaque cursor; passing it back continues after that page (records between
+the last checkpoint and a dropped connection are sent again, so consumers
+dedupe on "path"). max_records splits a large export into parts: each part
+ends with next_cursor (NDJSON "end" line, zip manifest.json), null when done.
+"""
+import io
+import json
+import base64
+import zipfile
+from datetime import datetime, timezone
+from account_deletion import LEAF_COLLECTIONS
+from chat_archive import CHUNK_SIZE, CHUNKS_COLLECTION, unpack_chunk
+
+# ------------------ CONFIG ------------------
+EXPORT_PAGE_SIZE = 200
+EXPORT_FORMATS = ("ndjson", "zip")
+
+# Export order: profile, the main project's collections, each other project's, journals.
+# A source is keyed [stage, project, collection]; a cursor names the source it stopped in.
+PROFILE, MAIN, OTHER, JOURNALS = range(4)
+
+
+# ------------------ Cursor ------------------
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token):
+    """Opaque cursor -> {"source": [stage, project, collection], "trail": [id, ...]}; ValueError if malformed."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"invalid export cursor: {e}") from None
+    if not isinstance(position, dict):
+        raise ValueError("invalid export cursor")
+    source, trail = position.get("source"), position.get("trail")
+    if not (isinstance(source, list) and len(source) == 3 and source[0] in range(4)
+            and all(isinstance(part, str) for part in source[1:])
+            and isinstance(trail, list) and all(isinstance(part, str) for part in trail)):
+        raise ValueError("invalid export cursor")
+    return position
+
+
+# ------------------ Values ------------------
+def _is_embedding(key):
+    return key.lower().endswith("embedding")
+
+
+def jsonable(value, embeddings=True):
+    """Firestore/RTDB values -> JSON: timestamps as ISO 8601, bytes as base64, references as paths."""
+    if isinstance(value, dict):
+        return {k: jsonable(v, embeddings) for k, v in value.items() if embeddings or not _is_embedding(k)}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v, embeddings) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):  # GeoPoint
+        return {"latitude": value.latitude, "longitude": value.longitude}
+    if hasattr(value, "path"):  # DocumentReference
+        return value.path
+    return str(value)
+
+
+# ------------------ Walking ------------------
+def _pages(query, after, page_size):
+    """Snapshot pages of `query` in document-id order, starting after document id `after`."""
+    query = query.order_by("__name__")
+    while True:
+        page_query = query.start_after({"__name__": after}) if after else query
+        page = list(page_query.limit(page_size).stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[-1].id
+
+
+def _walk(collection, source, path, trail, resume, page_size, record):
+    """
+    Records for every document in `collection` and, depth first, in its
+    documents' subcollections, with ("checkpoint", trail) after every page.
+    A trail alternates document and subcollection ids from the top-level
+    collection down: [doc] means everything up to doc (subtree included) is
+    done, [doc, sub, ...] a resume point inside doc's subtree.
+    """
+    after = resume[0] if resume else None
+    if len(resume) > 1:  # stopped inside `after`'s subcollections; the document itself went out
+        yield from _walk_subcollections(collection.document(after), source, f"{path}/{after}", trail + [after],
+                                        resume[1:], page_size, record)
+    for page in _pages(collection, after, page_size):
+        for doc in page:
+            yield record(source, f"{path}/{doc.id}", doc.to_dict())
+            if collection.id not in LEAF_COLLECTIONS:
+                yield from _walk_subcollections(doc.reference, source, f"{path}/{doc.id}", trail + [doc.id], [],
+                                                page_size, record)
+        yield "checkpoint", trail + [page[-1].id]
+
+
+def _walk_subcollections(doc_ref, source, path, trail, resume, page_size, record):
+    start = resume[0] if resume else None
+    for sub in sorted(doc_ref.collections(), key=lambda c: c.id):
+        if start is not None and sub.id < start:
+            continue
+        yield from _walk(sub, f"{source}/{sub.id}", f"{path}/{sub.id}", trail + [sub.id],
+                         resume[1:] if sub.id == start else [], page_size, record)
+
+
+def _chunks(collection, path, after, page_size, record):
+    """Archived chats come out as ordinary chat records, a few chunks per page."""
+    for page in _pages(collection, after, max(1, page_size // CHUNK_SIZE)):
+        for chunk in page:
+            for message in unpack_chunk(chunk.to_dict()):
+                yield record("chats", f"{path}/chats/{message.get('id')}",
+                             {k: v for k, v in message.items() if k != "id"})
+        yield "checkpoint", [page[-1].id]
+
+
+def _sources(db, user_id, other_dbs):
+    """[(key, collection)] in export order, collections discovered under each project's users/{uid}."""
+    sources = [((MAIN, "", c.id), c) for c in db.collection("users").document(user_id).collections()]
+    for project, other in (other_dbs or {}).items():
+        sources += [((OTHER, project, c.id), c) for c in other.collection("users").document(user_id).collections()]
+    return sorted(sources, key=lambda s: s[0])
+
+
+def iter_user_export(db, user_id, cursor=None, rtdb_reference=None, other_dbs=None, page_size=EXPORT_PAGE_SIZE,
+                     embeddings=True):
+    """
+    Yields ("record", {"source", "path", "data"}) for every stored item and
+    ("checkpoint", cursor) after every page. other_dbs ({project: client}) are
+    further projects holding a users/{uid} tree. rtdb_reference is
+    firebase_admin.db.reference (or a partial binding its url); None skips journals.
+    """
+    position = decode_cursor(cursor) if cursor else {"source": [PROFILE, "", ""], "trail": []}
+    resume_key = tuple(position["source"])
+    user_path = f"users/{user_id}"
+
+    def record(source, path, data):
+        return "record", {"source": source, "path": path, "data": jsonable(data, embeddings)}
+
+    def checkpoints(key, items):
+        for kind, payload in items:
+            yield (kind, encode_cursor({"source": list(key), "trail": payload})) if kind == "checkpoint" \
+                else (kind, payload)
+
+    if resume_key == (PROFILE, "", "") and not position["trail"]:
+        snapshot = db.collection("users").document(user_id).get()
+        if snapshot.exists:
+            yield record("profile", user_path, snapshot.to_dict())
+        yield "checkpoint", encode_cursor({"source": [PROFILE, "", ""], "trail": [user_id]})
+
+    for key, collection in _sources(db, user_id, other_dbs):
+        if key < resume_key:
+            continue
+        resume = position["trail"] if key == resume_key else []
+        stage, project, name = key
+        if name == CHUNKS_COLLECTION:
+            yield from checkpoints(key, _chunks(collection, user_path, resume[0] if resume else None, page_size,
+                                                record))
+        else:
+            source = f"{project}/{name}" if stage == OTHER else name
+            yield from checkpoints(key, _walk(collection, source, f"{user_path}/{name}", [], resume,
+                                              page_size, record))
+
+    if rtdb_reference is not None:
+        journals_key = (JOURNALS, "", "journals")
+        if resume_key <= journals_key:
+            after = position["trail"][0] if resume_key == journals_key and position["trail"] else None
+            yield from checkpoints(journals_key, _journal_pages(rtdb_reference(f"users/{user_id}/journals"),
+                                                                user_id, after, page_size, record))
+
+
+def _journal_pages(ref, user_id, after, page_size, record):
+    while True:
+        query = ref.order_by_key()
+        # start_at is inclusive, so fetch one extra and drop the cursor key
+        page = query.start_at(after).limit_to_first(page_size + 1).get() if after else \
+            query.limit_to_first(page_size).get()
+        keys = [k for k in (page or {}) if k != after]
+        if not keys:
+            return
+        for key in keys:
+            yield record("journals", f"users/{user_id}/journals/{key}", page[key])
+        yield "checkpoint", [keys[-1]]
+        if len(keys) < page_size:
+            return
+        after = keys[-1]
+
+
+def _parts(items, max_records):
+    """Passes items through, stopping at the first checkpoint past max_records; returns (counts, next_cursor)."""
+    counts = {}
+    total = 0
+    for kind, payload in items:
+        if kind == "record":
+            counts[payload["source"]] = counts.get(payload["source"], 0) + 1
+            total += 1
+        yield kind, payload
+        if kind == "checkpoint" and max_records and total >= max_records:
+            return counts, payload
+    return counts, None
+
+
+# ------------------ Encoders ------------------
+def stream_ndjson(items, max_records=None):
+    """NDJSON lines (bytes): record and checkpoint lines, then one end line with counts and next_cursor."""
+    parts = _parts(items, max_records)
+    while True:
+        try:
+            kind, payload = next(parts)
+        except StopIteration as done:
+            counts, next_cursor = done.value
+            break
+        line = {"type": "record", **payload} if kind == "record" else {"type": "checkpoint", "cursor": payload}
+        yield (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+    end = {"type": "end", "counts": counts, "next_cursor": next_cursor}
+    yield (json.dumps(end) + "\n").encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes into and the generator drains."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_zip(items, user_id, max_records=None):
+    """Zip archive bytes, one <source>.ndjson entry per source plus manifest.json, emitted as it is built."""
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    entry = entry_source = None
+    parts = _parts(items, max_records)
+    while True:
+        try:
+            kind, payload = next(parts)
+        except StopIteration as done:
+            counts, next_cursor = done.value
+            break
+        if kind != "record":
+            data = sink.drain()
+            if data:
+                yield data
+            continue
+        if payload["source"] != entry_source:
+            if entry is not None:
+                entry.close()
+            entry_source = payload["source"]
+            entry = archive.open(f"{entry_source}.ndjson", "w")
+        entry.write((json.dumps({"path": payload["path"], "data": payload["data"]}, ensure_ascii=False) + "\n")
+                    .encode("utf-8"))
+    if entry is not None:
+        entry.close()
+    archive.writestr("manifest.json", json.dumps({
+        "user_id": user_id,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "counts": counts,
+        "next_cursor": next_cursor,
+    }, indent=2))
+    archive.close()
+    yield sink.drain()
@@ -0,0 +1,194 @@
+# async_logging.py
+"""
+Non-blocking structured logging, shared by the backends (identical copies
+live next to each main.py).
+
+setup_logging() routes every stdlib logger through a bounded in-memory queue.
+One background thread drains it and writes one JSON object per line to
+stdout, which Cloud Logging parses into severity + jsonPayload. A request
+thread only formats the record, truncates it and enqueues it; it never
+waits on stdout. If the queue is full the record is dropped and counted
+instead of blocking.
+
+Large payloads (raw model replies, prompts) go through log_payload(), which
+samples per logger and truncates, so one dump per N calls is kept for
+debugging without paying for every one:
+
+    LOG_LEVEL=INFO                                  # root level
+    LOG_PAYLOAD_SAMPLE_RATE=0.01                    # default share of payload dumps kept
+    LOG_PAYLOAD_SAMPLE_RATES=sentiment=1,quote=0.5  # per-payload-logger overrides
+
+    python async_logging.py   # caller-side cost: print vs queued logging on a slow stdout
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+# ------------------ CONFIG ------------------
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+MAX_MESSAGE_CHARS = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", "2000"))
+MAX_PAYLOAD_CHARS = int(os.environ.get("LOG_MAX_PAYLOAD_CHARS", "500"))
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            pass
+    return rates
+
+
+PAYLOAD_SAMPLE_RATES = _parse_rates(os.environ.get("LOG_PAYLOAD_SAMPLE_RATES", ""))
+
+_setup_lock = threading.Lock()
+_listener = None
+_stats_lock = threading.Lock()
+_stats = {"dropped": 0, "truncated": 0, "payloads_logged": 0, "payloads_sampled_out": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that truncates before enqueueing and drops (never blocks) when the queue is full."""
+
+    def prepare(self, record):
+        record = super().prepare(record)  # formats msg + args (+ traceback) into record.msg
+        if len(record.msg) > MAX_MESSAGE_CHARS:
+            record.msg = truncate(record.msg, MAX_MESSAGE_CHARS)
+            _count("truncated")
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count("dropped")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed as extra={"json_fields": {...}} are merged in."""
+
+    def format(self, record):
+        entry = {"severity": record.levelname, "message": record.getMessage(), "logger": record.name}
+        entry.update(getattr(record, "json_fields", None) or {})
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging():
+    """Installs the queue handler on the root logger once per process; safe to call repeatedly."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(JsonFormatter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(DroppingQueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL)
+        _listener = logging.handlers.QueueListener(log_queue, writer)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Drains whatever is still queued and stops the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def payload_sample_rate(name):
+    return PAYLOAD_SAMPLE_RATES.get(name, PAYLOAD_SAMPLE_RATE)
+
+
+def log_payload(name, label, payload, level=logging.INFO):
+    """
+    Logs a large payload under logger payload.<name>, for a sampled share of
+    calls and truncated to MAX_PAYLOAD_CHARS. Returns whether it was logged.
+    """
+    logger = logging.getLogger(f"payload.{name}")
+    if not logger.isEnabledFor(level):
+        return False
+    if random.random() >= payload_sample_rate(name):
+        _count("payloads_sampled_out")
+        return False
+    text = payload if isinstance(payload, str) else str(payload)
+    _count("payloads_logged")
+    logger.log(level, "%s: %s", label, truncate(text, MAX_PAYLOAD_CHARS),
+               extra={"json_fields": {"payload_chars": len(text)}})
+    return True
+
+
+def log_stats():
+    """Queue depth plus dropped/truncated/sampled counters since process start."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queued"] = _listener.queue.qsize() if _listener is not None else 0
+    return stats
+
+
+class _SlowStream:
+    """stdout stand-in that takes `delay` seconds per write, like a backed-up log pipe."""
+
+    def __init__(self, delay=0.0005):
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def _demo(records=2000):
+    payload = "x" * 20000  # a long raw model reply
+    slow = _SlowStream()
+    start = time.perf_counter()
+    for i in range(records):
+        print(f"Gemini sentiment analysis raw response: {payload}", file=slow)
+    blocking = time.perf_counter() - start
+
+    real_stdout, sys.stdout = sys.stdout, slow
+    try:
+        setup_logging()
+        start = time.perf_counter()
+        for i in range(records):
+            log_payload("demo", "Gemini sentiment analysis raw response", payload)
+            logging.getLogger("demo").info("request %d handled", i)
+        queued = time.perf_counter() - start
+        shutdown_logging()
+    finally:
+        sys.stdout = real_stdout
+    print(f"print to slow stdout: {blocking / records * 1e6:8.1f} µs/call on the request thread")
+    print(f"queued logging:       {queued / records * 1e6:8.1f} µs/call on the request thread")
+    print("stats:", log_stats())
+
+
+if __name__ == "__main__":
+    _demo()
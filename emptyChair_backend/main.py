@@ -1,11 +1,18 @@
 import functions_framework
 import uuid
 import json
+import time
+import logging
+import threading
+from collections import OrderedDict
 from google.cloud import firestore
 import vertexai
 from vertexai.generative_models import GenerativeModel, Part, Content
 from vertexai.language_models import TextEmbeddingModel 
 import numpy as np 
+from llm_gateway import LLMGateway, canonical_key, limiter_for, metrics_snapshot
+from tracing import span, traced, timing_snapshot
+from async_logging import setup_logging, log_stats
 
 
 # --- Setup: This is the official and correct way ---
@@ -14,6 +21,17 @@ LOCATION = "us-central1"
 GEMINI_MODEL_NAME = "gemini-2.5-flash" 
 EMBEDDING_MODEL_NAME = "text-embedding-004" 
 
+# Long-term memory (RAG) in processMessage, memoized per session
+RAG_CANDIDATES = 10 # most recent summarized sessions with the same personInChair
+RAG_TOP_K = 2 # past sessions rendered into the prompt
+RAG_REUSE_SIMILARITY = 0.8 # message embedding at least this close to the last query vector -> reuse the block
+RAG_CACHE_TTL_SECONDS = 30 * 60 # candidate sets are re-queried after this long
+RAG_CACHE_SESSIONS = 256 # per-instance LRU bound (~30 KB of float32 embeddings each)
+
+# Queue-backed JSON logs; DEBUG lines are skipped unless LOG_LEVEL=DEBUG.
+setup_logging()
+log = logging.getLogger("empty_chair")
+
 # Initialize clients now that permissions are fixed.
 # This code runs once when the function instance starts.
 db = firestore.Client(project=PROJECT_ID)
@@ -21,34 +39,111 @@ vertexai.init(project=PROJECT_ID, location=LOCATION)
 model = GenerativeModel(GEMINI_MODEL_NAME)
 embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME) 
 
+# Deadlines, retries and circuit breaking around every Vertex call.
+# Summaries/embeddings coalesce identical concurrent calls (double-tapped
+# generateSessionSummaries builds the same prompts).
+# Dialogue and summaries share the Gemini quota, so they share one AIMD limiter.
+gemini_limiter = limiter_for(GEMINI_MODEL_NAME)
+dialogue_gateway = LLMGateway("dialogue", deadline=20.0, hedge=True, limiter=gemini_limiter)
+summary_gateway = LLMGateway("summaries", deadline=45.0, coalesce=True, limiter=gemini_limiter)
+embedding_gateway = LLMGateway("embeddings", deadline=10.0,
+                               limiter=limiter_for(EMBEDDING_MODEL_NAME, initial_limit=16, latency_target=3.0))
+
 
 # Helper function to generate embedding
+@span("embedding")
 def get_embedding_vertexai(text_content):
     if not text_content:
         return []
     try:
-        embeddings = embedding_model.get_embeddings([text_content])
+        embeddings = embedding_gateway.call(lambda: embedding_model.get_embeddings([text_content]),
+                                            key=canonical_key(EMBEDDING_MODEL_NAME, text_content))
         return embeddings[0].values
     except Exception as e:
-        print(f"ERROR generating embedding: {e}")
+        log.error("Error generating embedding: %s", e)
         return []
 
-# Helper function for cosine similarity
-def cosine_similarity(v1, v2):
-    if not v1 or not v2:
-        return 0.0
-    v1_np = np.array(v1)
-    v2_np = np.array(v2)
-    dot_product = np.dot(v1_np, v2_np)
-    norm_v1 = np.linalg.norm(v1_np)
-    norm_v2 = np.linalg.norm(v2_np)
-    if norm_v1 == 0 or norm_v2 == 0:
-        return 0.0
-    return dot_product / (norm_v1 * norm_v2)
+
+class SessionRagCache:
+    """
+    Long-term memory for processMessage, memoized per session. personInChair
+    and the set of past sessions don't change during a session, so the
+    Firestore query runs once per session (and TTL) instead of once per
+    message. The candidates' reflection embeddings are kept normalized in
+    one matrix; a turn whose message embedding stays within
+    RAG_REUSE_SIMILARITY of the last query vector reuses the rendered
+    memory block, and only a drifting message re-ranks (one matrix-vector
+    product, no I/O). Per instance: a cold instance or evicted session
+    simply queries again.
+    """
+
+    def __init__(self, ttl=RAG_CACHE_TTL_SECONDS, max_sessions=RAG_CACHE_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "reranks": 0, "reused": 0}
+
+    def _entry(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry["loaded_at"] <= self.ttl:
+                self._entries.move_to_end(key)
+                return entry
+        vectors, rendered = load()
+        matrix = np.zeros((0, 0), dtype=np.float32)
+        if vectors:
+            matrix = np.array(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+        entry = {"loaded_at": time.monotonic(), "matrix": matrix, "rendered": rendered, "query": None, "block": ""}
+        with self._lock:
+            self._stats["loads"] += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+        return entry
+
+    def memory_block(self, key, embedding, load, render):
+        """
+        The rendered memory block for this message. load() -> (reflection
+        embeddings, rendered entries) of the candidate sessions;
+        render(entries) -> block text.
+        """
+        entry = self._entry(key, load)
+        if not len(entry["matrix"]):
+            return ""
+        query = np.array(embedding, dtype=np.float32) if embedding else None
+        if query is not None and np.linalg.norm(query) > 0:
+            query = query / np.linalg.norm(query)
+        else:
+            query = None
+        last = entry["query"]
+        if query is None or (last is not None and float(np.dot(query, last)) >= RAG_REUSE_SIMILARITY):
+            with self._lock:
+                self._stats["reused"] += 1
+            return entry["block"]  # no embedding to rank with, or the topic hasn't moved
+        with span("rag_rank"):
+            scores = entry["matrix"] @ query
+            top = np.argsort(-scores, kind="stable")[:RAG_TOP_K]
+            block = render([entry["rendered"][i] for i in top])
+        with self._lock:
+            self._stats["reranks"] += 1
+            entry["query"], entry["block"] = query, block
+        return block
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, sessions=len(self._entries))
+
+
+rag_cache = SessionRagCache()
 
 
 # --- startSession Function (UPDATED) ---
 @functions_framework.http
+@traced("startSession")
 def startSession(request):
     """
     Initializes a new session. It starts the user in a 'pre-analysis' phase
@@ -60,9 +155,9 @@ def startSession(request):
         user_id = request_json["userId"]
         person_in_chair = request_json.get("personInChair", "the issue")
         user_goal = request_json.get("userGoal", "find some clarity")
-        print(f"--- INITIALIZING NEW SESSION for user: {user_id} with {person_in_chair} for goal: {user_goal} ---")
+        log.info("Initializing new session for user %s with %s for goal: %s", user_id, person_in_chair, user_goal)
     except (TypeError, KeyError) as e:
-        print(f"ERROR: Bad Request. Missing required fields. Details: {e}")
+        log.warning("Bad Request. Missing required fields. Details: %s", e)
         return ("Bad Request: Missing required fields in JSON body.", 400)
 
     initial_ai_message = (
@@ -86,7 +181,7 @@ def startSession(request):
         messages_ref.set({"text": initial_ai_message, "role": "ai", "timestamp": firestore.SERVER_TIMESTAMP, "perspective": "facilitator", "phase": "initial_analysis"})
 
     except Exception as e:
-        print(f"ERROR saving new session to Firestore in startSession: {e}")
+        log.error("Error saving new session to Firestore in startSession: %s", e)
         return ("Internal Server Error: Could not save session data.", 500)
     
     response_data = {
@@ -99,6 +194,7 @@ def startSession(request):
 
 # --- analyzeInitialProblem Function (FIXED & CLEANED) ---
 @functions_framework.http
+@traced("analyzeInitialProblem")
 def analyzeInitialProblem(request):
     """
     Handles the pre-analysis dialogue phase. Guides the user until an analysis is explicitly requested,
@@ -109,7 +205,7 @@ def analyzeInitialProblem(request):
         session_id = request_json["sessionId"]
         user_id = request_json["userId"]
         user_message_text = request_json["message"]
-        print(f"--- ANALYZING INITIAL PROBLEM for session: {session_id} ---")
+        log.info("Analyzing initial problem for session %s", session_id)
     except (TypeError, KeyError) as e:
         return ("Bad Request: Missing required fields in JSON body.", 400)
 
@@ -153,7 +249,7 @@ def analyzeInitialProblem(request):
     ]
     explicit_trigger = any(keyword in user_message_text.lower() for keyword in trigger_keywords)
     conversation_length_trigger = len(conversation_history_for_ai) >= 6  # 3 user + 3 AI messages
-    print(f"DEBUG: Message count: {len(conversation_history_for_ai)}, Explicit trigger: {explicit_trigger}, Length trigger: {conversation_length_trigger}")
+    log.debug("Message count: %d, Explicit trigger: %s, Length trigger: %s", len(conversation_history_for_ai), explicit_trigger, conversation_length_trigger)
 
     ai_response_text = "An error occurred."  # Default
 
@@ -173,7 +269,7 @@ Analysis Statement: [2-3 sentence analysis]
 Root Emotion: [core emotion]
 Cause of Emotion: [primary cause]
 """
-            analysis_full_response = model.generate_content(analysis_prompt_template).text.strip()
+            analysis_full_response = summary_gateway.generate(model, analysis_prompt_template).text.strip()
 
             # --- Parse the Analysis ---
             parsed_root_emotion = "Not identified"
@@ -216,11 +312,11 @@ Cause of Emotion: [primary cause]
             conversation_with_system = [Content(role="system", parts=[Part.from_text(system_message)])] + conversation_history_for_ai
 
             try:
-                response = model.generate_content(conversation_with_system)
+                response = dialogue_gateway.generate(model, conversation_with_system)
                 ai_response_text = response.text.strip()
             except Exception as e:
                 # Fallback
-                response = model.generate_content(conversation_history_for_ai)
+                response = dialogue_gateway.generate(model, conversation_history_for_ai)
                 ai_response_text = response.text.strip()
 
     except Exception as e:
@@ -251,6 +347,7 @@ Cause of Emotion: [primary cause]
 
 
 @functions_framework.http
+@traced("startEmptyChairSession")
 def startEmptyChairSession(request):
     """
     Marks a session as ready for Empty Chair dialogue.
@@ -272,6 +369,7 @@ def startEmptyChairSession(request):
     return (json.dumps(response_data), 200, {"Content-Type": "application/json", "Access-Control-Allow-Origin": "*"})
 # --- processMessage Function (Self-initializing) ---
 @functions_framework.http
+@traced("processMessage")
 def processMessage(request):
     """
     Handles ongoing Empty Chair session messages, generates AI prompts,
@@ -301,7 +399,8 @@ def processMessage(request):
         session_id = str(uuid.uuid4())
 
     session_ref = db.collection("users").document(user_id).collection("sessions").document(session_id)
-    session_data = session_ref.get()
+    with span("firestore_read"):
+        session_data = session_ref.get()
 
     if not session_data.exists:
         # Create new session with defaults
@@ -338,43 +437,50 @@ def processMessage(request):
     try:
         current_message_embedding = get_embedding_vertexai(user_message_text)
     except Exception as e:
-        print(f"ERROR generating embedding: {e}")
-
-    # --- Long-term memory RAG ---
-    long_term_memory_context = ""
-    try:
-        past_sessions_query = db.collection("users").document(user_id).collection("sessions") \
-            .where("personInChair", "==", current_person_in_chair) \
-            .where("blueSummaryEmbedding", "!=", []) \
-            .order_by("startTime", direction=firestore.Query.DESCENDING).limit(10).stream()
-        candidates = []
-        for doc in past_sessions_query:
+        log.error("Error generating embedding: %s", e)
+
+    # --- Long-term memory RAG (memoized per session, see SessionRagCache) ---
+    def load_candidates():
+        with span("rag_query"):
+            past_sessions = list(db.collection("users").document(user_id).collection("sessions")
+                                 .where("personInChair", "==", current_person_in_chair)
+                                 .where("blueSummaryEmbedding", "!=", [])
+                                 .order_by("startTime", direction=firestore.Query.DESCENDING)
+                                 .limit(RAG_CANDIDATES).stream())
+        vectors, rendered = [], []
+        for doc in past_sessions:
             if doc.id == session_id:
                 continue
             past_session_data = doc.to_dict()
-            if all(k in past_session_data for k in ["blueSummary", "blueSummaryEmbedding", "redSummary", "redSummaryEmbedding", "overallSessionReflection", "reflectionEmbedding"]):
-                target_embedding = past_session_data.get("reflectionEmbedding", [])
-                if current_message_embedding and target_embedding:
-                    similarity = cosine_similarity(current_message_embedding, target_embedding)
-                    candidates.append((similarity, past_session_data))
-
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        relevant_summaries_text = []
-        for score, sdata in candidates[:2]:
-            relevant_summaries_text.append(f"Past Session ({sdata.get('startTime').strftime('%Y-%m-%d')}, goal: {sdata.get('userGoal')}):")
-            relevant_summaries_text.append(f"  User Perspective (Blue): {sdata['blueSummary']}")
-            relevant_summaries_text.append(f"  Other Perspective (Red): {sdata['redSummary']}")
-            relevant_summaries_text.append(f"  Reflection: {sdata['overallSessionReflection']}\n")
-
-        if relevant_summaries_text:
-            long_term_memory_context = f"### User's Past Session Learnings (Semantic RAG for '{current_person_in_chair}'):\n" + "\n".join(relevant_summaries_text)
+            if all(k in past_session_data for k in ["blueSummary", "blueSummaryEmbedding", "redSummary", "redSummaryEmbedding", "overallSessionReflection", "reflectionEmbedding"]) \
+                    and past_session_data["reflectionEmbedding"]:
+                vectors.append(past_session_data["reflectionEmbedding"])
+                rendered.append([
+                    f"Past Session ({past_session_data.get('startTime').strftime('%Y-%m-%d')}, goal: {past_session_data.get('userGoal')}):",
+                    f"  User Perspective (Blue): {past_session_data['blueSummary']}",
+                    f"  Other Perspective (Red): {past_session_data['redSummary']}",
+                    f"  Reflection: {past_session_data['overallSessionReflection']}\n",
+                ])
+        return vectors, rendered
+
+    def render(entries):
+        relevant_summaries_text = [line for lines in entries for line in lines]
+        if not relevant_summaries_text:
+            return ""
+        return f"### User's Past Session Learnings (Semantic RAG for '{current_person_in_chair}'):\n" + "\n".join(relevant_summaries_text)
+
+    try:
+        long_term_memory_context = rag_cache.memory_block(
+            (user_id, session_id, current_person_in_chair), current_message_embedding, load_candidates, render)
     except Exception as e:
+        log.error("Long-term memory retrieval failed: %s", e)
         long_term_memory_context = ""
 
     # --- Retrieve current session conversation ---
     conversation_history = []
     try:
-        messages_query = session_ref.collection("messages").order_by("timestamp").stream()
+        with span("firestore_read"):
+            messages_query = list(session_ref.collection("messages").order_by("timestamp").stream())
         for msg_doc in messages_query:
             msg_data = msg_doc.to_dict()
             if msg_data.get("phase") == "empty_chair_ready":
@@ -403,7 +509,8 @@ def processMessage(request):
         conversation_with_system = [Content(role="user", parts=[Part.from_text(system_instruction)])]
         conversation_with_system.extend(conversation_history)
 
-        model_response = model.generate_content(conversation_with_system)
+        with span("generate"):
+            model_response = dialogue_gateway.generate(model, conversation_with_system)
         ai_response_text = model_response.text.strip()
 
     except Exception as e:
@@ -411,20 +518,21 @@ def processMessage(request):
 
     # --- Save messages ---
     try:
-        session_ref.collection("messages").document().set({
-            "text": user_message_text,
-            "role": "user",
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "perspective": perspective,
-            "phase": "empty_chair_ready"
-        })
-        session_ref.collection("messages").document().set({
-            "text": ai_response_text,
-            "role": "ai",
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "perspective": "facilitator",
-            "phase": "empty_chair_ready"
-        })
+        with span("firestore_write"):
+            session_ref.collection("messages").document().set({
+                "text": user_message_text,
+                "role": "user",
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "perspective": perspective,
+                "phase": "empty_chair_ready"
+            })
+            session_ref.collection("messages").document().set({
+                "text": ai_response_text,
+                "role": "ai",
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "perspective": "facilitator",
+                "phase": "empty_chair_ready"
+            })
     except Exception as e:
         return ("Internal Server Error: Could not save conversation data.", 500)
 
@@ -435,6 +543,7 @@ def processMessage(request):
 
 # --- generateSessionSummaries Function ---
 @functions_framework.http
+@traced("generateSessionSummaries")
 def generateSessionSummaries(request):
     """
     Generates 'blueSummary', 'redSummary', and an overall session reflection
@@ -445,16 +554,16 @@ def generateSessionSummaries(request):
         session_id = request_json["sessionId"]
         user_id = request_json["userId"]
 
-        print(f"--- GENERATING SUMMARIES for session: {session_id} ---")
+        log.info("Generating summaries for session %s", session_id)
     except (TypeError, KeyError) as e:
-        print(f"ERROR: Bad Request. Missing required fields in JSON body for generateSessionSummaries. Details: {e}")
+        log.warning("Bad Request. Missing required fields in JSON body for generateSessionSummaries. Details: %s", e)
         return ("Bad Request: Missing required fields in JSON body.", 400)
 
     session_ref = db.collection("users").document(user_id).collection("sessions").document(session_id)
     session_data = session_ref.get()
 
     if not session_data.exists:
-        print(f"ERROR: Session {session_id} not found for user {user_id}")
+        log.warning("Session %s not found for user %s", session_id, user_id)
         return ("Not Found: Session not found.", 404)
 
     session_details = session_data.to_dict()
@@ -493,10 +602,10 @@ def generateSessionSummaries(request):
             elif role == "ai" and msg_data.get("phase") == "empty_chair_ready": # Only include AI messages from EC phase for transcript
                 full_conversation_transcript.append(f"[Facilitator]: {text}")
                 
-        print(f"DEBUG: Found {len(blue_chair_content)} blue messages and {len(red_chair_content)} red messages in EC phase.")
+        log.debug("Found %d blue messages and %d red messages in EC phase.", len(blue_chair_content), len(red_chair_content))
 
     except Exception as e:
-        print(f"ERROR retrieving messages for summarization: {e}")
+        log.error("Error retrieving messages for summarization: %s", e)
         return ("Internal Server Error: Could not retrieve conversation messages for analysis.", 500)
 
 
@@ -506,8 +615,8 @@ def generateSessionSummaries(request):
             User statements from their own perspective:
             {'- '.join(blue_chair_content)}
             Summary of Blue Chair Perspective:"""
-            blue_summary_text = model.generate_content(blue_summary_prompt).text.strip()
-            print("DEBUG: Generated Blue Chair summary.")
+            blue_summary_text = summary_gateway.generate(model, blue_summary_prompt).text.strip()
+            log.debug("Generated Blue Chair summary.")
             blue_summary_embedding = get_embedding_vertexai(blue_summary_text)
 
         
@@ -516,8 +625,8 @@ def generateSessionSummaries(request):
             Statements from {person_in_chair}'s perspective:
             {'- '.join(red_chair_content)}
             Summary of Red Chair Perspective ({person_in_chair}):"""
-            red_summary_text = model.generate_content(red_summary_prompt).text.strip()
-            print("DEBUG: Generated Red Chair summary.")
+            red_summary_text = summary_gateway.generate(model, red_summary_prompt).text.strip()
+            log.debug("Generated Red Chair summary.")
             red_summary_embedding = get_embedding_vertexai(red_summary_text)
     
         transcript_text = '\n'.join(full_conversation_transcript) 
@@ -529,12 +638,12 @@ def generateSessionSummaries(request):
             {transcript_text}
 
             Provide a brief (2-3 sentences) overarching reflection or a key takeaway about the session's dynamics, progress, or insights gained. This is a final thought from the facilitator."""
-            overall_session_reflection = model.generate_content(reflection_prompt).text.strip()
-            print("DEBUG: Generated overall session reflection.")
+            overall_session_reflection = summary_gateway.generate(model, reflection_prompt).text.strip()
+            log.debug("Generated overall session reflection.")
             reflection_embedding = get_embedding_vertexai(overall_session_reflection)
 
     except Exception as e: 
-        print(f"CRITICAL CRASH calling the AI model for summarization: {e}")
+        log.critical("Crash calling the AI model for summarization: %s", e)
         import traceback
         traceback.print_exc()
 
@@ -548,9 +657,9 @@ def generateSessionSummaries(request):
             "reflectionEmbedding": reflection_embedding,     
             "endTime": firestore.SERVER_TIMESTAMP
         })
-        print("DEBUG: Saved summaries, embeddings, and marked session as ended in Firestore.")
+        log.debug("Saved summaries, embeddings, and marked session as ended in Firestore.")
     except Exception as e:
-        print(f"ERROR saving summaries and embeddings to Firestore: {e}")
+        log.error("Error saving summaries and embeddings to Firestore: %s", e)
         return ("Internal Server Error: Could not save session summaries and embeddings.", 500)
     
     response_data = {
@@ -560,4 +669,14 @@ def generateSessionSummaries(request):
         "overallSessionReflection": overall_session_reflection
     }
     headers = {"Access-Control-Allow-Origin": "*"}
-    return (json.dumps(response_data), 200, headers)
\ No newline at end of file
+    return (json.dumps(response_data), 200, headers)
+
+
+# --- metrics Function ---
+@functions_framework.http
+@traced("metrics")
+def metrics(request):
+    """Model gateway and concurrency-limiter counters, per-function stage latency histograms, log queue stats, RAG cache."""
+    headers = {"Content-Type": "application/json", "Access-Control-Allow-Origin": "*"}
+    return (json.dumps({**metrics_snapshot(), "endpoints": timing_snapshot(), "logging": log_stats(),
+                        "rag_cache": rag_cache.stats()}), 200, headers)
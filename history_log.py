@@ -0,0 +1,125 @@
+# history_log.py
+"""
+Local persistence for the `ai` chat driver: the conversation as an
+append-only log, and the one-time import of the old whole-file history.
+No clients or SDKs here, so it can be imported (and tested) on its own.
+"""
+import json
+import os
+import struct
+
+
+class HistoryLog:
+    """
+    Conversation turns as an append-only JSONL file plus an index of fixed-size
+    (8-byte) line offsets. A turn costs one appended line and one index entry,
+    and tail(n) reads n index entries and the last n lines, so per-turn I/O
+    stays constant however long the conversation gets.
+
+    Appends are fsynced, data before index. On open, a torn last line (crash
+    mid-write) is cut off, index entries for data that never reached the disk
+    are dropped, and entries are re-derived for any lines the index missed,
+    scanning from the last indexed offset only.
+    """
+
+    _OFFSET = struct.Struct("<Q")
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self._recover()
+        self._data = open(self.path, "ab")
+        self._index = open(self.index_path, "ab")
+
+    def _recover(self):
+        for p in (self.path, self.index_path):
+            if not os.path.exists(p):
+                open(p, "wb").close()
+        size = os.path.getsize(self.path)
+        with open(self.index_path, "rb+") as idx, open(self.path, "rb+") as data:
+            count = os.path.getsize(self.index_path) // self._OFFSET.size
+            last_offset = None
+            # drop entries pointing past the data or at a line that lost its end
+            # (index written, data lost); the torn line itself is cut off below
+            while count:
+                idx.seek((count - 1) * self._OFFSET.size)
+                last = self._OFFSET.unpack(idx.read(self._OFFSET.size))[0]
+                if last < size:
+                    data.seek(last)
+                    if data.readline().endswith(b"\n"):
+                        last_offset = last
+                        break
+                count -= 1
+            idx.truncate(count * self._OFFSET.size)
+
+            pos = last_offset or 0
+            data.seek(pos)
+            if last_offset is not None:
+                pos += len(data.readline())  # the last indexed line
+            idx.seek(0, os.SEEK_END)
+            while pos < size:
+                line = data.readline()
+                if not line.endswith(b"\n"):
+                    data.truncate(pos)  # torn final write
+                    size = pos
+                    break
+                idx.write(self._OFFSET.pack(pos))
+                count += 1
+                pos += len(line)
+        self._size = size
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def append(self, turn):
+        line = (json.dumps(turn, ensure_ascii=False) + "\n").encode("utf-8")
+        self._data.write(line)
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._index.write(self._OFFSET.pack(self._size))
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        self._size += len(line)
+        self._count += 1
+
+    def tail(self, n):
+        """The last n turns, oldest first."""
+        n = min(n, self._count)
+        if n <= 0:
+            return []
+        with open(self.index_path, "rb") as idx:
+            idx.seek((self._count - n) * self._OFFSET.size)
+            start = self._OFFSET.unpack(idx.read(self._OFFSET.size))[0]
+        with open(self.path, "rb") as data:
+            data.seek(start)
+            chunk = data.read(self._size - start)
+        return [json.loads(line) for line in chunk.splitlines()]
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+def migrate_legacy_history(legacy_path, path, index_path):
+    """
+    Imports `legacy_path` (whole-list JSON format) into an empty log, once;
+    call before opening the HistoryLog. The turns are written to a temp file
+    that replaces the log in one rename, so a crash mid-import leaves the log
+    empty and the import simply runs again, never a partial history that
+    would look migrated. The index is rebuilt from the data on open.
+    """
+    if not os.path.exists(legacy_path) or (os.path.exists(path) and os.path.getsize(path)):
+        return
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        turns = json.load(f)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        for turn in turns:
+            out.write((json.dumps(turn, ensure_ascii=False) + "\n").encode("utf-8"))
+        out.flush()
+        os.fsync(out.fileno())
+    if os.path.exists(index_path):
+        os.remove(index_path)  # offsets of an empty log; rebuilt by HistoryLog._recover
+    os.replace(tmp, path)
+    os.replace(legacy_path, legacy_path + ".migrated")
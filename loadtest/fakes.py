@@ -0,0 +1,709 @@
+# fakes.py
+"""
+In-memory stand-ins for Firestore and the Realtime Database, with a
+configurable latency per round-trip, so the backends can be driven without a
+Firebase project. They cover the client surface the backends use (documents,
+subcollections, where/order_by/limit/start_after queries, count()
+aggregations, get_all, field transforms, batches and transactions) and count
+reads/writes the way Firestore bills them.
+AsyncFakeFirestore is the firestore.AsyncClient view of the same data.
+"""
+import copy
+import asyncio
+import math
+import time
+import random
+import string
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from google.cloud import firestore
+
+AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+
+class Latency:
+    """
+    Log-normal latency given its median and p99 (milliseconds), which is close
+    to what Firestore and Vertex round-trips look like. Latency(0) never sleeps.
+    """
+
+    def __init__(self, median_ms, p99_ms=None):
+        self.median = median_ms / 1000.0
+        p99 = (p99_ms if p99_ms is not None else median_ms) / 1000.0
+        self.sigma = math.log(p99 / self.median) / 2.326 if self.median > 0 and p99 > self.median else 0.0
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0.0, self.sigma)) if self.sigma else self.median
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+    def __repr__(self):
+        return f"Latency(median={self.median * 1000:.0f}ms, sigma={self.sigma:.2f})"
+
+
+def _auto_id():
+    return "".join(random.choice(AUTO_ID_CHARS) for _ in range(20))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+# ------------------ Firestore ------------------
+def _set_path(data, dotted, value):
+    keys = dotted.split(".")
+    for k in keys[:-1]:
+        data = data.setdefault(k, {})
+    data[keys[-1]] = value
+
+
+def _get_path(data, dotted):
+    for k in dotted.split("."):
+        if not isinstance(data, dict) or k not in data:
+            return None, False
+        data = data[k]
+    return data, True
+
+
+def _apply_value(current, value):
+    """Resolves SERVER_TIMESTAMP / Increment / ArrayUnion / ArrayRemove against the stored value."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, firestore.ArrayUnion):
+        out = list(current) if isinstance(current, list) else []
+        out.extend(v for v in value.values if v not in out)
+        return out
+    if isinstance(value, firestore.ArrayRemove):
+        return [v for v in (current if isinstance(current, list) else []) if v not in value.values]
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+def _merge(target, updates):
+    for key, value in updates.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _matches(data, field, op, value):
+    current, present = _get_path(data, field)
+    if not present:
+        return False  # Firestore never returns docs missing a filtered field
+    try:
+        return _compare(current, op, value)
+    except TypeError:
+        return False  # mismatched types never match (Firestore orders by type first)
+
+
+def _compare(current, op, value):
+    if op == "==":
+        return current == value
+    if op == "!=":
+        return current != value
+    if op == "<":
+        return current < value
+    if op == "<=":
+        return current <= value
+    if op == ">":
+        return current > value
+    if op == ">=":
+        return current >= value
+    if op == "in":
+        return current in value
+    if op == "not-in":
+        return current not in value
+    if op == "array_contains":
+        return isinstance(current, list) and value in current
+    if op == "array_contains_any":
+        return isinstance(current, list) and any(v in current for v in value)
+    raise ValueError(f"unsupported operator {op!r}")
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return copy.deepcopy(_get_path(self._data or {}, field)[0])
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, transaction=None, field_paths=None):
+        self._db._round_trip("read")
+        return FakeSnapshot(self, self._db._read(self.path))
+
+    def set(self, data, merge=False):
+        self._db._round_trip("write")
+        self._db._write(self.path, data, merge)
+
+    def update(self, data):
+        self._db._round_trip("write")
+        self._db._update(self.path, data)
+
+    def delete(self):
+        self._db._round_trip("delete")
+        self._db._delete(self.path)
+
+    def collections(self):
+        self._db._round_trip("query")
+        with self._db._lock:
+            names = self._db._subcollections(self.path)
+        return [self.collection(name) for name in names]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit=None, cursor=None, projection=None):
+        self._db = db
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        fields = {"filters": self._filters, "orders": self._orders, "limit": self._limit, "cursor": self._cursor,
+                  "projection": self._projection}
+        fields.update(changes)
+        return self.query_class(self._db, self._path, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:  # FieldFilter(field_path, op_string, value)
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction == "DESCENDING"),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=(self._cursor_id(document_fields_or_snapshot), False))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(cursor=(self._cursor_id(document_fields_or_snapshot), True))
+
+    @staticmethod
+    def _cursor_id(value):
+        """Snapshots and {"__name__": id} cursors are supported; both position by document id."""
+        if isinstance(value, dict):
+            return value["__name__"]
+        return value.id
+
+    def _results(self):
+        docs = []
+        for doc_id, data in self._db._children(self._path):
+            if all(_matches(data, f, op, v) for f, op, v in self._filters) and \
+                    all(f == "__name__" or _get_path(data, f)[1] for f, _ in self._orders):
+                docs.append((doc_id, data))
+        # stable sorts from the last order_by key to the first; doc id breaks ties
+        docs.sort(key=lambda d: d[0])
+        for field, descending in reversed(self._orders):
+            if field == "__name__":
+                docs.sort(key=lambda d: d[0], reverse=descending)
+            else:
+                docs.sort(key=lambda d: _get_path(d[1], field)[0], reverse=descending)
+        if self._cursor is not None:
+            cursor_id, inclusive = self._cursor
+            ids = [doc_id for doc_id, _ in docs]
+            if cursor_id in ids:
+                docs = docs[ids.index(cursor_id) + (0 if inclusive else 1):]
+            elif self._orders and self._orders[0][0] == "__name__" and not self._orders[0][1]:
+                docs = [d for d in docs if d[0] > cursor_id]  # cursor document since deleted
+            else:
+                docs = []
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        if self._projection is not None:
+            docs = [(doc_id, {f: data[f] for f in self._projection if f in data}) for doc_id, data in docs]
+        return docs
+
+    def stream(self, transaction=None):
+        self._db._round_trip("query")
+        with self._db._lock:
+            results = self._results()
+            self._db.ops["read"] += max(len(results), 1)  # an empty query is still billed one read
+        for doc_id, data in results:
+            yield FakeSnapshot(FakeDocumentReference(self._db, f"{self._path}/{doc_id}"), copy.deepcopy(data))
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+    def count(self, alias=None):
+        return FakeAggregationQuery(self, alias or "count")
+
+
+FakeQuery.query_class = FakeQuery
+
+
+class FakeAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    """query.count(): one round-trip, billed one read per 1000 matches (at least one)."""
+
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        db = self._query._db
+        db._round_trip("query")
+        with db._lock:
+            matches = len(self._query._results())
+            db.ops["read"] += max(math.ceil(matches / 1000), 1)
+        return [[FakeAggregationResult(self._alias, matches)]]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._db, f"{self._path}/{document_id or _auto_id()}")
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return _now(), ref
+
+    def list_documents(self, page_size=None):
+        self._db._round_trip("query")
+        with self._db._lock:
+            ids = [doc_id for doc_id, _ in self._db._children(self._path, include_missing=True)]
+        return [self.document(i) for i in ids]
+
+
+class FakeWriteBatch:
+    """Buffers writes and applies them together on commit (one round-trip)."""
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference.path, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference.path, data, None))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, None))
+
+    def commit(self):
+        self._db._round_trip("commit")
+        self._apply()
+
+    def _apply(self):
+        with self._db._lock:
+            for kind, path, data, merge in self._writes:
+                self._db.ops["delete" if kind == "delete" else "write"] += 1
+                if kind == "set":
+                    self._db._write(path, data, merge)
+                elif kind == "update":
+                    self._db._update(path, data)
+                else:
+                    self._db._delete(path)
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    def get_all(self, references):
+        return self._db.get_all(references, transaction=self)
+
+
+class AsyncFakeTransaction(FakeWriteBatch):
+    async def commit(self):
+        await self._db._round_trip_async("commit")
+        self._apply()
+
+
+class FakeBulkWriter(FakeWriteBatch):
+    """BulkWriter: buffered writes go out in batches of 20, one round-trip each, on flush()."""
+
+    BATCH_SIZE = 20
+
+    def flush(self):
+        writes, self._writes = self._writes, []
+        for start in range(0, len(writes), self.BATCH_SIZE):
+            self._writes = writes[start:start + self.BATCH_SIZE]
+            self.commit()
+
+    def close(self):
+        self.flush()
+
+
+def transactional(fn):
+    """
+    Stand-in for firestore.transactional. Transactions are serialized on one
+    process-wide lock instead of retried on contention; that keeps them
+    correct, and is the pessimistic case for throughput.
+    """
+    def run(transaction, *args, **kwargs):
+        with transaction._db._txn_lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+    return run
+
+
+def async_transactional(fn):
+    """Stand-in for firestore.async_transactional, serialized on an asyncio lock like transactional()."""
+    async def run(transaction, *args, **kwargs):
+        db = transaction._db
+        if db._txn_lock_async is None:
+            db._txn_lock_async = asyncio.Lock()
+        async with db._txn_lock_async:
+            result = await fn(transaction, *args, **kwargs)
+            await transaction.commit()
+            return result
+    return run
+
+
+class FakeFirestore:
+    """
+    Dict-backed firestore.Client. Every RPC (get, set, update, delete, query,
+    batch commit) sleeps once for `latency`; `ops` counts billed reads, writes
+    and deletes.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency(0)
+        self.ops = Counter()
+        self._docs = {}
+        self._lock = threading.RLock()
+        self._txn_lock = threading.Lock()
+        self._txn_lock_async = None
+
+    # -- client surface --
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def bulk_writer(self, **kwargs):
+        return FakeBulkWriter(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        """Batched get: one round-trip, one billed read per document."""
+        references = list(references)
+        self._round_trip("query")
+        with self._lock:
+            self.ops["read"] += len(references)
+            return [FakeSnapshot(ref, self._read(ref.path)) for ref in references]
+
+    # -- storage --
+    def _count(self, kind):
+        if kind in ("read", "write", "delete"):
+            with self._lock:
+                self.ops[kind] += 1
+
+    def _round_trip(self, kind):
+        self._count(kind)
+        self.latency.sleep()
+
+    async def _round_trip_async(self, kind):
+        self._count(kind)
+        delay = self.latency.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _read(self, path):
+        with self._lock:
+            data = self._docs.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _write(self, path, data, merge):
+        with self._lock:
+            if merge and path in self._docs:
+                _merge(self._docs[path], data)
+            else:
+                doc = {}
+                _merge(doc, data)
+                self._docs[path] = doc
+
+    def _update(self, path, data):
+        with self._lock:
+            if path not in self._docs:
+                raise KeyError(f"404 No document to update: {path}")
+            doc = self._docs[path]
+            for dotted, value in data.items():
+                if value is firestore.DELETE_FIELD:
+                    parent, present = _get_path(doc, dotted.rsplit(".", 1)[0]) if "." in dotted else (doc, True)
+                    if present and isinstance(parent, dict):
+                        parent.pop(dotted.rsplit(".", 1)[-1], None)
+                else:
+                    _set_path(doc, dotted, _apply_value(_get_path(doc, dotted)[0], value))
+
+    def _delete(self, path):
+        with self._lock:
+            self._docs.pop(path, None)
+
+    def _children(self, collection_path, include_missing=False):
+        """(doc_id, data) for documents directly inside a collection."""
+        prefix = collection_path + "/"
+        depth = collection_path.count("/") + 1
+        found = {}
+        for path, data in self._docs.items():
+            if path.startswith(prefix):
+                parts = path.split("/")
+                if len(parts) == depth + 1:
+                    found[parts[depth]] = data
+                elif include_missing:  # parent of a subcollection, possibly without its own data
+                    found.setdefault(parts[depth], None)
+        return [(doc_id, data) for doc_id, data in found.items() if data is not None or include_missing]
+
+    def _subcollections(self, doc_path):
+        prefix = doc_path + "/"
+        return sorted({path[len(prefix):].split("/", 1)[0] for path in self._docs if path.startswith(prefix)})
+
+    def reset_ops(self):
+        with self._lock:
+            self.ops.clear()
+
+
+# ------------------ Firestore (async client) ------------------
+class AsyncFakeDocumentReference(FakeDocumentReference):
+    def collection(self, name):
+        return AsyncFakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    async def get(self, transaction=None, field_paths=None):
+        await self._db._round_trip_async("read")
+        return FakeSnapshot(self, self._db._read(self.path))
+
+    async def set(self, data, merge=False):
+        await self._db._round_trip_async("write")
+        self._db._write(self.path, data, merge)
+
+    async def update(self, data):
+        await self._db._round_trip_async("write")
+        self._db._update(self.path, data)
+
+    async def delete(self):
+        await self._db._round_trip_async("delete")
+        self._db._delete(self.path)
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def stream(self, transaction=None):
+        await self._db._round_trip_async("query")
+        with self._db._lock:
+            results = self._results()
+            self._db.ops["read"] += max(len(results), 1)
+        for doc_id, data in results:
+            yield FakeSnapshot(AsyncFakeDocumentReference(self._db, f"{self._path}/{doc_id}"), copy.deepcopy(data))
+
+    async def get(self, transaction=None):
+        return [snapshot async for snapshot in self.stream(transaction)]
+
+
+AsyncFakeQuery.query_class = AsyncFakeQuery
+
+
+class AsyncFakeCollectionReference(AsyncFakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return AsyncFakeDocumentReference(self._db, f"{self._path}/{document_id or _auto_id()}")
+
+    async def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        await ref.set(data)
+        return _now(), ref
+
+
+class AsyncFakeFirestore:
+    """
+    firestore.AsyncClient over a FakeFirestore: same documents and op counts,
+    round-trip latency awaited with asyncio.sleep instead of blocking a thread.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    def collection(self, name):
+        return AsyncFakeCollectionReference(self._db, name)
+
+    def document(self, path):
+        return AsyncFakeDocumentReference(self._db, path)
+
+    def transaction(self, **kwargs):
+        return AsyncFakeTransaction(self._db)
+
+
+# ------------------ Realtime Database ------------------
+class FakeRTDBReference:
+    def __init__(self, rtdb, path):
+        self._rtdb = rtdb
+        self.path = "/" + path.strip("/")
+        self.key = self.path.rsplit("/", 1)[-1] or None
+
+    def child(self, path):
+        return FakeRTDBReference(self._rtdb, f"{self.path}/{path.strip('/')}")
+
+    def get(self, etag=False, shallow=False):
+        self._rtdb._round_trip("read")
+        value = self._rtdb._get(self.path)
+        if shallow and isinstance(value, dict):
+            return {k: True for k in value}
+        return value
+
+    def set(self, value):
+        self._rtdb._round_trip("write")
+        self._rtdb._set(self.path, value)
+
+    def update(self, value):
+        """Multi-path update: keys may be relative paths, all applied atomically."""
+        self._rtdb._round_trip("write")
+        with self._rtdb._lock:
+            for rel, v in value.items():
+                self._rtdb._set(f"{self.path}/{rel.strip('/')}", v)
+
+    def push(self, value=""):
+        ref = self.child(_auto_id())
+        ref.set(value)
+        return ref
+
+    def delete(self):
+        self._rtdb._round_trip("delete")
+        self._rtdb._set(self.path, None)
+
+    def order_by_key(self):
+        return FakeRTDBQuery(self)
+
+
+class FakeRTDBQuery:
+    """order_by_key() queries: start_at / end_at on keys, limit_to_first / limit_to_last."""
+
+    def __init__(self, ref, start=None, end=None, first=None, last=None):
+        self._ref = ref
+        self._bounds = {"start": start, "end": end, "first": first, "last": last}
+
+    def _with(self, **changes):
+        return FakeRTDBQuery(self._ref, **{**self._bounds, **changes})
+
+    def start_at(self, key):
+        return self._with(start=key)
+
+    def end_at(self, key):
+        return self._with(end=key)
+
+    def limit_to_first(self, count):
+        return self._with(first=count)
+
+    def limit_to_last(self, count):
+        return self._with(last=count)
+
+    def get(self):
+        node = self._ref.get()
+        if not isinstance(node, dict):
+            return {}
+        b = self._bounds
+        keys = [k for k in sorted(node) if (b["start"] is None or k >= b["start"]) and
+                (b["end"] is None or k <= b["end"])]
+        if b["first"] is not None:
+            keys = keys[:b["first"]]
+        if b["last"] is not None:
+            keys = keys[-b["last"]:]
+        return {k: node[k] for k in keys}
+
+
+class FakeRTDB:
+    """Nested-dict Realtime Database; reference(path) mirrors firebase_admin.db.reference."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency(0)
+        self.ops = Counter()
+        self._root = {}
+        self._lock = threading.RLock()
+
+    def reference(self, path="/", app=None, url=None):
+        return FakeRTDBReference(self, path)
+
+    def _round_trip(self, kind):
+        with self._lock:
+            self.ops[kind] += 1
+        self.latency.sleep()
+
+    @staticmethod
+    def _keys(path):
+        return [k for k in path.split("/") if k]
+
+    def _get(self, path):
+        with self._lock:
+            node = self._root
+            for k in self._keys(path):
+                if not isinstance(node, dict) or k not in node:
+                    return None
+                node = node[k]
+            return copy.deepcopy(node)
+
+    def _set(self, path, value):
+        with self._lock:
+            keys = self._keys(path)
+            if not keys:
+                self._root = copy.deepcopy(value) if isinstance(value, dict) else {}
+                return
+            node = self._root
+            for k in keys[:-1]:
+                if not isinstance(node.get(k), dict):
+                    node[k] = {}
+                node = node[k]
+            if value is None:
+                node.pop(keys[-1], None)
+            else:
+                node[keys[-1]] = copy.deepcopy(value)
+
+    def reset_ops(self):
+        with self._lock:
+            self.ops.clear()
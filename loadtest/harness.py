@@ -0,0 +1,514 @@
+# harness.py
+"""
+Offline load tests for the backends. Each service's main.py is imported
+in-process with its Firebase/Vertex/Gemini entry points patched to the
+in-memory fakes (fakes.py) and stub models (stubs.py), then driven by a
+thread-pool load generator. No network, project or credentials involved.
+
+    python harness.py --list
+    python harness.py clario_chat relation_chat --concurrency 32 --requests 400
+    python harness.py --save-baseline     # record baselines.json
+    python harness.py                     # run everything, compare against baselines.json
+
+    # requests one instance sustains: Flask with 8 gunicorn threads vs the ASGI app,
+    # recorded under its own label (baselines.json key "<scenario>@overload")
+    python harness.py relation_chat relation_chat_asgi --concurrency 128 --requests 1000 --threads 8 \
+        --label overload --save-baseline
+
+Scenarios ending in _asgi drive a service's asgi.py (Quart) on one event loop
+with `concurrency` tasks; the others call the Flask/functions_framework
+handlers from `concurrency` client threads, at most --threads at a time.
+
+A chat answered with the backend's CHAT_FALLBACK_REPLY (its model call was
+shed by the limiter, timed out or failed) is counted as "shed", not served:
+throughput counts every response, goodput only real replies.
+
+The backends' SDKs must be installed (pip install -r requirements.txt).
+Helper modules shared between backends (llm_gateway.py, crisis.py,
+structured_output.py) are identical copies, so loading several services in
+one process reuses whichever copy was imported first.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import contextlib
+import importlib.util
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request
+from fakes import Latency, FakeFirestore, AsyncFakeFirestore, FakeRTDB, transactional, async_transactional
+from stubs import StubModel, StubGenAIClient, StubEmbeddingModel, StubImageModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# ------------------ CONFIG ------------------
+# Round-trip latencies (median ms, p99 ms), roughly what us-central1 sees from Cloud Run.
+FIRESTORE_LATENCY = (8, 40)
+RTDB_LATENCY = (10, 50)
+GEMINI_LATENCY = (700, 2500)
+EMBEDDING_LATENCY = (60, 250)
+IMAGEN_LATENCY = (4000, 9000)
+REGRESSION_TOLERANCE = 0.20  # fail when p95 grows / throughput drops by more than this vs baseline
+# Backend output goes here. It stays open for the whole run: async_logging binds its handler to
+# whatever sys.stdout is at import time, and its writer thread can still log after a scenario ends.
+_DEVNULL = open(os.devnull, "w")
+
+SAMPLE_MESSAGES = [
+    "I had another argument with my sister about the wedding plans.",
+    "Work has been overwhelming and I can't switch off at night.",
+    "Talked to Priya today and it actually helped a lot.",
+    "I keep replaying what my dad said last weekend.",
+    "Feeling a bit better after my walk this morning.",
+    "My manager ignored my idea in the meeting again.",
+    "I don't know why I feel so flat lately.",
+    "Rahul and I finally sorted things out, I'm relieved.",
+    "I'm anxious about the exam results coming out on Friday.",
+    "Mom called and we had a really nice chat.",
+    "I want to die, nothing is getting better.",  # exercises the crisis fast path
+    "Slept badly again, maybe four hours.",
+]
+
+
+# ------------------ Environment ------------------
+class Environment:
+    """One set of fakes and stubs, patched over the SDK entry points while active."""
+
+    def __init__(self, scale=1.0, error_rate=0.0):
+        def latency(spec):
+            return Latency(spec[0] * scale, spec[1] * scale)
+        self.firestore = FakeFirestore()
+        self.rtdb = FakeRTDB()
+        self.model = StubModel(latency(GEMINI_LATENCY), error_rate=error_rate)
+        self.embeddings = StubEmbeddingModel(latency(EMBEDDING_LATENCY), error_rate=error_rate)
+        self.images = StubImageModel(latency(IMAGEN_LATENCY), error_rate=error_rate)
+        self._store_latencies = (latency(FIRESTORE_LATENCY), latency(RTDB_LATENCY))
+        self._patches = contextlib.ExitStack()
+        self._services = {}
+
+    def __enter__(self):
+        targets = {
+            "google.cloud.firestore.Client": lambda *a, **kw: self.firestore,
+            "google.cloud.firestore.AsyncClient": lambda *a, **kw: AsyncFakeFirestore(self.firestore),
+            "google.cloud.firestore.transactional": transactional,
+            "google.cloud.firestore.async_transactional": async_transactional,
+            "firebase_admin.initialize_app": lambda *a, **kw: None,
+            "firebase_admin.credentials.ApplicationDefault": lambda *a, **kw: None,
+            "firebase_admin.auth.verify_id_token": lambda token, *a, **kw: {"uid": token},
+            "firebase_admin.db.reference": self.rtdb.reference,
+            "google.genai.Client": lambda *a, **kw: StubGenAIClient(self.model),
+            "google.generativeai.configure": lambda *a, **kw: None,
+            "google.generativeai.GenerativeModel": lambda *a, **kw: self.model,
+            "google.cloud.language_v1.LanguageServiceClient": lambda *a, **kw: None,
+            "vertexai.init": lambda *a, **kw: None,
+            "vertexai.generative_models.GenerativeModel": lambda *a, **kw: self.model,
+            "vertexai.language_models.TextEmbeddingModel.from_pretrained": lambda *a, **kw: self.embeddings,
+            "vertexai.preview.vision_models.ImageGenerationModel.from_pretrained": lambda *a, **kw: self.images,
+        }
+        for target, replacement in targets.items():
+            self._patches.enter_context(mock.patch(target, replacement))
+        os.environ.setdefault("GOOGLE_API_KEY", "loadtest")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")  # keep per-request backend logs out of the report
+        return self
+
+    def __exit__(self, *exc):
+        self._patches.close()
+
+    def service(self, name, entry="main"):
+        """
+        Imports <name>/<entry>.py once under the patches (as module '<name>_<entry>').
+        asgi.py does `from main import ...`; it gets this service's main module.
+        """
+        key = f"{name}_{entry}"
+        if key not in self._services:
+            service_dir = os.path.join(ROOT, name)
+            if service_dir not in sys.path:
+                sys.path.insert(0, service_dir)
+            if entry != "main":
+                sys.modules["main"] = self.service(name)
+            spec = importlib.util.spec_from_file_location(key, os.path.join(service_dir, f"{entry}.py"))
+            module = importlib.util.module_from_spec(spec)
+            try:
+                with contextlib.redirect_stdout(_DEVNULL):
+                    spec.loader.exec_module(module)
+            finally:
+                sys.modules.pop("main", None)
+            self._services[key] = module
+        return self._services[key]
+
+    def start_latency(self):
+        """Seeding runs at zero latency; the configured round-trip latency applies from here on."""
+        self.firestore.latency, self.rtdb.latency = self._store_latencies
+        self.firestore.reset_ops()
+        self.rtdb.reset_ops()
+        for stub in (self.model, self.embeddings, self.images):
+            stub.calls.clear()
+
+
+# ------------------ Request helpers ------------------
+SHED = "shed"  # request status: answered 200 with the fallback reply instead of a model reply
+
+
+def _chat_status(status, payload, fallback):
+    return SHED if status == 200 and (payload or {}).get("reply") == fallback else status
+
+
+def _flask_call(app, path, uid, body):
+    resp = app.test_client().post(path, json=body, headers={"Authorization": f"Bearer {uid}"})
+    return resp.status_code
+
+
+def _flask_chat(module, uid, message):
+    resp = module.app.test_client().post("/chat", json={"message": message}, headers={"Authorization": f"Bearer {uid}"})
+    return _chat_status(resp.status_code, resp.get_json(silent=True), module.CHAT_FALLBACK_REPLY)
+
+
+def _flask_get(app, path, uid):
+    return app.test_client().get(path, headers={"Authorization": f"Bearer {uid}"}).status_code
+
+
+def _function_call(fn, uid, body):
+    """Invokes a functions_framework handler with a Flask request, as the framework does."""
+    with FUNCTION_APP.test_request_context("/", method="POST", json=body,
+                                           headers={"Authorization": f"Bearer {uid}"}):
+        result = fn(request)
+    if isinstance(result, tuple):
+        return result[1] if len(result) > 1 else 200
+    return getattr(result, "status_code", 200)
+
+
+FUNCTION_APP = Flask("loadtest_functions")
+
+
+async def _asgi_call(app, path, uid, body=None, method="POST"):
+    kwargs = {"json": body} if body is not None else {}
+    resp = await app.test_client().open(path, method=method, headers={"Authorization": f"Bearer {uid}"}, **kwargs)
+    return resp.status_code
+
+
+async def _asgi_chat(module, uid, message):
+    resp = await module.app.test_client().post("/chat", json={"message": message},
+                                               headers={"Authorization": f"Bearer {uid}"})
+    return _chat_status(resp.status_code, await resp.get_json(), module.CHAT_FALLBACK_REPLY)
+
+
+def _message(i):
+    return SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)]
+
+
+def _seed_profile(db, uid, chats=20):
+    db.collection("users").document(uid).set({
+        "name": "Sam", "age": "27", "onboarding_complete": True, "main_goal": "sleep better",
+        "important_people": "my sister, Priya", "trusted_person": "Priya",
+    })
+    start = datetime.now(timezone.utc) - timedelta(days=2)
+    chats_ref = db.collection("users").document(uid).collection("chats")
+    for n in range(chats):
+        chats_ref.document().set({"role": "user" if n % 2 == 0 else "assistant",
+                                  "text": _message(n), "ts": start + timedelta(minutes=n)})
+
+
+def _seed_relations(db, uid, people=("priya", "rahul", "mom", "dad", "sister")):
+    relationships = db.collection("users").document(uid).collection("relationships")
+    for n, person in enumerate(people):
+        when = datetime.now(timezone.utc) - timedelta(days=n)
+        relationships.document(person).set({
+            "name": person, "last_interaction": when, "last_type": "positive",
+            "history": [{"timestamp": when, "type": "positive", "message": _message(n)}],
+        })
+
+
+def _seed_empty_chair(env, uid, past_sessions=6, messages=12):
+    db = env.firestore
+    sessions = db.collection("users").document(uid).collection("sessions")
+    for n in range(past_sessions):
+        reflection = f"Session {n}: I understood my father was scared, not angry."
+        sessions.document(f"past-{n}").set({
+            "personInChair": "my father", "userGoal": "forgive him",
+            "startTime": datetime.now(timezone.utc) - timedelta(days=7 * (n + 1)),
+            "sessionPhase": "completed",
+            "blueSummary": "I felt unheard.", "blueSummaryEmbedding": env.embeddings.get_embeddings(["blue"])[0].values,
+            "redSummary": "He felt he failed me.", "redSummaryEmbedding": env.embeddings.get_embeddings(["red"])[0].values,
+            "overallSessionReflection": reflection,
+            "reflectionEmbedding": env.embeddings.get_embeddings([reflection])[0].values,
+        })
+    session = sessions.document("live")
+    session.set({"personInChair": "my father", "userGoal": "forgive him",
+                 "startTime": datetime.now(timezone.utc), "sessionPhase": "empty_chair_ready"})
+    for n in range(messages):
+        session.collection("messages").document().set({
+            "text": _message(n), "role": "ai" if n % 2 else "user", "timestamp": datetime.now(timezone.utc),
+            "phase": "empty_chair_ready", "perspective": "facilitator" if n % 2 else "blue"})
+    env.embeddings.calls.clear()
+
+
+# ------------------ Scenarios ------------------
+# name -> (service dir[:entry module], seed(env, uid), request(env, module, i, uid) -> status or SHED)
+# For ":asgi" services the request returns a coroutine resolving to the status.
+SCENARIOS = {
+    "clario_chat": (
+        "clario_backend",
+        lambda env, uid: _seed_profile(env.firestore, uid),
+        lambda env, m, i, uid: _flask_chat(m, uid, _message(i))),
+    "clario_onboarding": (
+        "clario_backend",
+        lambda env, uid: None,
+        lambda env, m, i, uid: _flask_call(m.app, "/onboarding", uid, {"answer": f"answer {i}"})),
+    "clario_analyzeMood": (
+        "clario_backend",
+        lambda env, uid: None,
+        # unique text per request so single-flight coalescing doesn't flatter the numbers
+        lambda env, m, i, uid: _function_call(m.analyzeMood, uid, {"text": f"{_message(i)} (entry {i})"})),
+    "relation_chat": (
+        "RelationAI",
+        lambda env, uid: _seed_profile(env.firestore, uid),
+        lambda env, m, i, uid: _flask_chat(m, uid, _message(i))),
+    "relation_onboarding": (
+        "RelationAI",
+        lambda env, uid: None,
+        lambda env, m, i, uid: _flask_call(m.app, "/onboarding", uid, {"answer": f"answer {i}"})),
+    "relation_relations": (
+        "RelationAI",
+        lambda env, uid: _seed_relations(env.firestore, uid),
+        lambda env, m, i, uid: _flask_get(m.app, "/relations", uid)),
+    "clario_chat_asgi": (
+        "clario_backend:asgi",
+        lambda env, uid: _seed_profile(env.firestore, uid),
+        lambda env, m, i, uid: _asgi_chat(m, uid, _message(i))),
+    "clario_onboarding_asgi": (
+        "clario_backend:asgi",
+        lambda env, uid: None,
+        lambda env, m, i, uid: _asgi_call(m.app, "/onboarding", uid, {"answer": f"answer {i}"})),
+    "relation_chat_asgi": (
+        "RelationAI:asgi",
+        lambda env, uid: _seed_profile(env.firestore, uid),
+        lambda env, m, i, uid: _asgi_chat(m, uid, _message(i))),
+    "relation_onboarding_asgi": (
+        "RelationAI:asgi",
+        lambda env, uid: None,
+        lambda env, m, i, uid: _asgi_call(m.app, "/onboarding", uid, {"answer": f"answer {i}"})),
+    "relation_relations_asgi": (
+        "RelationAI:asgi",
+        lambda env, uid: _seed_relations(env.firestore, uid),
+        lambda env, m, i, uid: _asgi_call(m.app, "/relations", uid, method="GET")),
+    "emptychair_processMessage": (
+        "emptyChair_backend",
+        _seed_empty_chair,
+        lambda env, m, i, uid: _function_call(m.processMessage, uid, {
+            "sessionId": "live", "userId": uid, "message": _message(i), "perspective": "blue"})),
+    "journal_analyze": (
+        "JournalAI",
+        lambda env, uid: None,
+        lambda env, m, i, uid: _flask_call(m.app, "/analyze-journal", uid, {
+            "journal_text": f"{_message(i)} (entry {i})", "uid": uid})),
+}
+
+
+# ------------------ Load generator ------------------
+def _percentile(ordered, q):
+    return ordered[int(q * (len(ordered) - 1))] if ordered else float("nan")
+
+
+def _drive_threads(call, env, module, uids, concurrency, requests, threads=None):
+    """`concurrency` client threads; at most `threads` requests inside the app at once, like gunicorn --threads."""
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(threads) if threads else contextlib.nullcontext()
+    latencies, statuses = [], []
+    results_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.monotonic()  # includes waiting for a free server thread, as the client sees it
+            try:
+                with slots:
+                    status = call(env, module, i, uids[i % len(uids)])
+            except Exception as e:
+                status = f"exception: {type(e).__name__}"
+            elapsed = time.monotonic() - start
+            with results_lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return latencies, statuses
+
+
+async def _drive_asgi(call, env, module, uids, concurrency, requests):
+    """`concurrency` client tasks against an ASGI app on this thread's event loop."""
+    counter = iter(range(requests))
+    latencies, statuses = [], []
+
+    async def worker():
+        for i in counter:  # one shared iterator; tasks only switch at awaits
+            start = time.monotonic()
+            try:
+                status = await call(env, module, i, uids[i % len(uids)])
+            except Exception as e:
+                status = f"exception: {type(e).__name__}"
+            latencies.append(time.monotonic() - start)
+            statuses.append(status)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+def run_scenario(name, concurrency=16, requests=200, users=50, scale=1.0, error_rate=0.0, verbose=False,
+                 threads=None):
+    """
+    Runs one scenario closed-loop: `concurrency` clients issue `requests` calls across `users` users.
+    `threads` caps concurrent requests inside a threaded (Flask) app; ASGI scenarios ignore it.
+    """
+    random.seed(1234)
+    service, seed, call = SCENARIOS[name]
+    service, _, entry = service.partition(":")
+    is_asgi = entry == "asgi"
+    with Environment(scale=scale, error_rate=error_rate) as env:
+        module = env.service(service, entry or "main")
+        uids = [f"loadtest-user-{n}" for n in range(users)]
+        for uid in uids:
+            seed(env, uid)
+        env.start_latency()
+
+        started = time.monotonic()
+        with contextlib.redirect_stdout(sys.stdout if verbose else _DEVNULL):
+            if is_asgi:
+                latencies, statuses = asyncio.run(_drive_asgi(call, env, module, uids, concurrency, requests))
+            else:
+                latencies, statuses = _drive_threads(call, env, module, uids, concurrency, requests, threads)
+        wall = time.monotonic() - started
+
+        latencies.sort()
+        shed = statuses.count(SHED)
+        errors = sum(1 for s in statuses if s != SHED and (not isinstance(s, int) or s >= 500))
+        return {
+            "scenario": name,
+            "config": {"concurrency": concurrency, "requests": requests, "users": users, "scale": scale,
+                       "error_rate": error_rate, "threads": None if is_asgi else threads},
+            "throughput_rps": round(requests / wall, 2),
+            "goodput_rps": round((requests - errors - shed) / wall, 2),
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+            "errors": errors,
+            "shed": shed,
+            "firestore_ops_per_request": {k: round(v / requests, 2) for k, v in sorted(env.firestore.ops.items())},
+            "rtdb_ops_per_request": {k: round(v / requests, 2) for k, v in sorted(env.rtdb.ops.items())},
+            "model_calls_per_request": round(env.model.calls["generate"] / requests, 2),
+            "embedding_calls_per_request": round(env.embeddings.calls["embed"] / requests, 2),
+        }
+
+
+def format_result(r):
+    reads = r["firestore_ops_per_request"].get("read", 0) + r["rtdb_ops_per_request"].get("read", 0)
+    writes = r["firestore_ops_per_request"].get("write", 0) + r["rtdb_ops_per_request"].get("write", 0)
+    return (f"{r['scenario']:<26} {r['throughput_rps']:7.1f} req/s ({r['goodput_rps']:.1f} served)  "
+            f"p50={r['p50_ms']:7.1f}ms p95={r['p95_ms']:7.1f}ms p99={r['p99_ms']:7.1f}ms "
+            f"errors={r['errors']} shed={r['shed']}  "
+            f"reads/req={reads:.1f} writes/req={writes:.1f} model/req={r['model_calls_per_request']:.2f}")
+
+
+# ------------------ Baselines ------------------
+def load_baselines(path=BASELINES_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def baseline_key(scenario, label=None):
+    """Baselines are stored per scenario, or per scenario and label for runs with a non-default config."""
+    return f"{scenario}@{label}" if label else scenario
+
+
+def save_baselines(results, path=BASELINES_FILE, label=None):
+    baselines = load_baselines(path)
+    for r in results:
+        baselines[baseline_key(r["scenario"], label)] = r
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Saved {len(results)} baseline(s) to {path}")
+
+
+def compare(result, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Returns a list of regression messages (empty when within tolerance)."""
+    if baseline["config"] != result["config"]:
+        return [f"{result['scenario']}: baseline was recorded with {baseline['config']}, not comparable"]
+    problems = []
+    if result["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+        problems.append(f"{result['scenario']}: p95 {baseline['p95_ms']}ms -> {result['p95_ms']}ms")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        problems.append(f"{result['scenario']}: throughput {baseline['throughput_rps']} -> "
+                        f"{result['throughput_rps']} req/s")
+    if "goodput_rps" in baseline and result["goodput_rps"] < baseline["goodput_rps"] * (1 - tolerance):
+        problems.append(f"{result['scenario']}: goodput {baseline['goodput_rps']} -> "
+                        f"{result['goodput_rps']} req/s")
+    if result["errors"] > baseline["errors"]:
+        problems.append(f"{result['scenario']}: errors {baseline['errors']} -> {result['errors']}")
+    if result["shed"] > baseline.get("shed", 0):
+        problems.append(f"{result['scenario']}: shed {baseline.get('shed', 0)} -> {result['shed']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load tests against in-memory Firebase and stub models.")
+    parser.add_argument("scenarios", nargs="*", help="scenario names (default: all)")
+    parser.add_argument("--list", action="store_true", help="list scenarios and exit")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="server threads per instance for non-ASGI scenarios (default: one per client)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every simulated latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="injected model/embedding 503 rate")
+    parser.add_argument("--save-baseline", action="store_true", help="store results in baselines.json")
+    parser.add_argument("--label", default=None,
+                        help="store/compare baselines as '<scenario>@<label>' (for non-default configs)")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--verbose", action="store_true", help="keep the backends' own log output")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, (service, _, _) in SCENARIOS.items():
+            print(f"{name:<26} {service}")
+        return 0
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        result = run_scenario(name, args.concurrency, args.requests, args.users, args.scale,
+                              args.error_rate, args.verbose, args.threads)
+        print(format_result(result))
+        results.append(result)
+
+    if args.save_baseline:
+        save_baselines(results, label=args.label)
+        return 0
+    baselines = load_baselines()
+    problems = []
+    for r in results:
+        key = baseline_key(r["scenario"], args.label)
+        if key in baselines:
+            problems.extend(compare(r, baselines[key], args.tolerance))
+    for p in problems:
+        print(f"REGRESSION {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
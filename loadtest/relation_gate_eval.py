@@ -0,0 +1,99 @@
+# relation_gate_eval.py
+"""
+Skip rate and recall of the relation-extraction gate (RelationAI/relation_gate.py)
+on a labelled corpus: fixtures/relation_messages.jsonl, one
+{"text", "people"} object per line, where people lists whoever the message
+mentions (empty for none).
+
+    python relation_gate_eval.py
+    python relation_gate_eval.py --corpus my_messages.jsonl --min-recall 0.95
+
+skip rate    share of messages for which the extraction call is skipped
+recall       share of person-mentioning messages that still reach extraction
+false fires  share of no-person messages that reach extraction anyway
+
+The messages are replayed as one user's chat, with tracked names from a
+sample profile and relation graph; as in production, names in a message that
+passes the gate are remembered for later messages. Exits 1 when recall drops
+below --min-recall.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RelationAI"))
+from relation_gate import GateCache, names_from_profile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, "fixtures", "relation_messages.jsonl")
+
+SAMPLE_PROFILE = {
+    "important_people": "My mom, my best friend Jake and my sister Priya",
+    "trusted_person": "yes, sam",
+}
+SAMPLE_GRAPH_NAMES = ["Olivia", "Marcus"]
+
+
+def evaluate(rows, learn=True):
+    cache = GateCache()
+    gate = cache.put("eval", SAMPLE_GRAPH_NAMES + names_from_profile(SAMPLE_PROFILE))
+    reasons = Counter()
+    misses, false_fires = [], []
+    with_people = passed_people = 0
+    started = time.perf_counter()
+    for row in rows:
+        hit = gate.match(row["text"])
+        cache.check(gate, row["text"])
+        reasons[hit[0] if hit else "skipped"] += 1
+        if row["people"]:
+            with_people += 1
+            if hit:
+                passed_people += 1
+                if learn:
+                    cache.remember("eval", row["people"])
+            else:
+                misses.append(row["text"])
+        elif hit:
+            false_fires.append(f"{row['text']}  [{hit[0]}: {hit[1]}]")
+    elapsed = time.perf_counter() - started
+    without_people = len(rows) - with_people
+    return {
+        "messages": len(rows),
+        "skip_rate": round(reasons["skipped"] / len(rows), 3) if rows else None,
+        "recall": round(passed_people / with_people, 3) if with_people else None,
+        "false_fire_rate": round(len(false_fires) / without_people, 3) if without_people else None,
+        "reasons": dict(reasons),
+        "us_per_message": round(elapsed / max(len(rows), 1) * 1e6, 1),
+        "misses": misses,
+        "false_fires": false_fires,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Skip rate and recall of the relation-extraction gate.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--no-learn", action="store_true", help="don't remember names from earlier messages")
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    result = evaluate(rows, learn=not args.no_learn)
+    print(f"messages      {result['messages']}")
+    print(f"skip rate     {result['skip_rate']}")
+    print(f"recall        {result['recall']}")
+    print(f"false fires   {result['false_fire_rate']}")
+    print(f"reasons       {result['reasons']}")
+    print(f"us/message    {result['us_per_message']}")
+    for text in result["misses"]:
+        print(f"MISS          {text}")
+    for text in result["false_fires"]:
+        print(f"FALSE FIRE    {text}")
+    return 1 if result["recall"] is not None and result["recall"] < args.min_recall else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
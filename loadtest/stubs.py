@@ -0,0 +1,161 @@
+# stubs.py
+"""
+Stub Gemini, embedding and Imagen clients with latency distributions and
+optional error injection. Schema-constrained calls (schema_config) get a
+minimal reply that validates against the schema, so parse_structured()
+succeeds and the code after it runs as it would in production. The async
+variants (generate_content_async, client.aio) await the same latency.
+"""
+import io
+import asyncio
+import json
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from collections import Counter
+from fakes import Latency
+
+
+class StubServerError(Exception):
+    code = 503
+
+
+def _sample_for(schema):
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "OBJECT":
+        return {name: _sample_for(prop) for name, prop in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [_sample_for(schema["items"])]
+    if kind == "INTEGER":
+        return 50
+    if kind == "NUMBER":
+        return 5.0
+    if kind == "BOOLEAN":
+        return False
+    return "Sam"
+
+
+def _schema_of(config):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config.get("response_schema")
+    return getattr(config, "response_schema", None)
+
+
+def stub_response(text):
+    """Answers to .text (google-generativeai, Vertex) and .candidates[0].content.parts[0].text (google-genai)."""
+    part = SimpleNamespace(text=text)
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason="STOP")
+    return SimpleNamespace(text=text, candidates=[candidate], prompt_feedback=None)
+
+
+class _StubBase:
+    def __init__(self, latency=None, error_rate=0.0):
+        self.latency = latency or Latency(0)
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _round_trip(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+        self.latency.sleep()
+        self._maybe_fail(kind)
+
+    async def _round_trip_async(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+        delay = self.latency.sample()
+        if delay:
+            await asyncio.sleep(delay)
+        self._maybe_fail(kind)
+
+    def _maybe_fail(self, kind):
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.calls[f"{kind}_errors"] += 1
+            raise StubServerError("injected 503")
+
+
+class StubModel(_StubBase):
+    """
+    Stands in for google.generativeai.GenerativeModel and Vertex
+    GenerativeModel; the harness hands the same instance to every
+    GenerativeModel(name) constructor call.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, reply="That sounds hard. What felt heaviest about it?"):
+        super().__init__(latency, error_rate)
+        self.reply = reply
+
+    def generate_content(self, contents, generation_config=None, config=None, **kwargs):
+        self._round_trip("generate")
+        return self._reply(generation_config, config)
+
+    async def generate_content_async(self, contents, generation_config=None, config=None, **kwargs):
+        await self._round_trip_async("generate")
+        return self._reply(generation_config, config)
+
+    def _reply(self, generation_config, config):
+        schema = _schema_of(generation_config) or _schema_of(config)
+        return stub_response(json.dumps(_sample_for(schema)) if schema else self.reply)
+
+    def start_chat(self, history=None):
+        return SimpleNamespace(history=history or [], send_message=lambda msg, **kw: self.generate_content(msg, **kw))
+
+
+class StubGenAIClient:
+    """google.genai.Client with client.models / client.aio.models .generate_content(model=, contents=, config=)."""
+
+    def __init__(self, model):
+        self.models = SimpleNamespace(
+            generate_content=lambda model=None, contents=None, config=None: self._model.generate_content(
+                contents, config=config))
+        self.aio = SimpleNamespace(models=SimpleNamespace(
+            generate_content=lambda model=None, contents=None, config=None: self._model.generate_content_async(
+                contents, config=config)))
+        self._model = model
+
+
+class StubEmbeddingModel(_StubBase):
+    """TextEmbeddingModel: deterministic unit vectors, so identical text embeds identically."""
+
+    def __init__(self, latency=None, error_rate=0.0, dimensions=768):
+        super().__init__(latency, error_rate)
+        self.dimensions = dimensions
+
+    def get_embeddings(self, texts):
+        self._round_trip("embed")
+        out = []
+        for text in texts:
+            rng = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+            values = [rng.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+            norm = sum(v * v for v in values) ** 0.5
+            out.append(SimpleNamespace(values=[v / norm for v in values]))
+        return out
+
+
+class StubImageModel(_StubBase):
+    """ImageGenerationModel returning a fixed image, or nothing at `blocked_rate` (safety filter)."""
+
+    def __init__(self, latency=None, error_rate=0.0, blocked_rate=0.0, image_bytes=None):
+        super().__init__(latency, error_rate)
+        self.blocked_rate = blocked_rate
+        self.image_bytes = image_bytes or self._placeholder_png()
+
+    @staticmethod
+    def _placeholder_png():
+        from PIL import Image  # clario_backend already depends on Pillow for renditions
+        buf = io.BytesIO()
+        Image.new("RGB", (1024, 1024), (120, 144, 200)).save(buf, format="PNG")
+        return buf.getvalue()
+
+    def generate_images(self, prompt=None, number_of_images=1, **kwargs):
+        self._round_trip("image")
+        if self.blocked_rate and random.random() < self.blocked_rate:
+            return SimpleNamespace(images=[])
+        return SimpleNamespace(images=[SimpleNamespace(_image_bytes=self.image_bytes)] * number_of_images)
@@ -0,0 +1,124 @@
+# test_account_deletion.py
+"""clario_backend/account_deletion.py against the in-memory fakes, and the deleteAccount flow around it."""
+import os
+import sys
+import pytest
+from flask import request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clario_backend"))
+import account_deletion
+from account_deletion import delete_account
+from fakes import FakeFirestore, FakeRTDB
+from harness import Environment, FUNCTION_APP
+
+
+def _user_paths(db, uid):
+    return [path for path in db._docs if path.startswith(f"users/{uid}")]
+
+
+def _seed(main_db, empty_chair_db, rtdb, uid):
+    user = main_db.collection("users").document(uid)
+    user.set({"name": "Sam"})
+    user.collection("chats").document("c1").set({"text": "hi"})
+    user.collection("relationships").document("priya").set({"name": "priya"})
+    session = empty_chair_db.collection("users").document(uid).collection("sessions").document("s1")
+    session.set({"personInChair": "my father"})
+    session.collection("messages").document("m1").set({"text": "hello"})
+    rtdb.reference(f"users/{uid}/journals").push({"text": "entry"})
+
+
+def test_deletes_the_user_tree_in_every_project():
+    main_db, empty_chair_db, rtdb = FakeFirestore(), FakeFirestore(), FakeRTDB()
+    _seed(main_db, empty_chair_db, rtdb, "u1")
+    main_db.collection("users").document("u2").set({"name": "Other"})
+
+    stats = delete_account(main_db, "u1", rtdb_reference=rtdb.reference, other_dbs={"empty-chair": empty_chair_db})
+
+    assert _user_paths(main_db, "u1") == []
+    assert _user_paths(empty_chair_db, "u1") == []
+    assert rtdb.reference("users/u1").get() is None
+    assert main_db.collection("users").document("u2").get().exists
+    assert stats["status"] == "done"
+    assert set(stats["phases_done"]) == {"firestore", "firestore:empty-chair", "rtdb"}
+    assert stats["docs_deleted"] == 6  # three per project, users/{uid} included
+
+
+def test_rerun_after_done_deletes_data_written_back():
+    main_db, empty_chair_db, rtdb = FakeFirestore(), FakeFirestore(), FakeRTDB()
+    _seed(main_db, empty_chair_db, rtdb, "u1")
+    delete_account(main_db, "u1", rtdb_reference=rtdb.reference, other_dbs={"empty-chair": empty_chair_db})
+
+    # a client with a still-valid token writes after the first pass
+    _seed(main_db, empty_chair_db, rtdb, "u1")
+    stats = delete_account(main_db, "u1", rtdb_reference=rtdb.reference, other_dbs={"empty-chair": empty_chair_db})
+
+    assert _user_paths(main_db, "u1") == []
+    assert _user_paths(empty_chair_db, "u1") == []
+    assert rtdb.reference("users/u1").get() is None
+    assert stats["status"] == "done" and stats["resumes"] == 1
+
+
+# ---- deleteAccount / resumeAccountDeletions (clario_backend/main.py, SDKs faked by harness.Environment) ----
+UID = "deleting-user"
+
+
+def fail_once(method):
+    """Wraps a method so its first call raises, as a timeout or outage mid-deletion would."""
+    calls = []
+
+    def wrapper(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("rtdb unavailable")
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+@pytest.fixture
+def clario(monkeypatch):
+    with Environment(scale=0) as env:
+        clario = env.service("clario_backend")
+        deleted_users = []
+        monkeypatch.setattr(clario.auth, "delete_user", deleted_users.append)
+        monkeypatch.setattr(account_deletion.AccountDeletion, "_delete_rtdb",
+                            fail_once(account_deletion.AccountDeletion._delete_rtdb))
+        _seed(env.firestore, env.firestore, env.rtdb, UID)
+        yield clario, env, deleted_users
+
+
+def _call(fn, method="POST", body=None, query=""):
+    with FUNCTION_APP.test_request_context(f"/{query}", method=method, json=body,
+                                           headers={"Authorization": f"Bearer {UID}"}):
+        resp, status = fn(request)[:2]
+    return (resp if isinstance(resp, str) else resp.get_json()), status
+
+
+def _job(env):
+    return env.firestore.collection("deletionJobs").document(UID).get().to_dict()
+
+
+def test_failed_deletion_keeps_the_user_and_blocks_its_writes_until_a_retry(clario):
+    clario, env, deleted_users = clario
+    body, status = _call(clario.deleteAccount, body={"confirm": True})
+    assert status == 500
+    assert _job(env)["status"] == "failed"
+    assert deleted_users == []  # still able to sign in and retry
+    assert _call(clario.getNotifications, method="GET")[1] == 401  # but not to write data back
+
+    body, status = _call(clario.deleteAccount, body={"confirm": True})
+    assert status == 200 and body["status"] == "deleted"
+    assert deleted_users == [UID]
+    assert _user_paths(env.firestore, UID) == []
+    assert env.rtdb.reference(f"users/{UID}").get() is None
+
+
+def test_scheduler_finishes_a_failed_deletion(clario):
+    clario, env, deleted_users = clario
+    assert _call(clario.deleteAccount, body={"confirm": True})[1] == 500
+
+    assert _call(clario.resumeAccountDeletions, method="GET", query="?secret=wrong")[1] == 401
+    body, status = _call(clario.resumeAccountDeletions, method="GET", query=f"?secret={clario.CRON_SECRET}")
+    assert status == 200 and body == {"deleted": 1, "failed": 0}
+    assert _job(env)["status"] == "done"
+    assert deleted_users == [UID]
+    assert _user_paths(env.firestore, UID) == []
@@ -0,0 +1,91 @@
+# test_avatar.py
+"""clario_backend avatar storage order and getAvatar caching, with the SDKs faked by harness.Environment."""
+import io
+import pytest
+from flask import request
+from PIL import Image
+
+from harness import Environment, FUNCTION_APP
+
+AVATAR_ID = "a" * 64
+
+
+class RecordingStore:
+    def __init__(self):
+        self.blobs = {}
+        self.writes = []
+        self.reads = []
+
+    def get(self, key):
+        self.reads.append(key)
+        return self.blobs.get(key)
+
+    def exists(self, key):
+        return key in self.blobs
+
+    def put(self, key, data):
+        self.writes.append(key)
+        self.blobs[key] = data
+
+
+@pytest.fixture(scope="module")
+def clario():
+    with Environment(scale=0) as env:
+        yield env.service("clario_backend")
+
+
+@pytest.fixture
+def store(clario, monkeypatch):
+    store = RecordingStore()
+    monkeypatch.setattr(clario, "avatar_store", store)
+    return store
+
+
+def _png():
+    out = io.BytesIO()
+    Image.new("RGB", (512, 512), (200, 120, 40)).save(out, "PNG")
+    return out.getvalue()
+
+
+def _generate(clario, body):
+    with FUNCTION_APP.test_request_context("/", method="POST", json=body, headers={"Authorization": "Bearer avatar-user"}):
+        return clario.generateAvatar(request)
+
+
+def _get(clario, query):
+    with FUNCTION_APP.test_request_context(f"/?{query}", method="GET"):
+        return clario.getAvatar(request)
+
+
+def test_original_is_written_last(clario, store):
+    clario.store_avatar(AVATAR_ID, _png())
+    assert len(store.writes) > 1
+    assert store.writes[-1] == AVATAR_ID
+
+
+def test_rendition_is_immutable(clario, store):
+    clario.store_avatar(AVATAR_ID, _png())
+    size, fmt = clario.parse_rendition_args("64", None)
+    _, status, headers = _get(clario, f"id={AVATAR_ID}&size=64")
+    assert status == 200
+    assert headers["ETag"] == f'"{clario.rendition_key(AVATAR_ID, size, fmt)}"'
+    assert "immutable" in headers["Cache-Control"]
+
+
+def test_fallback_to_original_is_cached_briefly_under_its_own_etag(clario, store):
+    store.put(AVATAR_ID, _png())  # stored before renditions existed
+    _, status, headers = _get(clario, f"id={AVATAR_ID}&size=64")
+    assert status == 200
+    assert headers["ETag"] == f'"{AVATAR_ID}"'
+    assert headers["Cache-Control"] == f"public, max-age={clario.AVATAR_FALLBACK_MAX_AGE}"
+
+
+def test_cached_avatar_is_not_downloaded_to_check_it_exists(clario, store):
+    prompt = "a calm fox"
+    avatar_id = clario.avatar_key(clario.sanitize_prompt(prompt))
+    clario.store_avatar(avatar_id, _png())
+    resp, status, _ = _generate(clario, {"prompt": prompt})
+    assert status == 200 and resp.get_json()["cached"] is True
+    assert store.reads == []
+    resp, status, _ = _generate(clario, {"prompt": prompt, "inline": True, "size": 64})
+    assert status == 200 and resp.get_json()["image_base64"]  # inline still reads the rendition it returns
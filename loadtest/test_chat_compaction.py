@@ -0,0 +1,50 @@
+# test_chat_compaction.py
+"""clario_backend compactChatHistory paging, with the SDKs faked by harness.Environment."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from flask import request
+
+from harness import Environment, FUNCTION_APP
+
+
+@pytest.fixture
+def env():
+    with Environment(scale=0) as env:
+        yield env
+
+
+def _call(clario, query):
+    with FUNCTION_APP.test_request_context(f"/?secret={clario.CRON_SECRET}&{query}", method="GET"):
+        resp, status = clario.compactChatHistory(request)[:2]
+    return status, resp.get_json()
+
+
+def _seed(db, users, chats=4):
+    old = datetime.now(timezone.utc) - timedelta(days=60)
+    for n in range(users):
+        user = db.collection("users").document(f"user-{n:02d}")
+        user.set({"name": f"User {n}"})
+        for c in range(chats):
+            user.collection("chats").document(f"c{c}").set({"role": "user", "text": "hi",
+                                                            "ts": old + timedelta(minutes=c)})
+
+
+def test_each_call_compacts_one_page_and_the_pass_wraps_around(env, monkeypatch):
+    clario = env.service("clario_backend")
+    monkeypatch.setattr(clario, "COMPACTION_USERS_PER_RUN", 2)
+    _seed(env.firestore, users=5)
+
+    seen = []
+    for _ in range(3):
+        status, totals = _call(clario, "days=30")
+        assert status == 200 and totals["failed"] == 0
+        seen.append((totals["users"], totals["next_after"]))
+    assert seen == [(2, "user-01"), (2, "user-03"), (1, None)]
+    assert _call(clario, "days=30")[1]["next_after"] == "user-01"  # next pass starts over
+
+
+def test_days_must_be_positive(env):
+    clario = env.service("clario_backend")
+    assert _call(clario, "days=0")[0] == 400
+    assert _call(clario, "days=-3")[0] == 400
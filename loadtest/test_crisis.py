@@ -0,0 +1,33 @@
+# test_crisis.py
+"""The crisis-phrase scanner against its labelled corpus (clario_backend/ and RelationAI/ ship identical copies)."""
+import os
+import sys
+import json
+import filecmp
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "clario_backend"))
+from crisis import scan_message
+
+
+def _corpus():
+    with open(os.path.join(ROOT, "clario_backend", "crisis_corpus.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_every_crisis_in_the_corpus_is_caught():
+    missed = [s["text"] for s in _corpus() if s["crisis"] and scan_message(s["text"]) is None]
+    assert missed == []
+
+
+def test_negation_only_cancels_the_phrase_it_modifies():
+    assert scan_message("I'm not going to kill myself") is None
+    assert scan_message("I don't want to die") is None
+    assert scan_message("I'm not okay i want to die") == "want to die"
+    assert scan_message("no point, i want to die") == "want to die"
+
+
+def test_copies_are_identical():
+    for name in ("crisis.py", "crisis_corpus.jsonl"):
+        assert filecmp.cmp(os.path.join(ROOT, "clario_backend", name), os.path.join(ROOT, "RelationAI", name),
+                           shallow=False), name
@@ -0,0 +1,21 @@
+# test_harness.py
+"""harness.py's own accounting: fallback chat replies are counted as shed, not served."""
+import pytest
+
+from harness import compare, run_scenario
+
+
+@pytest.mark.parametrize("scenario", ["clario_chat", "clario_chat_asgi", "relation_chat", "relation_chat_asgi"])
+def test_fallback_replies_are_shed_not_served(scenario):
+    result = run_scenario(scenario, concurrency=4, requests=8, users=2, scale=0, error_rate=1.0)
+    assert result["shed"] == 8 and result["errors"] == 0
+    assert result["goodput_rps"] == 0
+    assert result["throughput_rps"] > 0
+
+
+def test_more_shedding_than_the_baseline_is_a_regression():
+    baseline = {"scenario": "clario_chat_asgi", "config": {}, "p95_ms": 100.0, "throughput_rps": 10.0,
+                "goodput_rps": 10.0, "errors": 0, "shed": 0}
+    result = dict(baseline, goodput_rps=1.0, shed=9)
+    assert compare(result, baseline) == ["clario_chat_asgi: goodput 10.0 -> 1.0 req/s",
+                                         "clario_chat_asgi: shed 0 -> 9"]
@@ -0,0 +1,129 @@
+# test_history_log.py
+"""history_log.py (the `ai` chat driver's local history): crash recovery and the legacy import."""
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import history_log
+from history_log import HistoryLog, migrate_legacy_history
+
+TURNS = [{"role": "user" if n % 2 == 0 else "model", "text": f"turn {n} é"} for n in range(5)]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "chat_history.jsonl"), str(tmp_path / "chat_history.idx")
+
+
+def _write(paths, turns=TURNS):
+    log = HistoryLog(*paths)
+    for turn in turns:
+        log.append(turn)
+    log.close()
+
+
+def _reopen(paths):
+    log = HistoryLog(*paths)
+    turns = log.tail(len(log))
+    log.close()
+    return turns
+
+
+def _line_offsets(path):
+    offsets, pos = [], 0
+    with open(path, "rb") as f:
+        for line in f:
+            offsets.append(pos)
+            pos += len(line)
+    return offsets
+
+
+def test_tail_after_reopen(paths):
+    _write(paths)
+    log = HistoryLog(*paths)
+    assert len(log) == 5
+    assert log.tail(2) == TURNS[-2:]
+    assert log.tail(50) == TURNS
+    assert log.tail(0) == []
+    log.append({"role": "user", "text": "after reopen"})
+    assert log.tail(2) == [TURNS[-1], {"role": "user", "text": "after reopen"}]
+    log.close()
+
+
+def test_torn_final_line_is_cut_off(paths):
+    _write(paths)
+    size = os.path.getsize(paths[0])
+    with open(paths[0], "ab") as f:
+        f.write(b'{"role": "user", "te')  # crash mid-append, before the index entry
+    assert _reopen(paths) == TURNS
+    assert os.path.getsize(paths[0]) == size
+    _write(paths, [{"role": "user", "text": "next"}])
+    assert _reopen(paths) == TURNS + [{"role": "user", "text": "next"}]
+
+
+def test_index_entries_past_the_data_are_dropped(paths):
+    _write(paths)
+    with open(paths[0], "rb+") as f:
+        f.truncate(_line_offsets(paths[0])[3])  # the last two lines never reached the disk
+    assert _reopen(paths) == TURNS[:3]
+    assert os.path.getsize(paths[1]) == 3 * 8
+
+
+def test_index_entry_for_a_torn_line_is_dropped(paths):
+    _write(paths)
+    with open(paths[0], "rb+") as f:
+        f.truncate(_line_offsets(paths[0])[4] + 5)  # the last line lost its tail
+    assert _reopen(paths) == TURNS[:4]
+
+
+def test_missing_index_is_rebuilt(paths):
+    _write(paths)
+    os.remove(paths[1])
+    assert _reopen(paths) == TURNS
+    assert os.path.getsize(paths[1]) == 5 * 8
+
+
+def test_index_behind_the_data_is_completed(paths):
+    _write(paths)
+    with open(paths[1], "rb+") as f:
+        f.truncate(2 * 8)  # crash between the data and index writes, twice over
+    assert _reopen(paths) == TURNS
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    path = str(tmp_path / "chat_history.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(TURNS, f)
+    return path
+
+
+def test_legacy_history_is_imported_once(paths, legacy):
+    migrate_legacy_history(legacy, *paths)
+    assert _reopen(paths) == TURNS
+    assert not os.path.exists(legacy) and os.path.exists(legacy + ".migrated")
+
+    with open(legacy, "w", encoding="utf-8") as f:  # a stray legacy file never lands in a non-empty log
+        json.dump(TURNS, f)
+    migrate_legacy_history(legacy, *paths)
+    assert _reopen(paths) == TURNS
+
+
+def test_crash_before_the_rename_leaves_nothing_half_imported(paths, legacy, monkeypatch):
+    real_replace = os.replace
+
+    def crash(src, dst):
+        raise KeyboardInterrupt("power cut")
+
+    monkeypatch.setattr(history_log.os, "replace", crash)
+    with pytest.raises(KeyboardInterrupt):
+        migrate_legacy_history(legacy, *paths)
+    monkeypatch.setattr(history_log.os, "replace", real_replace)
+
+    assert os.path.exists(legacy)
+    assert _reopen(paths) == []  # the log never saw the partial import
+    migrate_legacy_history(legacy, *paths)  # so the next start imports everything
+    assert _reopen(paths) == TURNS
+    assert not os.path.exists(paths[0] + ".tmp")
@@ -0,0 +1,28 @@
+# test_journal.py
+"""JournalAI /analyze-journal writes, with the SDKs faked by harness.Environment."""
+import pytest
+
+from harness import Environment
+
+UID = "journal-user"
+
+
+@pytest.fixture
+def env():
+    with Environment(scale=0) as env:
+        yield env
+
+
+def test_entry_and_profile_fields_are_one_rtdb_round_trip(env):
+    journal = env.service("JournalAI")
+    resp = journal.app.test_client().post("/analyze-journal", json={"journal_text": "Slept well, long walk.",
+                                                                     "uid": UID})
+    assert resp.status_code == 200
+    assert dict(env.rtdb.ops) == {"write": 1}
+
+    user = env.rtdb.reference(f"users/{UID}").get()
+    (key, entry), = user["journals"].items()
+    assert resp.get_json()["saved_path"] == f"/users/{UID}/journals/{key}"
+    assert user["latestMood"] == entry["moodTag"]
+    assert user["latestMoodScore"] == entry["moodScore"]
+    assert user["lastJournalAt"] == entry["timestamp"]
@@ -0,0 +1,163 @@
+# test_llm_gateway.py
+"""
+Behaviour tests for the shared llm_gateway.py (identical copies live next to
+each backend's main.py; these import clario_backend's).
+
+    python -m pytest -q loadtest
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clario_backend"))
+from llm_gateway import AdaptiveLimiter, AsyncLLMGateway, GatewayTimeout, LLMGateway, canonical_key
+
+
+def _slow_reply(seconds, reply="ok"):
+    async def call():
+        await asyncio.sleep(seconds)
+        return reply
+    return call
+
+
+def test_async_attempt_releases_slot_when_deadline_passes_before_call_starts():
+    # The second caller gets the only slot just as its deadline runs out, so its
+    # attempt is cancelled before the model call starts; the slot must come back.
+    limiter = AdaptiveLimiter("test-deadline", initial_limit=1, max_queue=4)
+    gateway = AsyncLLMGateway("test-deadline", max_retries=0, limiter=limiter)
+
+    async def one():
+        try:
+            return await gateway.call(_slow_reply(0.28), deadline=0.3)
+        except GatewayTimeout:
+            return "GatewayTimeout"
+
+    async def run():
+        return await asyncio.gather(one(), one())
+
+    assert sorted(asyncio.run(run())) == ["GatewayTimeout", "ok"]
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.try_acquire()  # the slot is usable again
+
+
+def test_async_slots_return_after_success_and_failure():
+    limiter = AdaptiveLimiter("test-release", initial_limit=2)
+    gateway = AsyncLLMGateway("test-release", max_retries=0, limiter=limiter)
+
+    async def failing():
+        raise ValueError("bad request")
+
+    async def run():
+        assert await gateway.call(_slow_reply(0.01)) == "ok"
+        try:
+            await gateway.call(failing)
+        except ValueError:
+            pass
+
+    asyncio.run(run())
+    assert limiter.stats()["in_flight"] == 0
+
+
+class SlowModels:
+    """Stands in for genai.Client().models: every call takes `seconds`, then returns or raises `outcome`."""
+
+    def __init__(self, seconds, outcome):
+        self.seconds = seconds
+        self.outcome = outcome
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.seconds)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class SlowClient:
+    def __init__(self, seconds, outcome):
+        self.models = SlowModels(seconds, outcome)
+
+
+def _identical_calls(client, n=8):
+    """n threads issue the same request at once; config dicts differ only in key order."""
+    gateway = LLMGateway("test-coalesce", max_retries=0, coalesce=True)
+    barrier = threading.Barrier(n)
+    configs = [{"temperature": 0.2, "max_output_tokens": 64}, {"max_output_tokens": 64, "temperature": 0.2}]
+
+    def one(i):
+        barrier.wait()
+        try:
+            return gateway.generate_genai(client, "gemini-2.0-flash", "same prompt", config=configs[i % 2])
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(one, range(n)))
+
+
+def test_canonical_key_ignores_dict_order_only():
+    assert canonical_key("m", "p", {"a": 1, "b": 2}) == canonical_key("m", "p", {"b": 2, "a": 1})
+    assert canonical_key("m", "p", {"a": 1}) != canonical_key("m", "p", {"a": 2})
+    assert canonical_key("m", "p", None) != canonical_key("m", "q", None)
+
+
+def test_identical_concurrent_calls_share_one_model_call():
+    client = SlowClient(0.3, "reply")
+    assert _identical_calls(client) == ["reply"] * 8
+    assert client.models.calls == 1
+
+
+def test_identical_concurrent_calls_all_see_the_error():
+    error = ValueError("bad request")
+    client = SlowClient(0.3, error)
+    assert _identical_calls(client) == [error] * 8
+    assert client.models.calls == 1
+
+
+def _bad_request():
+    raise ValueError("400 invalid argument")
+
+
+def _unavailable():
+    raise ConnectionError("503 unavailable")
+
+
+def test_client_errors_do_not_open_the_circuit():
+    gateway = LLMGateway("test-client-errors", max_retries=0)
+    for _ in range(gateway.breaker.failure_threshold * 2):
+        try:
+            gateway.call(_bad_request)
+        except ValueError:
+            pass
+    assert gateway.breaker.state == "closed"
+    assert gateway.stats()["client_errors"] == gateway.breaker.failure_threshold * 2
+
+    for _ in range(gateway.breaker.failure_threshold):
+        try:
+            gateway.call(_unavailable)
+        except ConnectionError:
+            pass
+    assert gateway.breaker.state == "open"
+
+
+def test_async_client_errors_do_not_open_the_circuit():
+    gateway = AsyncLLMGateway("test-client-errors-async", max_retries=0)
+
+    async def bad_request():
+        raise ValueError("400 invalid argument")
+
+    async def run():
+        for _ in range(gateway.breaker.failure_threshold * 2):
+            try:
+                await gateway.call(bad_request)
+            except ValueError:
+                pass
+
+    asyncio.run(run())
+    assert gateway.breaker.state == "closed"
@@ -0,0 +1,41 @@
+# test_notifications.py
+"""clario_backend getNotifications: unread count and mark-read, with the SDKs faked by harness.Environment."""
+import pytest
+from flask import request
+
+from harness import Environment, FUNCTION_APP
+
+UID = "notify-user"
+
+
+@pytest.fixture
+def env():
+    with Environment(scale=0) as env:
+        yield env
+
+
+def _call(clario, method="GET", body=None):
+    with FUNCTION_APP.test_request_context("/", method=method, json=body,
+                                           headers={"Authorization": f"Bearer {UID}"}):
+        resp, status, _ = clario.getNotifications(request)
+    assert status == 200
+    return resp.get_json()
+
+
+def test_unread_count_follows_ttl_deletes_and_mark_read(env):
+    clario = env.service("clario_backend")
+    for app in ("Instagram", "YouTube", "TikTok"):
+        clario.create_screen_time_notification(UID, app, 45)
+    clario.create_screen_time_notification(UID, "Instagram", 60)  # coalesced into the first one
+    listing = _call(clario)
+    assert listing["unread_count"] == 3
+
+    notifications = env.firestore.collection("users").document(UID).collection("notifications")
+    expired = listing["notifications"][-1]["id"]
+    notifications.document(expired).delete()  # what the TTL policy does
+    assert _call(clario)["unread_count"] == 2
+
+    live = [n["id"] for n in listing["notifications"] if n["id"] != expired]
+    marked = _call(clario, "POST", {"mark_read": [live[0], live[0], expired, "no-such-id"]})
+    assert marked["marked_read"] == 1
+    assert _call(clario)["unread_count"] == 1
@@ -0,0 +1,34 @@
+# test_relation_gate.py
+"""RelationAI's relation gate (mentions_someone) and the graph backfill it reads, with the SDKs faked by harness.Environment."""
+import pytest
+
+from harness import Environment
+
+UID = "gate-user"
+
+
+@pytest.fixture
+def env():
+    with Environment(scale=0) as env:
+        yield env
+
+
+def test_people_tracked_before_the_graph_pass_the_gate(env):
+    relation = env.service("RelationAI")
+    user = env.firestore.collection("users").document(UID)
+    user.collection("relationships").document("priya").set({"name": "priya", "relation": "friend"})
+    assert not user.collection("relation_graph").document("current").get().exists
+
+    assert relation.mentions_someone(UID, {}, "had lunch with priya today")
+    assert user.collection("relation_graph").document("current").get().exists  # backfilled once
+    assert not relation.mentions_someone(UID, {}, "the weather is nice")
+
+
+def test_gate_errors_fail_open(env, monkeypatch):
+    relation = env.service("RelationAI")
+
+    def broken(db, user_id):
+        raise RuntimeError("firestore unavailable")
+
+    monkeypatch.setattr(relation, "tracked_names", broken)
+    assert relation.mentions_someone(UID, {}, "the weather is nice")
@@ -0,0 +1,66 @@
+# test_session_rag_cache.py
+"""emptyChair_backend's SessionRagCache: one candidate load per session, reuse while the topic holds, re-rank on drift."""
+import pytest
+
+from harness import Environment
+
+KEY = ("rag-user", "session-1", "my father")
+# three candidate sessions, one per axis; rendered entries are just their names
+VECTORS = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+NAMES = [["work"], ["holidays"], ["health"]]
+
+
+@pytest.fixture(scope="module")
+def empty_chair():
+    with Environment(scale=0) as env:
+        yield env.service("emptyChair_backend")
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return VECTORS, NAMES
+
+
+def _render(entries):
+    return ",".join(line for lines in entries for line in lines)
+
+
+def test_loads_once_reuses_close_messages_and_reranks_on_drift(empty_chair):
+    cache = empty_chair.SessionRagCache()
+    load = Loader()
+
+    assert cache.memory_block(KEY, [1.0, 0.2, 0.0], load, _render) == "work,holidays"
+    assert cache.stats() == {"loads": 1, "reranks": 1, "reused": 0, "sessions": 1}
+
+    # cosine ~0.98 with the last query: same block, no ranking
+    assert cache.memory_block(KEY, [1.0, 0.0, 0.0], load, _render) == "work,holidays"
+    assert cache.stats()["reused"] == 1
+
+    # the conversation moved on: re-ranked from the cached matrix, not re-loaded
+    assert cache.memory_block(KEY, [0.0, 0.1, 1.0], load, _render) == "health,holidays"
+    assert cache.stats() == {"loads": 1, "reranks": 2, "reused": 1, "sessions": 1}
+    assert load.calls == 1
+
+
+def test_reuse_threshold_is_rag_reuse_similarity(empty_chair):
+    cache = empty_chair.SessionRagCache()
+    load = Loader()
+    threshold = empty_chair.RAG_REUSE_SIMILARITY
+    cache.memory_block(KEY, [1.0, 0.0, 0.0], load, _render)
+    below = (1 - (threshold - 0.05) ** 2) ** 0.5  # unit vector at cosine threshold - 0.05
+    cache.memory_block(KEY, [threshold - 0.05, below, 0.0], load, _render)
+    assert cache.stats()["reranks"] == 2
+
+
+def test_each_session_loads_its_own_candidates(empty_chair):
+    cache = empty_chair.SessionRagCache()
+    load = Loader()
+    cache.memory_block(KEY, [1.0, 0.0, 0.0], load, _render)
+    cache.memory_block(("rag-user", "session-2", "my father"), [1.0, 0.0, 0.0], load, _render)
+    cache.memory_block(KEY, [0.0, 1.0, 0.0], load, _render)
+    assert load.calls == 2
+    assert cache.stats()["sessions"] == 2
@@ -0,0 +1,37 @@
+# test_structured_output.py
+"""The shared structured_output.py (clario_backend's copy; RelationAI and JournalAI ship the same file)."""
+import os
+import sys
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clario_backend"))
+from structured_output import parse_structured, schema_config
+from harness import Environment
+from stubs import stub_response
+
+
+@dataclass
+class Score:
+    score: int
+
+
+def test_out_of_range_numbers_are_a_parse_failure_not_a_crash():
+    assert parse_structured("test", '{"score": 1e999}', Score) is None
+    assert parse_structured("test", '{"score": Infinity}', Score) is None
+    assert parse_structured("test", '{"score": "7"}', Score) == Score(7)
+
+
+def test_thinking_budget_is_only_sent_when_asked_for():
+    assert "thinking_config" not in schema_config(Score, 64)
+    assert schema_config(Score, 64, thinking_budget=0)["thinking_config"] == {"thinking_budget": 0}
+
+
+def test_malformed_replies_show_up_in_metrics(monkeypatch):
+    with Environment(scale=0) as env:
+        journal = env.service("JournalAI")
+        monkeypatch.setattr(env.model, "_reply", lambda *a: stub_response('{"mood_score": '))
+        before = journal.app.test_client().get("/metrics").get_json()["structured_output"]
+        assert journal.app.test_client().post("/analyze-journal", json={"journal_text": "long day"}).status_code == 200
+        after = journal.app.test_client().get("/metrics").get_json()["structured_output"]
+    failed = lambda stats: stats.get("journal_mood", {}).get("failed", 0)
+    assert failed(after) == failed(before) + 1
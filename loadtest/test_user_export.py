@@ -0,0 +1,64 @@
+# test_user_export.py
+"""clario_backend/user_export.py against the in-memory fakes."""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clario_backend"))
+from chat_archive import compact_history
+from user_export import iter_user_export
+from fakes import FakeFirestore, FakeRTDB
+
+
+def _seed(main_db, empty_chair_db, rtdb, uid):
+    user = main_db.collection("users").document(uid)
+    user.set({"name": "Sam"})
+    old = datetime.now(timezone.utc) - timedelta(days=90)
+    for n in range(5):
+        user.collection("chats").document(f"c{n}").set({"role": "user", "text": f"hi {n}",
+                                                         "ts": old + timedelta(minutes=n)})
+    compact_history(main_db, uid, older_than=old + timedelta(minutes=3), chunk_size=2)
+    user.collection("relationships").document("priya").set({"name": "priya"})
+    user.collection("relation_graph").document("current").set({"version": 3, "nodes": {}})
+    user.collection("notificationState").document("screen_time").set({"unread": 1})
+    sessions = empty_chair_db.collection("users").document(uid).collection("sessions")
+    for s in ("s1", "s2"):
+        sessions.document(s).set({"personInChair": "my father"})
+        for m in range(3):
+            sessions.document(s).collection("messages").document(f"m{m}").set({"text": f"{s} {m}"})
+    rtdb.reference(f"users/{uid}/journals").push({"text": "entry"})
+
+
+def _export(main_db, empty_chair_db, rtdb, uid, cursor=None, page_size=2):
+    return list(iter_user_export(main_db, uid, cursor=cursor, rtdb_reference=rtdb.reference,
+                                 other_dbs={"clario-4558": empty_chair_db}, page_size=page_size))
+
+
+def _paths(items):
+    return [payload["path"] for kind, payload in items if kind == "record"]
+
+
+def test_exports_every_collection_in_every_project():
+    main_db, empty_chair_db, rtdb = FakeFirestore(), FakeFirestore(), FakeRTDB()
+    _seed(main_db, empty_chair_db, rtdb, "u1")
+    items = _export(main_db, empty_chair_db, rtdb, "u1")
+    sources = {payload["source"] for kind, payload in items if kind == "record"}
+    assert sources == {"profile", "chats", "relationships", "relation_graph", "notificationState",
+                       "clario-4558/sessions", "clario-4558/sessions/messages", "journals"}
+    paths = _paths(items)
+    assert len(paths) == len(set(paths))
+    assert sorted(p for p in paths if "/chats/" in p) == [f"users/u1/chats/c{n}" for n in range(5)]
+    assert paths.index("users/u1/sessions/s1") < paths.index("users/u1/sessions/s1/messages/m0") \
+        < paths.index("users/u1/sessions/s2")
+
+
+def test_resuming_from_every_checkpoint_finishes_the_export():
+    main_db, empty_chair_db, rtdb = FakeFirestore(), FakeFirestore(), FakeRTDB()
+    _seed(main_db, empty_chair_db, rtdb, "u1")
+    items = _export(main_db, empty_chair_db, rtdb, "u1")
+    paths = _paths(items)
+    for n, (kind, cursor) in enumerate(items):
+        if kind != "checkpoint":
+            continue
+        done = _paths(items[:n])
+        assert _paths(_export(main_db, empty_chair_db, rtdb, "u1", cursor=cursor)) == paths[len(done):]
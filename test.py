@@ -1,7 +1,14 @@
 import os
 import json
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from google import genai
 from google.cloud import firestore
+from RelationAI.structured_output import enum_field, parse_structured, schema_config
+from RelationAI.chat_archive import load_messages
+from RelationAI.relation_graph import record_mentions, read_graph, tracked_names
+from RelationAI.relation_gate import GateCache, names_from_profile
+from RelationAI.relation_scores import record_interaction
 
 from flask import Flask, request, jsonify
 app = Flask(__name__)
@@ -19,7 +26,7 @@ def chat():
 @app.route("/relation_map", methods=["GET"])
 def relation_map():
     user_id = request.args.get("user_id")
-    return jsonify(get_relation_graph(user_id))
+    return jsonify(get_relation_graph(user_id, request.args.get("since", type=int)))
 
 
 # ------------------ CONFIG ------------------
@@ -40,6 +47,9 @@ client = genai.Client(
 
 db = firestore.Client(project=PROJECT_ID)
 
+# Skips the extraction call for messages that mention nobody (see RelationAI/relation_gate.py)
+relation_gates = GateCache()
+
 # ------------------ Onboarding Questions ------------------
 ONBOARDING_QUESTIONS_FULL = [
     "What’s your name (or nickname you’d like me to use)?",
@@ -86,15 +96,14 @@ def save_chat_message(user_id, role, text):
     })
 
 def load_history(user_id):
-    chats_ref = db.collection("users").document(user_id).collection("chats").order_by("ts")
-    docs = chats_ref.stream()
+    # includes messages compacted into chat_chunks
     return [
         {
             "role": d.get("role"),
             "text": d.get("text"),
             "ts": d.get("ts").isoformat() if hasattr(d.get("ts"), "isoformat") else str(d.get("ts"))
         }
-        for d in (doc.to_dict() for doc in docs)
+        for d in load_messages(db, user_id)
     ]
 
 # ------------------ Onboarding Helper ------------------
@@ -155,66 +164,66 @@ def run_onboarding(user_id, profile_data):
     return profile_data
 
 # ------------------ Relations ------------------
+@dataclass
+class RelationMention:
+    name: str = ""
+    sentiment: str = enum_field("positive", "negative", "neutral", default="neutral")
+
+
 def update_relations(user_id, user_message):
+    try:
+        gate = relation_gates.get(user_id)
+        if gate is None:
+            names = tracked_names(db, user_id, source="relations") + names_from_profile(get_user_profile(user_id) or {})
+            gate = relation_gates.put(user_id, names)
+        if not relation_gates.check(gate, user_message):
+            return
+    except Exception as e:
+        print(f"Relation gate error, extracting anyway: {e}")  # fail open
+
     analysis_prompt = f"""
     Identify if the user is referring to another person in this message.
 
     Extract:
-    - person's name (as the user says it, no assumptions)
+    - person's name (as the user says it, no assumptions; empty if nobody is mentioned)
     - relationship sentiment (choose ONLY one: "positive", "negative", "neutral")
 
-    Return JSON only. Example:
-    {"name": "Riya", "sentiment": "positive"}
-
     Message: {user_message}
     """
 
     try:
-        resp = client.models.generate_content(model=MODEL, contents=analysis_prompt)
+        resp = client.models.generate_content(
+            model=MODEL, contents=analysis_prompt, config=schema_config(RelationMention, 64, thinking_budget=0))
         raw = resp.candidates[0].content.parts[0].text.strip()
-
-        # Ensure JSON valid even if model adds formatting
-        data = json.loads(raw)
-
-        if not data.get("name"):
-            return  # No person found
-
     except Exception:
         return
 
+    mention = parse_structured("update_relations", raw, RelationMention)
+    if mention is None or not mention.name.strip():
+        return  # No person found
+    data = {"name": mention.name.strip(), "sentiment": mention.sentiment}
+    relation_gates.remember(user_id, [data["name"]])
+
+    # Graph first: a user's first update backfills it from the relations collection.
+    # A graph failure must not cost the relation write below.
+    try:
+        record_mentions(db, user_id, [(data["name"], data["sentiment"])], source="relations")
+    except Exception as e:
+        print(f"Relation graph update error: {e}")
+
     relations_ref = db.collection("users").document(user_id).collection("relations").document(data["name"])
-    doc = relations_ref.get()
-
-    # If exists, update. Else create new.
-    if doc.exists:
-        old = doc.to_dict()
-        relations_ref.update({
-            "sentiment": data.get("sentiment", old.get("sentiment")),
-            "times_mentioned": old.get("times_mentioned", 0) + 1,
-            "last_mentioned": datetime.now(timezone.utc).isoformat()
-        })
-    else:
-        relations_ref.set({
-            "name": data["name"],
-            "sentiment": data["sentiment"],
-            "times_mentioned": 1,
-            "last_mentioned": datetime.now(timezone.utc).isoformat()
-        })
-def get_relation_graph(user_id):
-    docs = db.collection("users").document(user_id).collection("relations").stream()
-    nodes = []
-    edges = []
-
-    # Add center node
-    nodes.append({"id": "user", "label": "You", "color": "#3B82F6"})  # Blue
-
-    for doc in docs:
-        d = doc.to_dict()
-        color = "#22C55E" if d["sentiment"] == "positive" else "#EF4444" if d["sentiment"] == "negative" else "#FACC15"
-        nodes.append({"id": d["name"], "label": d["name"], "color": color})
-        edges.append({"source": "user", "target": d["name"]})
-
-    return {"nodes": nodes, "edges": edges}
+
+    # One transaction creates or updates the doc, including the smoothed scores (relation_scores.py)
+    record_interaction(db, relations_ref, data["sentiment"], {
+        "name": data["name"],
+        "sentiment": data["sentiment"],
+        "times_mentioned": firestore.Increment(1),
+        "last_mentioned": datetime.now(timezone.utc).isoformat()
+    })
+
+def get_relation_graph(user_id, since=None):
+    """Materialized graph (RelationAI/relation_graph.py): one read, weighted edges, delta with since=<version>."""
+    return read_graph(db, user_id, since, source="relations")
 
 # ------------------ Memory Summarization ------------------
 def summarize_memory(history):
@@ -249,7 +258,7 @@ def build_prompt(memory_summary, history, profile):
     parts = [system_instructions]
 
     if profile:
-        parts.append("User profile:\n" + json.dumps(profile, indent=2) + "\n")
+        parts.append("User profile:\n" + json.dumps(profile, indent=2, default=str) + "\n")
     if memory_summary:
         parts.append("Memory summary:\n" + memory_summary + "\n")
 